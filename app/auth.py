@@ -1,13 +1,33 @@
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 
 load_dotenv()  # take environment variables from .env
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor. Hashes made with any other cost are flagged by
+# needs_update and transparently re-hashed on the next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads dedicated to bcrypt, and hash/verify calls admitted at once
+# (running or queued); past that callers are turned away with a 429
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "2"))
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", "16"))
+# Verified tokens remembered by decode_access_token (0 disables the cache)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "2048"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 SECRET_KEY = os.getenv("SECRET_KEY", "default-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
@@ -21,23 +41,186 @@ def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
 
+class HashingOverloaded(Exception):
+    """Raised when the password hasher's queue is full."""
+
+
+class PasswordHasher:
+    """Run bcrypt on a small dedicated thread pool.
+
+    bcrypt is deliberately slow (~250ms at cost 12), so it is kept off the
+    request threads. At most ``max_pending`` calls are admitted at once;
+    beyond that HashingOverloaded is raised immediately so a login burst
+    or brute-force attempt is shed instead of queueing without bound.
+    Latency (queue wait + hashing) is tracked per operation name.
+    """
+
+    def __init__(self, workers: int = BCRYPT_WORKERS,
+                 max_pending: int = BCRYPT_MAX_PENDING,
+                 context: CryptContext = pwd_context):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.context = context
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bcrypt"
+        )
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.rejected = 0
+        self.rehashed = 0
+        # op -> [calls, total seconds, max seconds]
+        self._latency = {}
+
+    def _run(self, op: str, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingOverloaded("Too many password operations in progress")
+            self._pending += 1
+        started = time.perf_counter()
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._pending -= 1
+                calls = self._latency.setdefault(op, [0, 0.0, 0.0])
+                calls[0] += 1
+                calls[1] += elapsed
+                calls[2] = max(calls[2], elapsed)
+
+    def hash(self, password: str, op: str = "hash") -> str:
+        return self._run(op, self.context.hash, password)
+
+    def verify(self, password: str, hashed: str, op: str = "verify") -> bool:
+        return self._run(op, self.context.verify, password, hashed)
+
+    def verify_and_update(self, password: str, hashed: str,
+                          op: str = "verify") -> Tuple[bool, Optional[str]]:
+        """Verify, also returning a new hash if ``hashed`` uses another cost."""
+        ok, new_hash = self._run(op, self.context.verify_and_update, password, hashed)
+        if new_hash:
+            with self._lock:
+                self.rehashed += 1
+        return ok, new_hash
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                "rounds": BCRYPT_ROUNDS,
+                "operations": {
+                    op: {
+                        "calls": calls,
+                        "avg_ms": round(total / calls * 1000, 3),
+                        "max_ms": round(peak * 1000, 3),
+                    }
+                    for op, (calls, total, peak) in self._latency.items()
+                },
+            }
+
+
+password_hasher = PasswordHasher()
+
+
 def create_access_token(
     data: dict, expires_delta: Optional[timedelta] = None
 ):
     to_encode = data.copy()
-    expire = datetime.utcnow() + (
+    issued = datetime.utcnow()
+    expire = issued + (
         expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
-    to_encode.update({"exp": expire})
+    # iat keys the principal cache, so each login resolves the account anew
+    to_encode.update({"exp": expire, "iat": issued})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+class VerifiedTokenCache:
+    """Recently verified JWT payloads, keyed by the token's SHA-256.
+
+    A dashboard sends the same bearer token with every request, so after
+    the first full signature check the payload is served from here until
+    the token's own ``exp`` passes. Entries are LRU-bounded; revoke()
+    drops every cached token of a subject (e.g. a deleted admin).
+    """
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # sha256 -> (payload, exp timestamp)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revoked = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.time() < entry[1]:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(entry[0])
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def put(self, token: str, payload: Dict[str, Any]):
+        exp = payload.get("exp")
+        if self.max_entries <= 0 or not isinstance(exp, (int, float)):
+            return
+        with self._lock:
+            self._entries[self._key(token)] = (dict(payload), exp)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def revoke(self, subject: str) -> int:
+        """Drop every cached token whose ``sub`` is ``subject``."""
+        with self._lock:
+            keys = [k for k, (payload, _) in self._entries.items()
+                    if payload.get("sub") == subject]
+            for key in keys:
+                del self._entries[key]
+            self.revoked += len(keys)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "revoked": self.revoked,
+            }
+
+
+token_cache = VerifiedTokenCache()
+
+
 def decode_access_token(token: str) -> Optional[Dict[str, Any]]:
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         return None
+    token_cache.put(token, payload)
+    return payload
 
 
 def verify_token(token: str) -> Optional[Dict[str, Any]]:
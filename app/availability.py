@@ -0,0 +1,304 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from .database import (
+    TIME_SLOTS, SLOT_CAPACITY, shard_db, week_db_path
+)
+from .shards import map_shards
+
+OCCUPANCY_CACHE_DATES = int(os.getenv("OCCUPANCY_CACHE_DATES", "4096"))
+# Largest number of dates one bulk availability request may ask for
+MAX_BULK_DATES = int(os.getenv("MAX_BULK_DATES", "366"))
+# Seconds browsers/CDN may reuse an availability response before revalidating
+AVAILABILITY_MAX_AGE = int(os.getenv("AVAILABILITY_MAX_AGE", "0"))
+
+
+def slot_status(count: int) -> str:
+    """Map a slot's booked count to the status shown on the calendar."""
+    if count <= 0:
+        return "available"
+    if count < SLOT_CAPACITY:
+        return "waiting"
+    return "booked"
+
+
+Tag = Tuple[str, int]
+
+
+def read_tag(conn) -> Optional[Tag]:
+    """The shard's (epoch, version), bumped by triggers on every occupancy change."""
+    row = conn.execute(
+        "SELECT epoch, version FROM shard_version WHERE id = 1"
+    ).fetchone()
+    return (row["epoch"], row["version"]) if row else None
+
+
+def _supersedes(tag: Tag, other: Tag) -> bool:
+    return tag[0] == other[0] and tag[1] >= other[1]
+
+
+class OccupancyCache:
+    """Process-wide booked counts per (date, time_slot).
+
+    A shard's cached dates are all valid at one shard_version tag. Readers
+    compare it with the live tag (one primary-key read) and reload on a
+    mismatch, so writes from other processes show up on the next request.
+    Writes in this process call ``record`` with the tags read inside their
+    transaction; one that does not follow on from the cached tag drops the
+    shard rather than overwriting newer counts. LRU-bounded by date.
+    """
+
+    def __init__(self, max_dates: int = OCCUPANCY_CACHE_DATES):
+        self.max_dates = max_dates
+        self._lock = threading.Lock()
+        # date -> (shard path, counts); shard path -> (tag, cached dates)
+        self._dates: "OrderedDict[str, Tuple[str, Dict[str, int]]]" = OrderedDict()
+        self._shards: Dict[str, Tuple[Tag, set]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, db_path: str, dates: List[str],
+               tag: Tag) -> Optional[Dict[str, Dict[str, int]]]:
+        """Counts for ``dates`` of one shard if all are cached at ``tag``."""
+        with self._lock:
+            entry = self._shards.get(db_path)
+            if entry is None or entry[0] != tag or not entry[1].issuperset(dates):
+                self.misses += len(dates)
+                return None
+            for date in dates:
+                self._dates.move_to_end(date)
+            self.hits += len(dates)
+            return {date: dict(self._dates[date][1]) for date in dates}
+
+    def put(self, db_path: str, counts: Dict[str, Dict[str, int]], tag: Tag):
+        """Store dates of one shard freshly loaded at ``tag``."""
+        with self._lock:
+            entry = self._shards.get(db_path)
+            if entry is not None and entry[0] != tag:
+                if _supersedes(entry[0], tag):
+                    return
+                self._drop(db_path)
+                entry = None
+            if entry is None:
+                entry = self._shards[db_path] = (tag, set())
+            for date, date_counts in counts.items():
+                self._dates[date] = (db_path, dict(date_counts))
+                self._dates.move_to_end(date)
+                entry[1].add(date)
+            while len(self._dates) > self.max_dates:
+                date, (path, _) = self._dates.popitem(last=False)
+                self._shards[path][1].discard(date)
+
+    def record(self, date: str, time_slot: str, count: int,
+               before: Tag, after: Tag):
+        """Apply a committed write that moved the shard from ``before`` to ``after``."""
+        db_path = week_db_path(date)
+        with self._lock:
+            entry = self._shards.get(db_path)
+            if entry is None:
+                return
+            if before is not None and entry[0] == before:
+                self._shards[db_path] = (after, entry[1])
+                if date in entry[1]:
+                    self._dates[date][1][time_slot] = count
+            elif after is None or not _supersedes(entry[0], after):
+                self._drop(db_path)
+
+    def _drop(self, db_path: str):
+        _, dates = self._shards.pop(db_path)
+        for date in dates:
+            del self._dates[date]
+
+    def invalidate(self, date: Optional[str] = None):
+        with self._lock:
+            if date is None:
+                self._dates.clear()
+                self._shards.clear()
+            elif date in self._dates:
+                path, _ = self._dates.pop(date)
+                self._shards[path][1].discard(date)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "dates": len(self._dates),
+                "shards": len(self._shards),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+occupancy_cache = OccupancyCache()
+
+
+def shard_tag(db_path: str) -> Optional[Tag]:
+    """Live tag of a shard file, or None if nobody has booked that week yet."""
+    if not os.path.exists(db_path):
+        return None
+    with shard_db(db_path) as conn:
+        return read_tag(conn)
+
+
+def _load_shard(db_path: str, dates: List[str]):
+    """Counts for ``dates`` and the tag they were read at, in one snapshot."""
+    counts = {date: {} for date in dates}
+    # A week nobody has booked yet has no file; don't create one to read it
+    if not os.path.exists(db_path):
+        return None, counts
+    placeholders = ", ".join("?" for _ in dates)
+    # One statement, so the counts and the version come from the same snapshot
+    with shard_db(db_path) as conn:
+        rows = conn.execute(
+            f"SELECT v.epoch, v.version, s.date, s.time_slot, s.booked "
+            f"FROM shard_version v LEFT JOIN slot_counts s "
+            f"ON s.date IN ({placeholders}) WHERE v.id = 1",
+            dates
+        ).fetchall()
+    tag = (rows[0]["epoch"], rows[0]["version"]) if rows else None
+    for row in rows:
+        if row["date"] is not None:
+            counts[row["date"]][row["time_slot"]] = row["booked"]
+    return tag, counts
+
+
+def _check_dates(dates: List[str]):
+    invalid = invalid_dates(dates)
+    if invalid:
+        raise ValueError(f"invalid dates: {', '.join(map(str, invalid))}")
+
+
+def _by_shard(dates: List[str]):
+    _check_dates(dates)
+    by_shard = defaultdict(list)
+    for date in dict.fromkeys(dates):
+        by_shard[week_db_path(date)].append(date)
+    return by_shard
+
+
+def live_tags(dates: List[str]) -> Dict[str, Optional[Tag]]:
+    """Current tag of every shard involved in ``dates``, read concurrently."""
+    paths = list(_by_shard(dates))
+    return dict(zip(paths, map_shards(shard_tag, paths)))
+
+
+def occupancy(dates: List[str], tags: Optional[Dict[str, Optional[Tag]]] = None):
+    """Booked counts per date, and the shard tag each shard was served at.
+
+    Dates are grouped by weekly shard. A shard whose cached dates match
+    its live tag (``tags``, read here if not given) is served from
+    memory; the rest are loaded with one ``date IN (...)`` query per
+    shard, with the shards queried concurrently, and report the tag of
+    that snapshot. Raises ValueError if any date is not YYYY-MM-DD.
+    """
+    by_shard = _by_shard(dates)
+    counts = {}
+    tags = dict(tags) if tags is not None else live_tags(dates)
+    missing = []
+    for path, shard_dates in by_shard.items():
+        cached = None
+        if tags[path] is not None:
+            cached = occupancy_cache.lookup(path, shard_dates, tags[path])
+        if cached is not None:
+            counts.update(cached)
+        elif tags[path] is None:
+            counts.update({date: {} for date in shard_dates})
+        else:
+            missing.append((path, shard_dates))
+    loaded = map_shards(lambda item: _load_shard(*item), missing)
+    for (path, _), (tag, shard_counts) in zip(missing, loaded):
+        if tag is not None:
+            occupancy_cache.put(path, shard_counts, tag)
+        tags[path] = tag
+        counts.update(shard_counts)
+    return counts, tags
+
+
+def slot_counts(date: str) -> Dict[str, int]:
+    """Booked count per time slot for ``date``, served from the cache."""
+    return occupancy([date])[0][date]
+
+
+def availability_for(date: str, include_count: bool = False) -> dict:
+    """Calendar payload for one date: ``{slot: {"status": ...}}``."""
+    counts = slot_counts(date)
+    result = {}
+    for slot in TIME_SLOTS:
+        count = counts.get(slot, 0)
+        result[slot] = {"status": slot_status(count)}
+        if include_count:
+            result[slot]["count"] = count
+    return result
+
+
+def slot_statuses(counts: Dict[str, int]) -> dict:
+    """Calendar payload for one date's booked counts."""
+    return {
+        slot: {"status": slot_status(counts.get(slot, 0))}
+        for slot in TIME_SLOTS
+    }
+
+
+def invalid_dates(dates: List[str]) -> List[str]:
+    """The entries of ``dates`` that are not real YYYY-MM-DD dates."""
+    invalid = []
+    for date in dict.fromkeys(dates):
+        try:
+            valid = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d") == date
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            invalid.append(date)
+    return invalid
+
+
+def date_range(start: str, end: str) -> List[str]:
+    """Every date from ``start`` to ``end`` inclusive, as YYYY-MM-DD."""
+    first = datetime.strptime(start, "%Y-%m-%d").date()
+    last = datetime.strptime(end, "%Y-%m-%d").date()
+    if last < first:
+        raise ValueError("end date is before start date")
+    days = (last - first).days + 1
+    if days > MAX_BULK_DATES:
+        raise ValueError(f"at most {MAX_BULK_DATES} dates per request")
+    return [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+
+
+def _format_tag(tag: Optional[Tag]) -> str:
+    return f"{tag[0]}.{tag[1]}" if tag else "0"
+
+
+def availability_etag(dates: List[str], tags: Dict[str, Optional[Tag]]) -> str:
+    """Strong ETag for the availability of ``dates`` served at ``tags``.
+
+    Built from the tag of each involved shard, which the shard's triggers
+    bump on every change to slot occupancy. Pass the tags returned by
+    ``occupancy`` so the ETag describes exactly the payload it is sent
+    with, or ``live_tags`` to revalidate without building the payload.
+    """
+    digest = hashlib.sha1(f"{SLOT_CAPACITY}|{','.join(TIME_SLOTS)}".encode())
+    _check_dates(dates)
+    for date in dates:
+        path = week_db_path(date)
+        digest.update(f"|{date}={os.path.basename(path)}:{_format_tag(tags.get(path))}".encode())
+    return f'"{digest.hexdigest()[:20]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header value matches ``etag``."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={AVAILABILITY_MAX_AGE}, must-revalidate",
+    }
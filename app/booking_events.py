@@ -0,0 +1,33 @@
+"""Propagate committed booking writes to the derived stores.
+
+Called after the shard transaction commits, on the same DB thread. A
+failing store is logged rather than failing the booking; its rebuild
+script brings it back in line.
+"""
+import logging
+
+from . import customer_analytics, customers, deposit_tasks, email_index, kpis
+
+logger = logging.getLogger("booking")
+
+
+def _apply(store: str, fn, booking: dict):
+    try:
+        fn(booking)
+    except Exception as e:
+        logger.error(f"Failed to update {store} for booking {booking.get('id')}: {e}")
+
+
+def booking_created(booking: dict):
+    _apply("email index", email_index.record_booking, booking)
+    _apply("customers", customers.record_booking, booking)
+    _apply("customer rollups", customer_analytics.record_booking, booking)
+    _apply("kpi counters", kpis.record_booking, booking)
+    _apply("deposit deadlines", deposit_tasks.record_booking, booking)
+
+
+def booking_cancelled(booking: dict):
+    _apply("email index", email_index.remove_booking, booking)
+    _apply("customers", customers.remove_booking, booking)
+    _apply("customer rollups", customer_analytics.remove_booking, booking)
+    _apply("kpi counters", kpis.remove_booking, booking)
@@ -0,0 +1,213 @@
+import logging
+import os
+from collections import Counter
+from datetime import date as dt_date, datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from .database import get_db
+from .shards import query_shards
+
+logger = logging.getLogger("booking")
+
+# Days of per-day detail kept; older activity is only kept per month
+ROLLUP_DAILY_RETENTION_DAYS = int(os.getenv("ROLLUP_DAILY_RETENTION_DAYS", "400"))
+RETENTION_WINDOW_DAYS = 90
+
+_ROLLUPS = (("customer_daily", "day", 10), ("customer_monthly", "month", 7))
+
+
+def _today() -> dt_date:
+    return datetime.now(ZoneInfo("America/Los_Angeles")).date()
+
+
+def _daily_cutoff(today: Optional[dt_date] = None) -> str:
+    """Oldest day still covered by customer_daily."""
+    today = today or _today()
+    return (today - timedelta(days=ROLLUP_DAILY_RETENTION_DAYS)).isoformat()
+
+
+def _bump(booking: dict, delta: int):
+    email, created_at = booking.get("email"), booking.get("created_at")
+    if not email or not created_at:
+        return
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for table, column, width in _ROLLUPS:
+            key = created_at[:width]
+            conn.execute(f"""
+                INSERT INTO {table} ({column}, email, bookings) VALUES (?, ?, ?)
+                ON CONFLICT ({column}, email)
+                DO UPDATE SET bookings = bookings + excluded.bookings
+            """, (key, email, delta))
+            conn.execute(
+                f"DELETE FROM {table} WHERE {column} = ? AND email = ? AND bookings <= 0",
+                (key, email)
+            )
+
+
+def record_booking(booking: dict):
+    """Count a new booking in the daily and monthly rollups."""
+    _bump(booking, 1)
+
+
+def remove_booking(booking: dict):
+    """Take a cancelled booking back out of the rollups."""
+    _bump(booking, -1)
+
+
+def compact_rollups(today: Optional[dt_date] = None) -> int:
+    """Nightly job: reconcile monthly rows and drop expired daily detail.
+
+    Months fully covered by customer_daily are re-derived from it (so the
+    two granularities cannot drift apart), then daily rows older than
+    ROLLUP_DAILY_RETENTION_DAYS are deleted. Returns rows deleted.
+    """
+    cutoff = _daily_cutoff(today)
+    cutoff_date = dt_date.fromisoformat(cutoff)
+    first_full_month = (
+        cutoff_date.replace(day=1) if cutoff_date.day == 1
+        else (cutoff_date.replace(day=28) + timedelta(days=4)).replace(day=1)
+    ).isoformat()
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "DELETE FROM customer_monthly WHERE month >= ?", (first_full_month[:7],)
+        )
+        conn.execute("""
+            INSERT INTO customer_monthly (month, email, bookings)
+            SELECT substr(day, 1, 7), email, SUM(bookings)
+            FROM customer_daily
+            WHERE day >= ?
+            GROUP BY substr(day, 1, 7), email
+        """, (first_full_month,))
+        deleted = conn.execute(
+            "DELETE FROM customer_daily WHERE day < ?", (cutoff,)
+        ).rowcount
+    logger.info(f"Compacted customer rollups: {deleted} daily rows before {cutoff} removed")
+    return deleted
+
+
+def rebuild_rollups() -> int:
+    """Recompute both rollups from every shard; returns bookings counted."""
+    daily, monthly = Counter(), Counter()
+    for booking in query_shards("SELECT email, created_at FROM bookings"):
+        if booking["email"] and booking["created_at"]:
+            daily[(booking["created_at"][:10], booking["email"])] += 1
+            monthly[(booking["created_at"][:7], booking["email"])] += 1
+    cutoff = _daily_cutoff()
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM customer_daily")
+        conn.execute("DELETE FROM customer_monthly")
+        conn.executemany(
+            "INSERT INTO customer_daily (day, email, bookings) VALUES (?, ?, ?)",
+            [(day, email, n) for (day, email), n in daily.items() if day >= cutoff]
+        )
+        conn.executemany(
+            "INSERT INTO customer_monthly (month, email, bookings) VALUES (?, ?, ?)",
+            [(month, email, n) for (month, email), n in monthly.items()]
+        )
+    return sum(daily.values())
+
+
+def window_stats(conn, start: str, end: str) -> dict:
+    """Activity between ``start`` and ``end`` (YYYY-MM-DD, inclusive).
+
+    Served from customer_daily while the window lies within its retention,
+    otherwise from customer_monthly with the window widened to whole months.
+    """
+    if start >= _daily_cutoff():
+        table, column, lo, hi, granularity = "customer_daily", "day", start, end, "day"
+    else:
+        table, column, granularity = "customer_monthly", "month", "month"
+        lo, hi = start[:7], end[:7]
+        start = f"{lo}-01"
+        end_date = dt_date.fromisoformat(f"{hi}-01")
+        end = ((end_date.replace(day=28) + timedelta(days=4)).replace(day=1)
+               - timedelta(days=1)).isoformat()
+    bookings, active = conn.execute(f"""
+        SELECT COALESCE(SUM(bookings), 0), COUNT(DISTINCT email)
+        FROM {table} WHERE {column} BETWEEN ? AND ?
+    """, (lo, hi)).fetchone()
+    returning = conn.execute(f"""
+        SELECT COUNT(DISTINCT r.email)
+        FROM {table} r JOIN customers c ON c.email = r.email
+        WHERE r.{column} BETWEEN ? AND ? AND c.first_created_at < ?
+    """, (lo, hi, start)).fetchone()[0]
+    next_day = (dt_date.fromisoformat(end) + timedelta(days=1)).isoformat()
+    new_customers = conn.execute("""
+        SELECT COUNT(*) FROM customers
+        WHERE first_created_at >= ? AND first_created_at < ?
+    """, (start, next_day)).fetchone()[0]
+    return {
+        "start": start,
+        "end": end,
+        "granularity": granularity,
+        "bookings": bookings,
+        "active_customers": active,
+        "new_customers": new_customers,
+        "returning_customers": returning,
+        "retention_rate": round(returning / active * 100, 2) if active else 0.0,
+    }
+
+
+def customer_analytics(start: Optional[str] = None,
+                       end: Optional[str] = None) -> dict:
+    """Customer analytics from the aggregate and rollup tables."""
+    today = _today()
+    with get_db() as conn:
+        total, returning = conn.execute("""
+            SELECT COUNT(*), COALESCE(SUM(total_bookings > 1), 0) FROM customers
+        """).fetchone()
+        tiers = {tier: 0 for tier in ("VIP", "Premium", "Regular", "New")}
+        for row in conn.execute(
+            "SELECT customer_tier, COUNT(*) FROM customers GROUP BY customer_tier"
+        ):
+            tiers[row[0]] = row[1]
+        top_customers = [
+            {
+                "name": row["name"],
+                "email": row["email"],
+                "total_bookings": row["total_bookings"],
+                "total_spent": row["total_spent"],
+                "first_booking": row["first_created_at"],
+                "last_booking": row["last_created_at"],
+                "customer_tier": row["customer_tier"],
+            }
+            for row in conn.execute("""
+                SELECT * FROM customers
+                ORDER BY total_bookings DESC, email DESC LIMIT 10
+            """)
+        ]
+        this_month = window_stats(conn, today.replace(day=1).isoformat(), today.isoformat())
+        trailing = window_stats(
+            conn,
+            (today - timedelta(days=RETENTION_WINDOW_DAYS - 1)).isoformat(),
+            today.isoformat()
+        )
+        window = window_stats(conn, start, end) if start and end else None
+
+    analytics = {
+        "total_customers": total,
+        "new_customers_this_month": this_month["new_customers"],
+        "returning_customers": returning,
+        "customer_tiers": tiers,
+        "top_customers": top_customers,
+        "booking_patterns": {},
+        "retention_rate": (returning / total) * 100 if total else 0.0,
+        "retention_rate_90d": trailing["retention_rate"],
+    }
+    if window:
+        analytics["window"] = window
+    return analytics
+
+
+def backfill_rollups():
+    """Build the rollups on first start after the upgrade."""
+    with get_db() as conn:
+        has_rollups = conn.execute("SELECT 1 FROM customer_monthly LIMIT 1").fetchone()
+        has_customers = conn.execute("SELECT 1 FROM customers LIMIT 1").fetchone()
+    if has_rollups or not has_customers:
+        return
+    logger.info(f"Backfilled customer rollups from {rebuild_rollups()} bookings")
@@ -0,0 +1,235 @@
+import json
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, List, Optional
+from zoneinfo import ZoneInfo
+
+from .database import get_db
+from .email_index import shards_for_email
+from .shards import count_shards, query_shards
+
+logger = logging.getLogger("booking")
+
+# Flat price per booking used for the "total spent" figures
+BOOKING_PRICE = 55.0
+
+# Columns /admin/customers may be sorted by
+CUSTOMER_SORT_COLUMNS = {
+    "total_bookings": "total_bookings",
+    "total_spent": "total_spent",
+    "last_booking_date": "last_booking_date",
+    "first_booking_date": "first_booking_date",
+    "name": "name COLLATE NOCASE",
+}
+
+INFO_FIELDS = ("name", "phone", "address", "city", "zipcode", "contact_preference")
+
+
+def customer_tier(total_bookings: int) -> str:
+    if total_bookings >= 10:
+        return "VIP"
+    if total_bookings >= 5:
+        return "Premium"
+    if total_bookings >= 2:
+        return "Regular"
+    return "New"
+
+
+def _now() -> str:
+    return datetime.now(ZoneInfo("America/Los_Angeles")).isoformat()
+
+
+def _aggregate(email: str, bookings: Iterable[dict]) -> Optional[dict]:
+    """Build a customers row from every booking of one customer."""
+    bookings = list(bookings)
+    if not bookings:
+        return None
+    latest = max(bookings, key=lambda b: b.get("created_at") or "")
+    dates = [b["date"] for b in bookings if b.get("date")]
+    created = [b["created_at"] for b in bookings if b.get("created_at")]
+    row = {field: latest.get(field) for field in INFO_FIELDS}
+    row.update({
+        "email": email,
+        "info_created_at": latest.get("created_at"),
+        "first_booking_date": min(dates) if dates else None,
+        "last_booking_date": max(dates) if dates else None,
+        "first_created_at": min(created) if created else None,
+        "last_created_at": max(created) if created else None,
+        "total_bookings": len(bookings),
+        "total_spent": BOOKING_PRICE * len(bookings),
+        "slot_histogram": dict(Counter(b.get("time_slot") for b in bookings)),
+        "customer_tier": customer_tier(len(bookings)),
+    })
+    return row
+
+
+def _write(conn, row: dict):
+    row = dict(row, slot_histogram=json.dumps(row["slot_histogram"]),
+               updated_at=_now())
+    columns = ", ".join(row)
+    conn.execute(
+        f"INSERT OR REPLACE INTO customers ({columns}) "
+        f"VALUES ({', '.join('?' for _ in row)})",
+        tuple(row.values())
+    )
+
+
+def _read(conn, email: str) -> Optional[dict]:
+    row = conn.execute(
+        "SELECT * FROM customers WHERE email = ?", (email,)
+    ).fetchone()
+    if row is None:
+        return None
+    row = dict(row)
+    row["slot_histogram"] = json.loads(row["slot_histogram"] or "{}")
+    return row
+
+
+def _customer_bookings(email: str) -> List[dict]:
+    return query_shards(
+        "SELECT name, phone, address, city, zipcode, contact_preference, "
+        "date, time_slot, created_at FROM bookings WHERE email = ?",
+        (email,),
+        shards=shards_for_email(email)
+    )
+
+
+def record_booking(booking: dict):
+    """Fold a newly created booking into its customer's aggregate."""
+    email = booking.get("email")
+    if not email:
+        return
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = _read(conn, email)
+        if row is None:
+            row = _aggregate(email, [booking])
+        else:
+            created_at = booking.get("created_at") or ""
+            if created_at >= (row["info_created_at"] or ""):
+                row.update({field: booking.get(field) for field in INFO_FIELDS})
+                row["info_created_at"] = created_at
+            date = booking.get("date")
+            if date:
+                row["first_booking_date"] = min(filter(None, (row["first_booking_date"], date)))
+                row["last_booking_date"] = max(filter(None, (row["last_booking_date"], date)))
+            if created_at:
+                row["first_created_at"] = min(filter(None, (row["first_created_at"], created_at)))
+                row["last_created_at"] = max(filter(None, (row["last_created_at"], created_at)))
+            slot = booking.get("time_slot")
+            row["slot_histogram"][slot] = row["slot_histogram"].get(slot, 0) + 1
+            row["total_bookings"] += 1
+            row["total_spent"] = BOOKING_PRICE * row["total_bookings"]
+            row["customer_tier"] = customer_tier(row["total_bookings"])
+        _write(conn, row)
+
+
+def remove_booking(booking: dict):
+    """Take a cancelled booking out of its customer's aggregate.
+
+    Counts are decremented in place; only when the booking defined one of
+    the customer's boundaries (first/last date, latest contact info) are
+    the remaining bookings of that customer re-read from the shards.
+    """
+    email = booking.get("email")
+    if not email:
+        return
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = _read(conn, email)
+        if row is None:
+            return
+        boundaries = (
+            row["first_booking_date"], row["last_booking_date"],
+            row["first_created_at"], row["last_created_at"],
+            row["info_created_at"],
+        )
+        if row["total_bookings"] <= 1:
+            conn.execute("DELETE FROM customers WHERE email = ?", (email,))
+            return
+        if booking.get("date") in boundaries or booking.get("created_at") in boundaries:
+            row = _aggregate(email, _customer_bookings(email))
+            if row is None:
+                conn.execute("DELETE FROM customers WHERE email = ?", (email,))
+                return
+        else:
+            slot = booking.get("time_slot")
+            remaining = row["slot_histogram"].get(slot, 0) - 1
+            if remaining > 0:
+                row["slot_histogram"][slot] = remaining
+            else:
+                row["slot_histogram"].pop(slot, None)
+            row["total_bookings"] -= 1
+            row["total_spent"] = BOOKING_PRICE * row["total_bookings"]
+            row["customer_tier"] = customer_tier(row["total_bookings"])
+        _write(conn, row)
+
+
+def rebuild_customers() -> int:
+    """Recompute the customers table from every shard; returns row count."""
+    by_email = {}
+    for booking in query_shards(
+        "SELECT email, name, phone, address, city, zipcode, "
+        "contact_preference, date, time_slot, created_at FROM bookings"
+    ):
+        if booking["email"]:
+            by_email.setdefault(booking["email"], []).append(booking)
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM customers")
+        for email, bookings in by_email.items():
+            _write(conn, _aggregate(email, bookings))
+    return len(by_email)
+
+
+def backfill_customers():
+    """Build the customers table on first start after the upgrade."""
+    with get_db() as conn:
+        has_rows = conn.execute("SELECT 1 FROM customers LIMIT 1").fetchone()
+    if has_rows or not count_shards("SELECT COUNT(*) FROM bookings"):
+        return
+    logger.info(f"Backfilled {rebuild_customers()} customer aggregates")
+
+
+def customer_profile(row) -> dict:
+    """Shape a customers row like the /admin/customers entries."""
+    row = dict(row)
+    histogram = json.loads(row["slot_histogram"] or "{}")
+    favorites = sorted(histogram.items(), key=lambda x: x[1], reverse=True)[:3]
+    return {
+        "customer_info": {field: row[field] for field in ("name", "email") + INFO_FIELDS[1:]},
+        "total_bookings": row["total_bookings"],
+        "total_spent": row["total_spent"],
+        "last_booking_date": row["last_booking_date"],
+        "first_booking_date": row["first_booking_date"],
+        "favorite_time_slots": [slot for slot, _ in favorites],
+        "booking_status_counts": {
+            "confirmed": row["total_bookings"],
+            "pending": 0,
+            "cancelled": 0,
+        },
+        "customer_tier": row["customer_tier"],
+    }
+
+
+def list_customers(limit: Optional[int], offset: int = 0, sort: str = "total_bookings",
+                   descending: bool = True, tier: Optional[str] = None):
+    """One page of customer profiles (every profile if ``limit`` is None)
+    plus the total matching count."""
+    order = CUSTOMER_SORT_COLUMNS[sort]
+    direction = "DESC" if descending else "ASC"
+    where, params = "", []
+    if tier:
+        where, params = "WHERE customer_tier = ?", [tier]
+    with get_db() as conn:
+        total = conn.execute(
+            f"SELECT COUNT(*) FROM customers {where}", params
+        ).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT * FROM customers {where} "
+            f"ORDER BY {order} {direction}, email {direction} "
+            f"LIMIT ? OFFSET ?",
+            params + [-1 if limit is None else limit, offset]
+        ).fetchall()
+    return [customer_profile(row) for row in rows], total
@@ -1,51 +1,568 @@
+import atexit
+import functools
 import os
+import re
 import sqlite3
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 DB_DIR = os.path.join(os.path.dirname(__file__), '..', 'weekly_databases')
 os.makedirs(DB_DIR, exist_ok=True)
 
-def get_week_db(date_str: str):
+# Connection tuning for every pooled SQLite handle
+SQLITE_CACHE_KIB = int(os.getenv("SQLITE_CACHE_KIB", "8192"))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(64 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+# Idle connections kept per database file, and files kept open at once
+POOL_MAX_IDLE = int(os.getenv("DB_POOL_MAX_IDLE", "4"))
+POOL_MAX_FILES = int(os.getenv("DB_POOL_MAX_FILES", "32"))
+
+
+def open_connection(db_path: str) -> sqlite3.Connection:
+    """Open a tuned SQLite connection (WAL, synchronous=NORMAL, cache, mmap)."""
+    conn = sqlite3.connect(
+        db_path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KIB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def _file_identity(db_path: str):
+    try:
+        st = os.stat(db_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+class ConnectionPool:
+    """Process-wide pool of tuned SQLite connections, keyed by database file.
+
+    At most ``max_idle`` idle connections are kept per file and at most
+    ``max_files`` files keep idle connections at all; the least recently
+    used file is closed first. Connections are handed to one thread at a
+    time, so they are opened with ``check_same_thread=False``. If a file is
+    deleted or replaced on disk (restore, test cleanup) its idle
+    connections are discarded instead of being reused.
+    """
+
+    def __init__(self, max_idle: int = POOL_MAX_IDLE,
+                 max_files: int = POOL_MAX_FILES):
+        self.max_idle = max_idle
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        # path -> {"identity": (dev, ino), "idle": deque[Connection]}
+        self._files: "OrderedDict[str, dict]" = OrderedDict()
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+
+    def acquire(self, db_path: str, initializer=None) -> sqlite3.Connection:
+        """Check out a connection, opening (and initialising) one if needed."""
+        db_path = os.path.abspath(db_path)
+        identity = _file_identity(db_path)
+        stale = []
+        conn = None
+        with self._lock:
+            entry = self._files.get(db_path)
+            if entry is not None and entry["identity"] != identity:
+                stale.extend(entry["idle"])
+                del self._files[db_path]
+                entry = None
+            if entry is not None:
+                self._files.move_to_end(db_path)
+                if entry["idle"]:
+                    self.reused += 1
+                    conn = entry["idle"].pop()
+        self._close_all(stale)
+        if conn is not None:
+            return conn
+
+        conn = open_connection(db_path)
+        try:
+            if initializer is not None:
+                initializer(conn, db_path)
+        except Exception:
+            conn.close()
+            raise
+        with self._lock:
+            self.opened += 1
+            if db_path not in self._files:
+                self._files[db_path] = {
+                    "identity": _file_identity(db_path), "idle": deque()
+                }
+                evicted = []
+                while len(self._files) > self.max_files:
+                    _, old = self._files.popitem(last=False)
+                    evicted.extend(old["idle"])
+            else:
+                evicted = []
+        self._close_all(evicted)
+        return conn
+
+    def release(self, db_path: str, conn: sqlite3.Connection):
+        """Return a connection to the pool, closing it if the pool is full."""
+        db_path = os.path.abspath(db_path)
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            entry = self._files.get(db_path)
+            if entry is not None and len(entry["idle"]) < self.max_idle:
+                entry["idle"].append(conn)
+                return
+        self._close_all([conn])
+
+    @contextmanager
+    def connection(self, db_path: str, initializer=None):
+        """Yield a pooled connection; commit on success, roll back on error."""
+        conn = self.acquire(db_path, initializer)
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self.release(db_path, conn)
+
+    def close_all(self):
+        """Close every idle connection (used at shutdown and in tests)."""
+        with self._lock:
+            conns = [c for e in self._files.values() for c in e["idle"]]
+            self._files.clear()
+        self._close_all(conns)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "idle": sum(len(e["idle"]) for e in self._files.values()),
+                "opened": self.opened,
+                "reused": self.reused,
+                "closed": self.closed,
+            }
+
+    def _close_all(self, conns):
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        if conns:
+            with self._lock:
+                self.closed += len(conns)
+
+
+class SchemaRegistry:
+    """Remembers which database files already carry the current schema.
+
+    The schema version lives in each file as ``PRAGMA user_version``; the
+    registry caches it per path (and on-disk identity), so DDL only runs
+    the first time a file is seen below the target version, and later
+    connections to a known file skip even the pragma read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # path -> ((dev, ino), version)
+        self._ready = {}
+        self.migrations = 0
+
+    def ensure(self, conn: sqlite3.Connection, db_path: str, version: int,
+               migrate):
+        """Bring ``conn``'s file up to ``version`` with ``migrate(conn, old)``."""
+        db_path = os.path.abspath(db_path)
+        if self._ready.get(db_path) == (_file_identity(db_path), version):
+            return
+        with self._lock:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current < version:
+                # Re-check under a write lock: another worker may have won
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    current = conn.execute(
+                        "PRAGMA user_version"
+                    ).fetchone()[0]
+                    if current < version:
+                        migrate(conn, current)
+                        conn.execute(f"PRAGMA user_version = {int(version)}")
+                        self.migrations += 1
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+            self._ready[db_path] = (_file_identity(db_path), version)
+
+    def forget(self, db_path: str):
+        """Drop the cached state for ``db_path`` (e.g. after a restore)."""
+        with self._lock:
+            self._ready.pop(os.path.abspath(db_path), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"files": len(self._ready), "migrations": self.migrations}
+
+
+pool = ConnectionPool()
+schemas = SchemaRegistry()
+atexit.register(pool.close_all)
+
+WEEK_SCHEMA_VERSION = 8
+MAIN_SCHEMA_VERSION = 11
+MAIN_DB_PATH = "mh-bookings.db"
+
+# Bookable slots per day and how many bookings each slot accepts
+TIME_SLOTS = ['12:00 PM', '3:00 PM', '6:00 PM', '9:00 PM']
+SLOT_CAPACITY = int(os.getenv("SLOT_CAPACITY", "2"))
+SLOT_FULL_MESSAGE = "slot is fully booked"
+
+# Booking ids are shard_key * BOOKING_ID_SPAN + per-shard sequence
+BOOKING_ID_SPAN = 1_000_000
+SHARD_FILE_RE = re.compile(r"^bookings_(\d{4})-(\d{2})\.db$")
+
+
+def shard_key(date_str: str) -> int:
+    """Return the ISO year/week key (e.g. 202527) for ``date_str``."""
     date = datetime.strptime(date_str, "%Y-%m-%d")
     year, week, _ = date.isocalendar()
-    db_path = os.path.join(DB_DIR, f"bookings_{year}-{week:02d}.db")
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+    return year * 100 + week
+
+
+def shard_path(key: int) -> str:
+    """Return the weekly shard file for a ``shard_key``."""
+    year, week = divmod(key, 100)
+    return os.path.join(DB_DIR, f"bookings_{year}-{week:02d}.db")
+
+
+def week_db_path(date_str: str) -> str:
+    """Return the weekly shard file that holds bookings for ``date_str``."""
+    return shard_path(shard_key(date_str))
+
+
+def shard_id_base(db_path: str) -> Optional[int]:
+    """Return the first booking id reserved for a shard file, if it is one."""
+    match = SHARD_FILE_RE.match(os.path.basename(db_path))
+    if not match:
+        return None
+    year, week = int(match.group(1)), int(match.group(2))
+    return (year * 100 + week) * BOOKING_ID_SPAN
+
+
+def booking_db_path(booking_id: int) -> Optional[str]:
+    """Route a booking id to its shard file, or None if it has no shard.
+
+    Ids are ``shard_key * BOOKING_ID_SPAN + sequence``, so the owning
+    shard is known without opening any database.
+    """
+    key = booking_id // BOOKING_ID_SPAN
+    if booking_id <= 0 or key < 100:
+        return None
+    path = shard_path(key)
+    return path if os.path.exists(path) else None
+
+
+def migrate_week_schema(conn: sqlite3.Connection, from_version: int,
+                        db_path: Optional[str] = None):
+    """Upgrade a weekly shard from ``from_version`` to WEEK_SCHEMA_VERSION."""
     c = conn.cursor()
-    # Bookings table
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS bookings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            phone TEXT,
-            email TEXT,
-            address TEXT,
-            city TEXT,
-            zipcode TEXT,
-            date TEXT,
-            time_slot TEXT,
-            contact_preference TEXT,
-            created_at TEXT,
-            deposit_received INTEGER DEFAULT 0
-        )
-    """)
-    c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_date_time_slot ON bookings(date, time_slot)")
-    # Company Newsletter table
+    if from_version < 1:
+        # Bookings table
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS bookings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT,
+                phone TEXT,
+                email TEXT,
+                address TEXT,
+                city TEXT,
+                zipcode TEXT,
+                date TEXT,
+                time_slot TEXT,
+                contact_preference TEXT,
+                created_at TEXT,
+                deposit_received INTEGER DEFAULT 0
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_date_time_slot ON bookings(date, time_slot)")
+        # Company Newsletter table
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS company_newsletter (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT,
+                phone TEXT,
+                email TEXT NOT NULL UNIQUE,
+                address TEXT,
+                city TEXT,
+                zipcode TEXT,
+                last_activity_date TEXT,
+                source TEXT
+            )
+        """)
+    if from_version < 2:
+        # Booking ids become globally unique: shard key * BOOKING_ID_SPAN
+        # plus the per-shard sequence. Legacy rows are shifted into the
+        # shard's range and AUTOINCREMENT is seeded to continue from it.
+        base = shard_id_base(db_path) if db_path else None
+        if base is not None:
+            c.execute(
+                "UPDATE bookings SET id = id + ? WHERE id < ?",
+                (base, BOOKING_ID_SPAN)
+            )
+            c.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) "
+                "WHERE name = 'bookings'",
+                (base,)
+            )
+            c.execute("""
+                INSERT INTO sqlite_sequence (name, seq)
+                SELECT 'bookings', ?
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM sqlite_sequence WHERE name = 'bookings'
+                )
+            """, (base,))
+    if from_version < 3:
+        # Per-slot occupancy row; capacity is enforced with a guarded
+        # UPDATE ... WHERE booked < capacity (see app.reservations)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS slot_counts (
+                date TEXT NOT NULL,
+                time_slot TEXT NOT NULL,
+                booked INTEGER NOT NULL DEFAULT 0,
+                capacity INTEGER NOT NULL,
+                PRIMARY KEY (date, time_slot)
+            ) WITHOUT ROWID
+        """)
+        c.execute("""
+            INSERT OR IGNORE INTO slot_counts (date, time_slot, booked, capacity)
+            SELECT date, time_slot, COUNT(*), ?
+            FROM bookings
+            WHERE date IS NOT NULL AND time_slot IS NOT NULL
+            GROUP BY date, time_slot
+        """, (SLOT_CAPACITY,))
+    if from_version < 4:
+        # slot_counts becomes a materialized view of bookings kept exact by
+        # triggers; the BEFORE INSERT trigger enforces capacity in SQLite.
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_bookings_slot_check
+            BEFORE INSERT ON bookings
+            BEGIN
+                INSERT OR IGNORE INTO slot_counts (date, time_slot, booked, capacity)
+                VALUES (NEW.date, NEW.time_slot, 0, {int(SLOT_CAPACITY)});
+                SELECT RAISE(ABORT, '{SLOT_FULL_MESSAGE}')
+                FROM slot_counts
+                WHERE date = NEW.date AND time_slot = NEW.time_slot
+                  AND booked >= capacity;
+            END
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_bookings_slot_insert
+            AFTER INSERT ON bookings
+            BEGIN
+                UPDATE slot_counts SET booked = booked + 1
+                WHERE date = NEW.date AND time_slot = NEW.time_slot;
+            END
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_bookings_slot_delete
+            AFTER DELETE ON bookings
+            BEGIN
+                UPDATE slot_counts SET booked = MAX(booked - 1, 0)
+                WHERE date = OLD.date AND time_slot = OLD.time_slot;
+            END
+        """)
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_bookings_slot_move
+            AFTER UPDATE OF date, time_slot ON bookings
+            WHEN OLD.date IS NOT NEW.date OR OLD.time_slot IS NOT NEW.time_slot
+            BEGIN
+                UPDATE slot_counts SET booked = MAX(booked - 1, 0)
+                WHERE date = OLD.date AND time_slot = OLD.time_slot;
+                INSERT OR IGNORE INTO slot_counts (date, time_slot, booked, capacity)
+                VALUES (NEW.date, NEW.time_slot, 0, {int(SLOT_CAPACITY)});
+                UPDATE slot_counts SET booked = booked + 1
+                WHERE date = NEW.date AND time_slot = NEW.time_slot;
+            END
+        """)
+        rebuild_slot_counts(conn)
+    if from_version < 5:
+        # Single-row version counter bumped whenever availability in this
+        # shard changes; drives the availability ETags. The random epoch
+        # keeps tags unique if a shard file is ever recreated.
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS shard_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                epoch TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        c.execute("""
+            INSERT OR IGNORE INTO shard_version (id, epoch, version)
+            VALUES (1, lower(hex(randomblob(8))), 0)
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_slot_counts_version_update
+            AFTER UPDATE OF booked, capacity ON slot_counts
+            WHEN OLD.booked IS NOT NEW.booked OR OLD.capacity IS NOT NEW.capacity
+            BEGIN
+                UPDATE shard_version SET version = version + 1 WHERE id = 1;
+            END
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_slot_counts_version_insert
+            AFTER INSERT ON slot_counts
+            WHEN NEW.booked > 0
+            BEGIN
+                UPDATE shard_version SET version = version + 1 WHERE id = 1;
+            END
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_slot_counts_version_delete
+            AFTER DELETE ON slot_counts
+            BEGIN
+                UPDATE shard_version SET version = version + 1 WHERE id = 1;
+            END
+        """)
+    if from_version < 6:
+        # Per-customer lookups (customer drawer, profile autofill)
+        columns = {row[1] for row in c.execute("PRAGMA table_info(bookings)")}
+        if {"email", "created_at"} <= columns:
+            c.execute("CREATE INDEX IF NOT EXISTS idx_bookings_email_created ON bookings (email, created_at)")
+    if from_version < 7:
+        # Deposit deadlines swept by app.deposit_tasks (UTC, SQLite
+        # datetime format). Each column is cleared once its email is queued,
+        # so the partial indexes only ever hold outstanding unpaid rows.
+        columns = {row[1] for row in c.execute("PRAGMA table_info(bookings)")}
+        for column in ("reminder_due_at", "admin_notify_due_at"):
+            if column not in columns:
+                c.execute(f"ALTER TABLE bookings ADD COLUMN {column} TEXT")
+        if {"created_at", "deposit_received"} <= columns:
+            # Recent unpaid bookings whose in-memory jobs had not fired yet
+            c.execute("""
+                UPDATE bookings SET reminder_due_at = datetime(created_at, '+4 hours')
+                WHERE deposit_received = 0
+                  AND datetime(created_at, '+4 hours') > datetime('now')
+            """)
+            c.execute("""
+                UPDATE bookings SET admin_notify_due_at = datetime(created_at, '+6 hours')
+                WHERE deposit_received = 0
+                  AND datetime(created_at, '+6 hours') > datetime('now')
+            """)
+            c.execute("""
+                CREATE INDEX IF NOT EXISTS idx_bookings_reminder_due ON bookings (reminder_due_at)
+                WHERE deposit_received = 0 AND reminder_due_at IS NOT NULL
+            """)
+            c.execute("""
+                CREATE INDEX IF NOT EXISTS idx_bookings_admin_notify_due ON bookings (admin_notify_due_at)
+                WHERE deposit_received = 0 AND admin_notify_due_at IS NOT NULL
+            """)
+    if from_version < 8:
+        # Emails staged in the same transaction as the booking change that
+        # triggers them; app.outbox relays them into mh-bookings.db's
+        # email_outbox and deletes them, so the table is normally empty
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                dedupe_key TEXT NOT NULL UNIQUE,
+                created_at TEXT NOT NULL
+            )
+        """)
+
+
+def rebuild_slot_counts(conn: sqlite3.Connection) -> int:
+    """Recount slot_counts from bookings; returns how many rows changed.
+
+    Used by the schema migration and by scripts/repair_slot_counts.py to
+    backfill or repair a shard. Per-slot capacities are preserved.
+    """
+    c = conn.cursor()
+    before = {
+        (row[0], row[1]): row[2]
+        for row in c.execute("SELECT date, time_slot, booked FROM slot_counts")
+    }
+    c.execute("UPDATE slot_counts SET booked = 0")
     c.execute("""
-        CREATE TABLE IF NOT EXISTS company_newsletter (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            phone TEXT,
-            email TEXT NOT NULL UNIQUE,
-            address TEXT,
-            city TEXT,
-            zipcode TEXT,
-            last_activity_date TEXT,
-            source TEXT
-        )
-    """)
-    conn.commit()
+        INSERT INTO slot_counts (date, time_slot, booked, capacity)
+        SELECT date, time_slot, COUNT(*), ?
+        FROM bookings
+        WHERE date IS NOT NULL AND time_slot IS NOT NULL
+        GROUP BY date, time_slot
+        ON CONFLICT (date, time_slot) DO UPDATE SET booked = excluded.booked
+    """, (SLOT_CAPACITY,))
+    after = {
+        (row[0], row[1]): row[2]
+        for row in c.execute("SELECT date, time_slot, booked FROM slot_counts")
+    }
+    return sum(1 for key, booked in after.items() if before.get(key) != booked)
+
+
+def _init_week_db(conn: sqlite3.Connection, db_path: str):
+    schemas.ensure(
+        conn, db_path, WEEK_SCHEMA_VERSION,
+        functools.partial(migrate_week_schema, db_path=db_path)
+    )
+
+
+@contextmanager
+def shard_db(db_path: str):
+    """Pooled connection to an existing weekly shard file."""
+    with pool.connection(db_path, _init_week_db) as conn:
+        yield conn
+
+
+@contextmanager
+def week_db(date_str: str):
+    """Pooled connection to the weekly shard for ``date_str``.
+
+    Commits on normal exit, rolls back on error and always returns the
+    connection to the pool::
+
+        with week_db("2025-07-04") as conn:
+            conn.execute(...)
+    """
+    with shard_db(week_db_path(date_str)) as conn:
+        yield conn
+
+
+def week_db_dependency(date: str):
+    """FastAPI dependency yielding the pooled shard connection for ``date``."""
+    with week_db(date) as conn:
+        yield conn
+
+
+def bootstrap_shards():
+    """Bring every existing weekly shard up to the current schema.
+
+    Run at startup so that migrations such as the booking id renumbering
+    have happened before ids are handed to clients.
+    """
+    for fname in sorted(os.listdir(DB_DIR)):
+        if SHARD_FILE_RE.match(fname):
+            with shard_db(os.path.join(DB_DIR, fname)):
+                pass
+
+
+def get_week_db(date_str: str):
+    """Open an unpooled connection to a weekly shard.
+
+    Kept for scripts; the caller owns the connection and must close it.
+    Request handlers should use ``week_db()`` instead.
+    """
+    db_path = week_db_path(date_str)
+    conn = open_connection(db_path)
+    _init_week_db(conn, db_path)
     return conn
 
 def init_user_db():
@@ -82,10 +599,31 @@ def init_user_db():
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     """)
+    _create_user_log_indexes(c)
     
     conn.commit()
     return conn
 
+def _create_user_log_indexes(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_activity_logs_timestamp ON user_activity_logs (timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_activity_logs_action_timestamp ON user_activity_logs (action, timestamp)")
+
+def ensure_user_db_indexes():
+    """Add the activity log indexes to an existing users.db (run at startup)."""
+    db_path = os.path.join(DB_DIR, "users.db")
+    if not os.path.exists(db_path):
+        return
+    conn = sqlite3.connect(db_path)
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='user_activity_logs'"
+        ).fetchone()
+        if exists:
+            _create_user_log_indexes(conn.cursor())
+            conn.commit()
+    finally:
+        conn.close()
+
 def get_user_db():
     db_path = os.path.join(DB_DIR, "users.db")
     conn = sqlite3.connect(db_path)
@@ -94,10 +632,230 @@ def get_user_db():
 
 DB_PATH = Path(__file__).parent.parent / "mh-bookings.db"
 
-def get_db():
-    conn = sqlite3.connect("mh-bookings.db")
-    conn.row_factory = sqlite3.Row
+def migrate_main_schema(conn: sqlite3.Connection, from_version: int):
+    """Upgrade mh-bookings.db from ``from_version`` to MAIN_SCHEMA_VERSION."""
     c = conn.cursor()
+    if from_version < 1:
+        _create_main_tables(c)
+    if from_version < 2:
+        # Per-customer aggregates maintained on booking writes (app.customers)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS customers (
+                email TEXT PRIMARY KEY,
+                name TEXT,
+                phone TEXT,
+                address TEXT,
+                city TEXT,
+                zipcode TEXT,
+                contact_preference TEXT,
+                info_created_at TEXT,
+                first_booking_date TEXT,
+                last_booking_date TEXT,
+                first_created_at TEXT,
+                last_created_at TEXT,
+                total_bookings INTEGER NOT NULL DEFAULT 0,
+                total_spent REAL NOT NULL DEFAULT 0,
+                slot_histogram TEXT NOT NULL DEFAULT '{}',
+                customer_tier TEXT NOT NULL DEFAULT 'New',
+                updated_at TEXT
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_customers_total ON customers (total_bookings, email)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_customers_last_date ON customers (last_booking_date, email)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_customers_tier ON customers (customer_tier, total_bookings)")
+    if from_version < 3:
+        # Bookings per customer per day / month, keyed by when the booking
+        # was made (app.customer_analytics); old daily rows are compacted away
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS customer_daily (
+                day TEXT NOT NULL,
+                email TEXT NOT NULL,
+                bookings INTEGER NOT NULL,
+                PRIMARY KEY (day, email)
+            ) WITHOUT ROWID
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS customer_monthly (
+                month TEXT NOT NULL,
+                email TEXT NOT NULL,
+                bookings INTEGER NOT NULL,
+                PRIMARY KEY (month, email)
+            ) WITHOUT ROWID
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_customers_first_created ON customers (first_created_at)")
+    if from_version < 4:
+        # Dashboard KPI counters (app.kpis); bookings live in the shards so
+        # their counters are bumped by the booking event hooks, while the
+        # waitlist count is kept by triggers on the waitlist table itself.
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS waitlist (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                phone TEXT NOT NULL,
+                email TEXT NOT NULL,
+                preferred_date TEXT NOT NULL,
+                preferred_time TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS kpi_counters (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        c.execute("""
+            INSERT OR REPLACE INTO kpi_counters (key, value)
+            SELECT 'waitlist', COUNT(*) FROM waitlist
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_waitlist_count_insert
+            AFTER INSERT ON waitlist
+            BEGIN
+                UPDATE kpi_counters SET value = value + 1 WHERE key = 'waitlist';
+            END
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_waitlist_count_delete
+            AFTER DELETE ON waitlist
+            BEGIN
+                UPDATE kpi_counters SET value = MAX(value - 1, 0) WHERE key = 'waitlist';
+            END
+        """)
+    if from_version < 5:
+        # email -> (shard key, booking id) of every booking (app.email_index)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS booking_emails (
+                email TEXT NOT NULL,
+                booking_id INTEGER NOT NULL,
+                shard INTEGER NOT NULL,
+                created_at TEXT,
+                PRIMARY KEY (email, booking_id)
+            ) WITHOUT ROWID
+        """)
+    if from_version < 6:
+        # Newest-first keyset pagination, optionally filtered by type
+        c.execute("CREATE INDEX IF NOT EXISTS idx_activity_logs_timestamp ON activity_logs (timestamp)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_activity_logs_entity_timestamp ON activity_logs (entity_type, timestamp)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_activity_logs_action_timestamp ON activity_logs (action_type, timestamp)")
+    if from_version < 7:
+        # Trigram full-text shadow index over newsletter recipients
+        # (app.newsletter_search); external content, synced by triggers
+        c.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS company_newsletter_fts USING fts5(
+                name, city, email, address, zipcode,
+                content='company_newsletter', content_rowid='id',
+                tokenize='trigram'
+            )
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_company_newsletter_fts_insert
+            AFTER INSERT ON company_newsletter
+            BEGIN
+                INSERT INTO company_newsletter_fts (rowid, name, city, email, address, zipcode)
+                VALUES (NEW.id, NEW.name, NEW.city, NEW.email, NEW.address, NEW.zipcode);
+            END
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_company_newsletter_fts_delete
+            AFTER DELETE ON company_newsletter
+            BEGIN
+                INSERT INTO company_newsletter_fts (company_newsletter_fts, rowid, name, city, email, address, zipcode)
+                VALUES ('delete', OLD.id, OLD.name, OLD.city, OLD.email, OLD.address, OLD.zipcode);
+            END
+        """)
+        c.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_company_newsletter_fts_update
+            AFTER UPDATE ON company_newsletter
+            WHEN OLD.name IS NOT NEW.name OR OLD.city IS NOT NEW.city
+              OR OLD.email IS NOT NEW.email OR OLD.address IS NOT NEW.address
+              OR OLD.zipcode IS NOT NEW.zipcode
+            BEGIN
+                INSERT INTO company_newsletter_fts (company_newsletter_fts, rowid, name, city, email, address, zipcode)
+                VALUES ('delete', OLD.id, OLD.name, OLD.city, OLD.email, OLD.address, OLD.zipcode);
+                INSERT INTO company_newsletter_fts (rowid, name, city, email, address, zipcode)
+                VALUES (NEW.id, NEW.name, NEW.city, NEW.email, NEW.address, NEW.zipcode);
+            END
+        """)
+        c.execute("INSERT INTO company_newsletter_fts (company_newsletter_fts) VALUES ('rebuild')")
+    if from_version < 8:
+        # Bulk newsletter sends (app.newsletter_delivery): one row per
+        # campaign plus a per-recipient delivery status
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS newsletter_campaigns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                subject TEXT NOT NULL,
+                message TEXT NOT NULL,
+                city_filter TEXT,
+                status TEXT NOT NULL DEFAULT 'queued',
+                total INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                created_by TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS newsletter_deliveries (
+                campaign_id INTEGER NOT NULL,
+                email TEXT NOT NULL,
+                name TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                sent_at TEXT,
+                PRIMARY KEY (campaign_id, email)
+            ) WITHOUT ROWID
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_newsletter_deliveries_status ON newsletter_deliveries (campaign_id, status, email)")
+    if from_version < 9:
+        # Transactional email outbox (app.outbox). next_attempt_at doubles
+        # as the claim lease, so only pending rows need indexing
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                dedupe_key TEXT UNIQUE,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                sent_at TEXT
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (next_attempt_at) WHERE status = 'pending'")
+    if from_version < 10:
+        # Earliest unpaid deposit deadline per shard key (app.deposit_tasks),
+        # so the sweeper opens only shards with something due. version is
+        # bumped by every upsert so a sweep never clears a newer deadline
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS deposit_shards (
+                shard INTEGER PRIMARY KEY,
+                next_due_at TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_deposit_shards_due ON deposit_shards (next_due_at)")
+        # Leases for jobs that must run in one process at a time (app.leases)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS job_leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                lease_until REAL NOT NULL
+            )
+        """)
+    if from_version < 11:
+        # The worker sending a campaign holds it until lease_until, so a
+        # campaign resumed by several processes is sent by one of them
+        c.execute("ALTER TABLE newsletter_campaigns ADD COLUMN owner TEXT")
+        c.execute("ALTER TABLE newsletter_campaigns ADD COLUMN lease_until REAL")
+
+
+def _create_main_tables(c: sqlite3.Cursor):
     # Ensure company_newsletter table exists
     c.execute("""
         CREATE TABLE IF NOT EXISTS company_newsletter (
@@ -126,8 +884,17 @@ def get_db():
             timestamp TEXT NOT NULL
         )
     """)
-    conn.commit()
-    return conn
+
+
+def _init_main_db(conn: sqlite3.Connection, db_path: str):
+    schemas.ensure(conn, db_path, MAIN_SCHEMA_VERSION, migrate_main_schema)
+
+
+@contextmanager
+def get_db():
+    """Pooled connection to mh-bookings.db; use as ``with get_db() as conn``."""
+    with pool.connection(MAIN_DB_PATH, _init_main_db) as conn:
+        yield conn
 
 def init_db():
     with get_db() as conn:
@@ -221,23 +988,3 @@ def init_db():
         )
         conn.commit()
 
-
-# Ensure the company_newsletter table exists in the main database at startup
-conn = sqlite3.connect("mh-bookings.db")
-c = conn.cursor()
-c.execute("""
-    CREATE TABLE IF NOT EXISTS company_newsletter (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT,
-        phone TEXT,
-        email TEXT NOT NULL UNIQUE,
-        address TEXT,
-        city TEXT,
-        zipcode TEXT,
-        last_activity_date TEXT,
-        source TEXT
-    )
-""")
-conn.commit()
-conn.close()
-
@@ -0,0 +1,105 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+DB_EXECUTOR_QUEUE = int(os.getenv("DB_EXECUTOR_QUEUE", "64"))
+
+
+class DBExecutor:
+    """Run blocking SQLite work on dedicated threads for async handlers.
+
+    At most ``max_queue`` calls per event loop are admitted at once (queued
+    or running); further callers wait for a slot without blocking the loop.
+    Queue depth, wait time (submit -> start) and run time are tracked for
+    the admin metrics endpoint.
+    """
+
+    def __init__(self, workers: int = DB_EXECUTOR_WORKERS,
+                 max_queue: int = DB_EXECUTOR_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="db"
+        )
+        # One admission semaphore per event loop (tests run several loops)
+        self._admission = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+        self._run_max = 0.0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        sem = self._admission.get(loop)
+        if sem is None:
+            sem = self._admission[loop] = asyncio.Semaphore(self.max_queue)
+        return sem
+
+    def _call(self, submitted: float, fn, args, kwargs):
+        started = time.perf_counter()
+        waited = started - submitted
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        failed = False
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                self._failed += failed
+                self._run_total += elapsed
+                self._run_max = max(self._run_max, elapsed)
+
+    async def run(self, fn, *args, **kwargs):
+        """Await ``fn(*args, **kwargs)`` executed on a DB thread."""
+        async with self._semaphore():
+            with self._lock:
+                self._queued += 1
+            call = functools.partial(
+                self._call, time.perf_counter(), fn, args, kwargs
+            )
+            return await asyncio.get_running_loop().run_in_executor(
+                self._pool, call
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self._completed or 1
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait_ms": round(self._wait_total / done * 1000, 3),
+                "max_wait_ms": round(self._wait_max * 1000, 3),
+                "avg_run_ms": round(self._run_total / done * 1000, 3),
+                "max_run_ms": round(self._run_max * 1000, 3),
+            }
+
+
+db_executor = DBExecutor()
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run blocking database work off the event loop and await its result."""
+    return await db_executor.run(fn, *args, **kwargs)
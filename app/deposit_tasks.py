@@ -1,47 +1,211 @@
 from apscheduler.schedulers.background import BackgroundScheduler
-from .email_utils import send_deposit_reminder, notify_admin_deposit_missing
-from .database import get_week_db
+from .database import (
+    BOOKING_ID_SPAN, get_db, shard_db, shard_id_base, shard_path, booking_db_path
+)
+from .shards import list_shards, map_shards
+from . import leases, outbox
 import logging
-import sqlite3
-from datetime import datetime, timedelta
+import os
+import threading
+from datetime import datetime, timedelta, timezone
 
 logger = logging.getLogger("booking")
 scheduler = BackgroundScheduler()
 scheduler.start()
 
-def schedule_deposit_jobs(booking_id, booking_date):
-    # Reminder after 4 hours
-    scheduler.add_job(
-        func=send_deposit_reminder_job,
-        trigger='date',
-        run_date=datetime.now() + timedelta(hours=4),
-        args=[booking_id, booking_date],
-        id=f"reminder_{booking_id}",
-        replace_existing=True
-    )
-    # Admin notification after 6 hours
-    scheduler.add_job(
-        func=notify_admin_deposit_missing_job,
-        trigger='date',
-        run_date=datetime.now() + timedelta(hours=6),
-        args=[booking_id, booking_date],
-        id=f"admin_notify_{booking_id}",
-        replace_existing=True
-    )
-
-def send_deposit_reminder_job(booking_id, booking_date):
-    booking = get_booking_by_id(booking_id, booking_date)
-    if booking and not booking.get("deposit_received"):
-        send_deposit_reminder(booking)
-
-def notify_admin_deposit_missing_job(booking_id, booking_date):
-    booking = get_booking_by_id(booking_id, booking_date)
-    if booking and not booking.get("deposit_received"):
-        notify_admin_deposit_missing(booking)
-
-def get_booking_by_id(booking_id, booking_date):
-    conn = get_week_db(booking_date)
-    c = conn.cursor()
-    c.execute("SELECT * FROM bookings WHERE id = ?", (booking_id,))
-    row = c.fetchone()
-    return dict(row) if row else None
\ No newline at end of file
+# Hours after booking before the customer is reminded / the admin is told
+DEPOSIT_REMINDER_HOURS = float(os.getenv("DEPOSIT_REMINDER_HOURS", "4"))
+DEPOSIT_ADMIN_NOTIFY_HOURS = float(os.getenv("DEPOSIT_ADMIN_NOTIFY_HOURS", "6"))
+# How often the sweeper runs, and due rows handled per shard query
+DEPOSIT_SWEEP_SECONDS = int(os.getenv("DEPOSIT_SWEEP_SECONDS", "60"))
+DEPOSIT_SWEEP_BATCH = int(os.getenv("DEPOSIT_SWEEP_BATCH", "200"))
+# Only one process sweeps; another takes over once this lease lapses
+DEPOSIT_SWEEP_LEASE_SECONDS = float(
+    os.getenv("DEPOSIT_SWEEP_LEASE_SECONDS", str(DEPOSIT_SWEEP_SECONDS * 3))
+)
+
+# deadline column -> outbox email kind
+DEADLINES = (
+    ("reminder_due_at", "deposit_reminder"),
+    ("admin_notify_due_at", "deposit_missing"),
+)
+
+_stats_lock = threading.Lock()
+_stats = {"sweeps": 0, "shards": 0, "reminders": 0, "admin_notices": 0,
+          "last_sweep_at": None, "last_sweep_ms": 0.0}
+
+
+def _utc(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def deposit_deadlines(now: datetime = None) -> dict:
+    """Deadline columns for a booking made at ``now``."""
+    now = now or datetime.now(timezone.utc)
+    return {
+        "reminder_due_at": _utc(now + timedelta(hours=DEPOSIT_REMINDER_HOURS)),
+        "admin_notify_due_at": _utc(now + timedelta(hours=DEPOSIT_ADMIN_NOTIFY_HOURS)),
+    }
+
+
+def _track(entries):
+    """Lower each shard's next deadline to ``due`` if that is earlier."""
+    with get_db() as conn:
+        conn.executemany("""
+            INSERT INTO deposit_shards (shard, next_due_at) VALUES (?, ?)
+            ON CONFLICT (shard) DO UPDATE SET
+                next_due_at = MIN(next_due_at, excluded.next_due_at),
+                version = version + 1
+        """, entries)
+
+
+def record_booking(booking: dict):
+    """Point the sweeper at a new booking's shard, after it has committed."""
+    due = [booking[column] for column, _ in DEADLINES if booking.get(column)]
+    if due and booking.get("id") and not booking.get("deposit_received"):
+        _track([(booking["id"] // BOOKING_ID_SPAN, min(due))])
+
+
+def _next_due(conn):
+    # Each MIN reads the first entry of its partial deadline index
+    return conn.execute("""
+        SELECT MIN(due) FROM (
+            SELECT MIN(reminder_due_at) AS due FROM bookings
+            WHERE deposit_received = 0 AND reminder_due_at IS NOT NULL
+            UNION ALL
+            SELECT MIN(admin_notify_due_at) FROM bookings
+            WHERE deposit_received = 0 AND admin_notify_due_at IS NOT NULL
+        )
+    """).fetchone()[0]
+
+
+def _shard_next_due(db_path: str):
+    with shard_db(db_path) as conn:
+        return _next_due(conn)
+
+
+def rebuild_deposit_shards() -> int:
+    """Record every shard's next deadline; returns shards with one pending.
+
+    Run at startup, which also covers a process that died between a
+    booking's commit and ``record_booking``.
+    """
+    shards = list_shards()
+    entries = [
+        (shard_id_base(path) // BOOKING_ID_SPAN, due)
+        for path, due in zip(shards, map_shards(_shard_next_due, shards))
+        if due is not None
+    ]
+    _track(entries)
+    return len(entries)
+
+
+def _due(conn, column: str, now: str, limit: int):
+    # Both terms of the partial index's WHERE are repeated so it is used
+    return conn.execute(f"""
+        SELECT * FROM bookings
+        WHERE deposit_received = 0 AND {column} IS NOT NULL AND {column} <= ?
+        ORDER BY {column} LIMIT ?
+    """, (now, limit))
+
+
+def _sweep_column(db_path: str, column: str, kind: str, now: str,
+                  batch_size: int) -> int:
+    # Read-only probe first: no write lock unless something is due
+    with shard_db(db_path) as conn:
+        if _due(conn, column, now, 1).fetchone() is None:
+            return 0
+    sent = 0
+    while True:
+        with shard_db(db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = [dict(row) for row in _due(conn, column, now, batch_size)]
+            # Stage each email and clear its deadline in one transaction;
+            # the dedupe key makes a second sweeper harmless
+            for row in rows:
+                outbox.stage(conn, kind, {"booking": row}, f"booking:{row['id']}:{kind}")
+            if rows:
+                conn.execute(
+                    f"UPDATE bookings SET {column} = NULL "
+                    f"WHERE id IN ({', '.join('?' for _ in rows)})",
+                    [row["id"] for row in rows]
+                )
+        if not rows:
+            return sent
+        outbox.relay(db_path)
+        sent += len(rows)
+        if len(rows) < batch_size:
+            return sent
+
+
+def sweep_deposit_deadlines(now: datetime = None,
+                            batch_size: int = DEPOSIT_SWEEP_BATCH) -> dict:
+    """Queue every deposit reminder and admin notice that has come due.
+
+    Only shards whose entry in ``deposit_shards`` has come due are
+    opened, whatever week they hold. Afterwards each entry is moved to
+    the shard's next deadline, or dropped if none is left, unless a new
+    booking updated it meanwhile (its version changed).
+    """
+    started = datetime.now(timezone.utc)
+    now = now or started
+    cutoff = _utc(now)
+    counts = {"deposit_reminder": 0, "deposit_missing": 0}
+    with get_db() as conn:
+        due = conn.execute(
+            "SELECT shard, version FROM deposit_shards WHERE next_due_at <= ?",
+            (cutoff,)
+        ).fetchall()
+    for shard, version in due:
+        db_path = shard_path(shard)
+        next_due = None
+        if os.path.exists(db_path):
+            for column, kind in DEADLINES:
+                counts[kind] += _sweep_column(db_path, column, kind, cutoff, batch_size)
+            next_due = _shard_next_due(db_path)
+        with get_db() as conn:
+            if next_due is None:
+                conn.execute(
+                    "DELETE FROM deposit_shards WHERE shard = ? AND version = ?",
+                    (shard, version)
+                )
+            else:
+                conn.execute(
+                    "UPDATE deposit_shards SET next_due_at = ? WHERE shard = ? AND version = ?",
+                    (next_due, shard, version)
+                )
+    with _stats_lock:
+        _stats["sweeps"] += 1
+        _stats["shards"] += len(due)
+        _stats["reminders"] += counts["deposit_reminder"]
+        _stats["admin_notices"] += counts["deposit_missing"]
+        _stats["last_sweep_at"] = cutoff
+        _stats["last_sweep_ms"] = round(
+            (datetime.now(timezone.utc) - started).total_seconds() * 1000, 3
+        )
+    if any(counts.values()):
+        logger.info(f"Deposit sweep queued {counts['deposit_reminder']} reminders "
+                    f"and {counts['deposit_missing']} admin notices")
+    return counts
+
+
+def run_deposit_sweeper():
+    """Interval job: sweep if this process holds the sweeper lease."""
+    if leases.acquire("deposit_sweeper", DEPOSIT_SWEEP_LEASE_SECONDS):
+        sweep_deposit_deadlines()
+
+
+def sweeper_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats, interval_seconds=DEPOSIT_SWEEP_SECONDS)
+
+
+def get_booking_by_id(booking_id, booking_date=None):
+    db_path = booking_db_path(booking_id)
+    if db_path is None:
+        return None
+    with shard_db(db_path) as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM bookings WHERE id = ?", (booking_id,))
+        row = c.fetchone()
+    return dict(row) if row else None
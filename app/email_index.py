@@ -0,0 +1,109 @@
+import logging
+import os
+from typing import List, Optional
+
+from .database import BOOKING_ID_SPAN, get_db, shard_db, shard_path
+from .shards import list_shards, map_shards
+
+logger = logging.getLogger("booking")
+
+
+def record_booking(booking: dict):
+    """Index a new booking under its customer's email."""
+    if not booking.get("email") or not booking.get("id"):
+        return
+    with get_db() as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO booking_emails (email, booking_id, shard, created_at)
+            VALUES (?, ?, ?, ?)
+        """, (booking["email"], booking["id"], booking["id"] // BOOKING_ID_SPAN,
+              booking.get("created_at")))
+
+
+def remove_booking(booking: dict):
+    """Drop a cancelled booking from the index."""
+    if not booking.get("email") or not booking.get("id"):
+        return
+    with get_db() as conn:
+        conn.execute(
+            "DELETE FROM booking_emails WHERE email = ? AND booking_id = ?",
+            (booking["email"], booking["id"])
+        )
+
+
+def shards_for_email(email: str) -> List[str]:
+    """Existing shard files that hold bookings for ``email``, oldest first."""
+    with get_db() as conn:
+        keys = [row[0] for row in conn.execute(
+            "SELECT DISTINCT shard FROM booking_emails WHERE email = ? ORDER BY shard",
+            (email,)
+        )]
+    return [shard_path(key) for key in keys if os.path.exists(shard_path(key))]
+
+
+def shards_for_emails(emails: List[str]) -> List[str]:
+    """Existing shard files holding bookings for any of ``emails``."""
+    if not emails:
+        return []
+    with get_db() as conn:
+        keys = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT shard FROM booking_emails "
+            f"WHERE email IN ({', '.join('?' for _ in emails)}) ORDER BY shard",
+            emails
+        )]
+    return [shard_path(key) for key in keys if os.path.exists(shard_path(key))]
+
+
+def latest_booking(email: str) -> Optional[dict]:
+    """The customer's most recently created booking, read from its shard."""
+    with get_db() as conn:
+        entries = conn.execute("""
+            SELECT booking_id, shard FROM booking_emails
+            WHERE email = ? ORDER BY created_at DESC, booking_id DESC
+        """, (email,)).fetchall()
+    for entry in entries:
+        path = shard_path(entry["shard"])
+        if not os.path.exists(path):
+            continue
+        with shard_db(path) as conn:
+            row = conn.execute(
+                "SELECT * FROM bookings WHERE id = ?", (entry["booking_id"],)
+            ).fetchone()
+        if row:
+            return dict(row)
+    return None
+
+
+def _shard_entries(db_path: str):
+    with shard_db(db_path) as conn:
+        return [
+            (row["email"], row["id"], row["id"] // BOOKING_ID_SPAN, row["created_at"])
+            for row in conn.execute(
+                "SELECT id, email, created_at FROM bookings WHERE email IS NOT NULL AND email != ''"
+            )
+        ]
+
+
+def rebuild_email_index() -> int:
+    """Recompute booking_emails from every shard; returns entries written."""
+    entries = [
+        entry
+        for shard_entries in map_shards(_shard_entries, list_shards())
+        for entry in shard_entries
+    ]
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM booking_emails")
+        conn.executemany("""
+            INSERT OR REPLACE INTO booking_emails (email, booking_id, shard, created_at)
+            VALUES (?, ?, ?, ?)
+        """, entries)
+    return len(entries)
+
+
+def backfill_email_index():
+    """Build the index on first start after the upgrade."""
+    with get_db() as conn:
+        has_rows = conn.execute("SELECT 1 FROM booking_emails LIMIT 1").fetchone()
+    if not has_rows and list_shards():
+        logger.info(f"Indexed {rebuild_email_index()} bookings by email")
@@ -1,16 +1,262 @@
+import collections
 import os
 import smtplib
+import threading
+import time
 from email.message import EmailMessage
 
-SMTP_HOST = "smtp.ionos.com"
-SMTP_PORT = 587
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.ionos.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
 SMTP_USER = os.environ.get("SMTP_USER", "cs@myhibachichef.com")
 SMTP_PASS = os.environ.get("SMTP_PASS", "myhibachicustomers!")
+# Set to "false" for a plain local relay/sink (no STARTTLS or LOGIN)
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "true") == "true"
+# Long-lived sessions shared by every sender in the process
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", "4"))
+# Sessions are replaced after this many seconds...
+SMTP_SESSION_MAX_AGE = float(os.environ.get("SMTP_SESSION_MAX_AGE", "300"))
+# ...and NOOP-checked before reuse once idle this long
+SMTP_NOOP_AFTER = float(os.environ.get("SMTP_NOOP_AFTER", "30"))
+
+
+def email_disabled():
+    return os.environ.get("TESTING") == "true" or os.environ.get("DISABLE_EMAIL") == "true"
+
+
+class _LoggingSession:
+    """Stand-in session used when email is disabled."""
+
+    def send_message(self, msg):
+        print(f"TEST MODE: Would send email to {msg['To']} with subject: {msg['Subject']}")
+
+    def noop(self):
+        return (250, b"OK")
+
+    def quit(self):
+        pass
+
+
+def open_smtp_session():
+    """Open one authenticated SMTP session."""
+    if email_disabled():
+        return _LoggingSession()
+    server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+    if SMTP_STARTTLS:
+        server.starttls()
+        server.login(SMTP_USER, SMTP_PASS)
+    return server
+
+
+class _SendStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed, ok):
+        with self.lock:
+            self.sent += ok
+            self.failed += not ok
+            self.total += elapsed
+            self.max = max(self.max, elapsed)
+
+    def snapshot(self):
+        with self.lock:
+            done = (self.sent + self.failed) or 1
+            return {
+                "sent": self.sent,
+                "failed": self.failed,
+                "avg_send_ms": round(self.total / done * 1000, 3),
+                "max_send_ms": round(self.max * 1000, 3),
+            }
+
+
+class SMTPTransport:
+    """Send messages over a pool of up to ``size`` long-lived SMTP sessions.
+
+    The STARTTLS handshake and LOGIN are paid once per session instead of
+    once per message. A session idle for ``noop_after`` seconds is checked
+    with NOOP before reuse; sessions older than ``max_age`` or that raised
+    are closed and replaced. A send that finds its session disconnected is
+    retried once on a fresh one.
+    """
+
+    backend = "smtp"
+
+    def __init__(self, factory=open_smtp_session, size=SMTP_POOL_SIZE,
+                 max_age=SMTP_SESSION_MAX_AGE, noop_after=SMTP_NOOP_AFTER):
+        self.factory = factory
+        self.size = size
+        self.max_age = max_age
+        self.noop_after = noop_after
+        self._cond = threading.Condition()
+        self._idle = []
+        self._open = 0
+        self._stats = _SendStats()
+        self.opened = 0
+        self.reused = 0
+        self.recycled = 0
+        self.health_checks = 0
+
+    def _healthy(self, entry):
+        now = time.monotonic()
+        if now - entry["opened_at"] >= self.max_age:
+            return False
+        if now - entry["used_at"] < self.noop_after:
+            return True
+        with self._cond:
+            self.health_checks += 1
+        try:
+            return entry["session"].noop()[0] == 250
+        except Exception:
+            return False
+
+    def _acquire(self):
+        while True:
+            with self._cond:
+                while not self._idle and self._open >= self.size:
+                    self._cond.wait()
+                if not self._idle:
+                    self._open += 1
+                    break
+                entry = self._idle.pop()
+            if self._healthy(entry):
+                with self._cond:
+                    self.reused += 1
+                return entry
+            self._discard(entry)
+        try:
+            session = self.factory()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.opened += 1
+        now = time.monotonic()
+        return {"session": session, "opened_at": now, "used_at": now}
+
+    def _release(self, entry):
+        entry["used_at"] = time.monotonic()
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    def _discard(self, entry):
+        try:
+            entry["session"].quit()
+        except Exception:
+            pass
+        with self._cond:
+            self._open -= 1
+            self.recycled += 1
+            self._cond.notify()
+
+    def send(self, msg):
+        started = time.perf_counter()
+        try:
+            for attempt in (1, 2):
+                entry = self._acquire()
+                try:
+                    entry["session"].send_message(msg)
+                except smtplib.SMTPServerDisconnected:
+                    self._discard(entry)
+                    if attempt == 2:
+                        raise
+                except Exception:
+                    self._discard(entry)
+                    raise
+                else:
+                    self._release(entry)
+                    break
+        except Exception:
+            self._stats.record(time.perf_counter() - started, False)
+            raise
+        self._stats.record(time.perf_counter() - started, True)
+
+    def close(self):
+        """Quit every idle session (shutdown, or between bulk jobs)."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for entry in idle:
+            try:
+                entry["session"].quit()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._cond:
+            stats = {
+                "backend": self.backend,
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "opened": self.opened,
+                "reused": self.reused,
+                "recycled": self.recycled,
+                "health_checks": self.health_checks,
+            }
+        stats.update(self._stats.snapshot())
+        return stats
+
+
+class SinkTransport:
+    """Keep messages in memory instead of sending them (tests, benchmarks)."""
+
+    backend = "sink"
+
+    def __init__(self, keep=1000):
+        self.messages = collections.deque(maxlen=keep)
+        self._stats = _SendStats()
+
+    def send(self, msg):
+        started = time.perf_counter()
+        self.messages.append(msg)
+        self._stats.record(time.perf_counter() - started, True)
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return dict(self._stats.snapshot(), backend=self.backend, kept=len(self.messages))
+
+
+def create_transport(size=SMTP_POOL_SIZE):
+    """A new transport for EMAIL_BACKEND ("smtp" or "sink")."""
+    if os.environ.get("EMAIL_BACKEND", "smtp") == "sink":
+        return SinkTransport()
+    return SMTPTransport(size=size)
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """The process-wide transport, created on first use."""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = create_transport()
+        return _transport
+
+
+def set_transport(transport):
+    """Swap the process-wide transport; returns the previous one."""
+    global _transport
+    with _transport_lock:
+        previous, _transport = _transport, transport
+    return previous
+
 
 def send_email(subject, to, content):
     """Send a plain text email using the configured SMTP server."""
     # Skip email sending during testing
-    if os.environ.get("TESTING") == "true" or os.environ.get("DISABLE_EMAIL") == "true":
+    if email_disabled():
         print(f"TEST MODE: Would send email to {to} with subject: {subject}")
         return
         
@@ -19,10 +265,7 @@ def send_email(subject, to, content):
     msg['From'] = SMTP_USER
     msg['To'] = to
     msg.set_content(content)
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASS)
-        server.send_message(msg)
+    get_transport().send(msg)
 
 def send_booking_email(booking):
     """Send a notification email to the admin for a new booking."""
@@ -46,7 +289,7 @@ Contact Preference: {booking.contact_preference}
 def send_customer_confirmation(booking):
     """Send booking confirmation email to customer AND info@myhibachichef.com."""
     # Skip email sending during testing
-    if os.environ.get("TESTING") == "true" or os.environ.get("DISABLE_EMAIL") == "true":
+    if email_disabled():
         print(f"TEST MODE: Would send confirmation email to {booking.email} and info@myhibachichef.com")
         return
         
@@ -95,10 +338,7 @@ For questions, contact us at info@myhibachichef.com
     msg['To'] = booking.email
     msg.set_content(plain_text)
     msg.add_alternative(html_content, subtype='html')
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASS)
-        server.send_message(msg)
+    get_transport().send(msg)
     
     # Send copy to info@myhibachichef.com
     admin_subject = f"COPY: Booking Confirmation Sent to {booking.name} for {booking.date}"
@@ -224,7 +464,7 @@ My Hibachi Chef Team
 
 def send_deposit_confirmation_email(booking, admin_reason=""):
     """Send deposit confirmation email to customer AND info@myhibachichef.com."""
-    if os.environ.get("TESTING") == "true" or os.environ.get("DISABLE_EMAIL") == "true":
+    if email_disabled():
         print(f"TEST MODE: Deposit confirmation to {booking.email} and info@myhibachichef.com")
         return
         
@@ -269,7 +509,7 @@ The customer has been notified that their booking is confirmed.
 
 def send_booking_cancellation_email(booking, reason=""):
     """Send cancellation confirmation to customer AND info@myhibachichef.com."""
-    if os.environ.get("TESTING") == "true" or os.environ.get("DISABLE_EMAIL") == "true":
+    if email_disabled():
         print(f"TEST MODE: Cancellation email to {booking.email} and info@myhibachichef.com")
         return
         
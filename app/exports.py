@@ -0,0 +1,101 @@
+import csv
+import io
+import os
+import zlib
+from typing import Iterable, Iterator, Optional, Sequence
+
+from .database import get_db
+from .newsletter_search import substring_filter
+from .shards import STREAM_BATCH_SIZE, iter_bookings
+
+# Bytes buffered before a CSV chunk is handed to the response
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(64 * 1024)))
+
+NEWSLETTER_COLUMNS = (
+    "name", "phone", "email", "address", "city", "zipcode",
+    "last_activity_date", "source",
+)
+BOOKING_COLUMNS = (
+    "id", "name", "phone", "email", "address", "city", "zipcode", "date",
+    "time_slot", "contact_preference", "created_at", "deposit_received",
+)
+
+
+def select_columns(requested: Optional[str], allowed: Sequence[str]) -> list:
+    """Parse a comma separated column list; raises ValueError on unknown ones."""
+    if not requested:
+        return list(allowed)
+    columns = [c.strip() for c in requested.split(",") if c.strip()]
+    unknown = [c for c in columns if c not in allowed]
+    if unknown or not columns:
+        raise ValueError(
+            f"Unknown columns: {', '.join(unknown) or 'none given'}; "
+            f"choose from {', '.join(allowed)}"
+        )
+    return columns
+
+
+def csv_chunks(columns: Sequence[str], rows: Iterable[dict]) -> Iterator[bytes]:
+    """Encode rows as CSV, yielding UTF-8 chunks of ~EXPORT_CHUNK_BYTES."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([row[c] for c in columns])
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Compress a chunk stream into a gzip stream without buffering it."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_newsletter(columns: Sequence[str], city: Optional[str] = None,
+                    source: Optional[str] = None,
+                    active_since: Optional[str] = None) -> Iterator[dict]:
+    """Newsletter contacts (optionally one segment), read with fetchmany."""
+    where, params = [], []
+    if city and city.strip():
+        condition, condition_params = substring_filter("city", city)
+        where.append(condition)
+        params += condition_params
+    if source:
+        where.append("source = ?")
+        params.append(source)
+    if active_since:
+        where.append("last_activity_date >= ?")
+        params.append(active_since)
+    clause = " WHERE " + " AND ".join(where) if where else ""
+    with get_db() as conn:
+        cur = conn.execute(
+            f"SELECT {', '.join(columns)} FROM company_newsletter{clause} ORDER BY id",
+            params
+        )
+        while True:
+            rows = cur.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+
+
+def iter_booking_export(columns: Sequence[str], start: Optional[str] = None,
+                        end: Optional[str] = None) -> Iterator[dict]:
+    """Bookings from every shard (or the shards overlapping start..end)."""
+    return iter_bookings(start=start, end=end, columns=", ".join(columns))
+
+
+def export_stream(columns: Sequence[str], rows: Iterable[dict],
+                  compress: bool = False) -> Iterator[bytes]:
+    chunks = csv_chunks(columns, rows)
+    return gzip_chunks(chunks) if compress else chunks
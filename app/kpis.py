@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from .database import SHARD_FILE_RE, get_db, shard_db, shard_key
+from .shards import list_shards, map_shards
+
+logger = logging.getLogger("booking")
+
+# A cached KPI snapshot is served as-is for KPI_FRESH_SECONDS, then served
+# stale while one background refresh runs, up to KPI_STALE_SECONDS old
+KPI_FRESH_SECONDS = float(os.getenv("KPI_FRESH_SECONDS", "5"))
+KPI_STALE_SECONDS = float(os.getenv("KPI_STALE_SECONDS", "300"))
+
+
+def _week_key(date_str: str) -> str:
+    key = shard_key(date_str)
+    return f"week:{key // 100}-{key % 100:02d}"
+
+
+def _month_key(date_str: str) -> str:
+    return f"month:{date_str[:7]}"
+
+
+def _bump(booking: dict, delta: int):
+    date = booking.get("date")
+    if not date:
+        return
+    keys = ("total", _week_key(date), _month_key(date))
+    with get_db() as conn:
+        conn.executemany("""
+            INSERT INTO kpi_counters (key, value) VALUES (?, MAX(?, 0))
+            ON CONFLICT (key) DO UPDATE SET value = MAX(value + ?, 0)
+        """, [(key, delta, delta) for key in keys])
+    kpi_cache.mark_stale()
+
+
+def record_booking(booking: dict):
+    _bump(booking, 1)
+
+
+def remove_booking(booking: dict):
+    _bump(booking, -1)
+
+
+def _shard_counts(db_path: str):
+    with shard_db(db_path) as conn:
+        rows = conn.execute("""
+            SELECT substr(date, 1, 7) AS month, SUM(booked) AS booked
+            FROM slot_counts GROUP BY substr(date, 1, 7)
+        """).fetchall()
+    return db_path, [(row["month"], row["booked"] or 0) for row in rows]
+
+
+def rebuild_kpi_counters() -> dict:
+    """Recount the booking counters from every shard's slot_counts.
+
+    A repair tool (scripts/rebuild_kpi_counters.py, and the first start
+    after the upgrade), not a periodic job: the shards are read before the
+    counters are replaced, so a booking counted by ``_bump`` in between
+    would be lost. Run it while no bookings are being written.
+    """
+    counters = {"total": 0}
+    for db_path, months in map_shards(_shard_counts, list_shards()):
+        year, week = SHARD_FILE_RE.match(os.path.basename(db_path)).groups()
+        counters[f"week:{year}-{week}"] = sum(n for _, n in months)
+        counters["total"] += counters[f"week:{year}-{week}"]
+        for month, booked in months:
+            if month:
+                counters[f"month:{month}"] = counters.get(f"month:{month}", 0) + booked
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM kpi_counters WHERE key != 'waitlist'")
+        conn.executemany(
+            "INSERT INTO kpi_counters (key, value) VALUES (?, ?)",
+            list(counters.items())
+        )
+        conn.execute("""
+            INSERT OR REPLACE INTO kpi_counters (key, value)
+            SELECT 'waitlist', COUNT(*) FROM waitlist
+        """)
+    kpi_cache.mark_stale()
+    return counters
+
+
+def read_kpis(today: Optional[datetime] = None) -> dict:
+    """Current KPIs: a handful of primary-key reads on kpi_counters."""
+    today_str = (today or datetime.now()).strftime("%Y-%m-%d")
+    keys = {
+        "total": "total",
+        "week": _week_key(today_str),
+        "month": _month_key(today_str),
+        "waitlist": "waitlist",
+    }
+    with get_db() as conn:
+        values = dict(conn.execute(
+            f"SELECT key, value FROM kpi_counters WHERE key IN ({', '.join('?' for _ in keys)})",
+            list(keys.values())
+        ).fetchall())
+    return {name: values.get(key, 0) for name, key in keys.items()}
+
+
+class StaleWhileRevalidate:
+    """Cache one computed value with stale-while-revalidate semantics.
+
+    Within ``fresh`` seconds the cached value is returned. Up to ``stale``
+    seconds it is still returned immediately while a single background
+    thread recomputes it; past that (or when empty) callers compute it
+    themselves. ``mark_stale`` makes the next read revalidate.
+    """
+
+    def __init__(self, loader: Callable[[], dict], fresh: float = KPI_FRESH_SECONDS,
+                 stale: float = KPI_STALE_SECONDS):
+        self.loader = loader
+        self.fresh = fresh
+        self.stale = stale
+        self._lock = threading.Lock()
+        self._value = None
+        self._loaded_at = 0.0
+        self._refreshing = False
+        self.hits = 0
+        self.stale_hits = 0
+        self.loads = 0
+        self.last_load_ms = 0.0
+
+    def _load(self):
+        started = time.perf_counter()
+        value = self.loader()
+        with self._lock:
+            self._value = value
+            self._loaded_at = time.monotonic()
+            self.loads += 1
+            self.last_load_ms = round((time.perf_counter() - started) * 1000, 3)
+        return value
+
+    def _background_refresh(self):
+        try:
+            self._load()
+        except Exception as e:
+            logger.error(f"Background KPI refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self) -> dict:
+        with self._lock:
+            age = time.monotonic() - self._loaded_at
+            if self._value is not None and age < self.fresh:
+                self.hits += 1
+                return self._value
+            if self._value is not None and age < self.stale:
+                self.stale_hits += 1
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(
+                        target=self._background_refresh, daemon=True,
+                        name="kpi-refresh"
+                    ).start()
+                return self._value
+        return self._load()
+
+    def mark_stale(self):
+        with self._lock:
+            self._loaded_at = min(self._loaded_at, time.monotonic() - self.fresh)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "loads": self.loads,
+                "last_load_ms": self.last_load_ms,
+                "age_seconds": round(time.monotonic() - self._loaded_at, 3)
+                if self._value is not None else None,
+            }
+
+
+kpi_cache = StaleWhileRevalidate(read_kpis)
+
+
+def backfill_kpi_counters():
+    """Build the booking counters on first start after the upgrade."""
+    with get_db() as conn:
+        has_total = conn.execute(
+            "SELECT 1 FROM kpi_counters WHERE key = 'total'"
+        ).fetchone()
+    if not has_total:
+        rebuild_kpi_counters()
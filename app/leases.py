@@ -0,0 +1,38 @@
+"""Run a periodic job in one process at a time.
+
+Every worker schedules the same jobs; before a run each one asks for the
+job's lease in mh-bookings.db. Only the current holder (or anyone, once
+the holder has let it lapse) gets it, so a job whose owner died is taken
+over after at most one lease period.
+"""
+import os
+import socket
+import time
+
+from .database import get_db
+
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def acquire(name: str, seconds: float, owner: str = OWNER) -> bool:
+    """Take or renew the lease on ``name`` for ``seconds``; True if held."""
+    now = time.time()
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT OR IGNORE INTO job_leases (name, owner, lease_until) VALUES (?, ?, 0)",
+            (name, owner)
+        )
+        return conn.execute("""
+            UPDATE job_leases SET owner = ?, lease_until = ?
+            WHERE name = ? AND (owner = ? OR lease_until < ?)
+        """, (owner, now + seconds, name, owner, now)).rowcount == 1
+
+
+def release(name: str, owner: str = OWNER):
+    """Give up ``name`` early so another process can take it at once."""
+    with get_db() as conn:
+        conn.execute(
+            "UPDATE job_leases SET lease_until = 0 WHERE name = ? AND owner = ?",
+            (name, owner)
+        )
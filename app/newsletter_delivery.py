@@ -0,0 +1,324 @@
+import collections
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.message import EmailMessage
+from typing import Callable, Iterator, Optional
+
+from . import email_utils
+from .database import get_db
+from .leases import OWNER
+from .newsletter_search import substring_filter
+
+logger = logging.getLogger("booking")
+
+# Concurrent sends, and the number of SMTP sessions kept open for them
+# (a transport of its own, so a campaign never starves transactional mail)
+NEWSLETTER_CONCURRENCY = int(os.getenv("NEWSLETTER_CONCURRENCY", "3"))
+# Messages handed to the SMTP server per minute (0 = unthrottled)
+NEWSLETTER_RATE_PER_MINUTE = int(os.getenv("NEWSLETTER_RATE_PER_MINUTE", "120"))
+# Pending recipients read per query while a campaign runs
+NEWSLETTER_BATCH_SIZE = int(os.getenv("NEWSLETTER_BATCH_SIZE", "200"))
+# A running campaign is taken over by another worker if its owner has not
+# renewed the claim for this long; it is renewed every third of it
+NEWSLETTER_LEASE_SECONDS = float(os.getenv("NEWSLETTER_LEASE_SECONDS", "300"))
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class RateLimiter:
+    """Blocking sliding-window limit of ``per_minute`` calls to acquire()."""
+
+    def __init__(self, per_minute: int = NEWSLETTER_RATE_PER_MINUTE,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.per_minute = per_minute
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._sent = collections.deque()
+        self.waited_seconds = 0.0
+
+    def acquire(self):
+        if self.per_minute <= 0:
+            return
+        while True:
+            with self._lock:
+                now = self.clock()
+                while self._sent and now - self._sent[0] >= 60:
+                    self._sent.popleft()
+                if len(self._sent) < self.per_minute:
+                    self._sent.append(now)
+                    return
+                wait = 60 - (now - self._sent[0])
+                self.waited_seconds += wait
+            self.sleep(wait)
+
+
+def create_campaign(subject: str, message: str, city_filter: Optional[str] = None,
+                    created_by: Optional[str] = None) -> dict:
+    """Queue a campaign with one pending delivery per matching recipient.
+
+    Recipients are copied with a single INSERT ... SELECT, so the list is
+    fixed at creation and never held in memory.
+    """
+    where = ["email IS NOT NULL", "email != ''"]
+    params = []
+    if city_filter and city_filter.strip():
+        condition, params = substring_filter("city", city_filter)
+        where.append(condition)
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        campaign_id = conn.execute("""
+            INSERT INTO newsletter_campaigns (subject, message, city_filter, created_by, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (subject, message, city_filter or None, created_by, _now())).lastrowid
+        total = conn.execute(f"""
+            INSERT OR IGNORE INTO newsletter_deliveries (campaign_id, email, name)
+            SELECT ?, email, name FROM company_newsletter WHERE {' AND '.join(where)}
+        """, [campaign_id] + params).rowcount
+        conn.execute(
+            "UPDATE newsletter_campaigns SET total = ? WHERE id = ?", (total, campaign_id)
+        )
+    return {"id": campaign_id, "total": total}
+
+
+def _pending(campaign_id: int, batch_size: int) -> Iterator[dict]:
+    """Pending deliveries in email order, one short read per batch."""
+    after = ""
+    while True:
+        with get_db() as conn:
+            rows = conn.execute("""
+                SELECT email, name FROM newsletter_deliveries
+                WHERE campaign_id = ? AND status = 'pending' AND email > ?
+                ORDER BY email LIMIT ?
+            """, (campaign_id, after, batch_size)).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield dict(row)
+        after = rows[-1]["email"]
+
+
+def build_message(campaign: dict, recipient: dict) -> EmailMessage:
+    msg = EmailMessage()
+    msg["Subject"] = campaign["subject"]
+    msg["From"] = email_utils.SMTP_USER
+    msg["To"] = recipient["email"]
+    greeting = f"Hello {recipient['name']},\n\n" if recipient.get("name") else ""
+    msg.set_content(greeting + campaign["message"])
+    return msg
+
+
+def _record(campaign_id: int, email: str, error: Optional[str]):
+    with get_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        # Only a pending row counts, so an outcome is never recorded twice
+        updated = conn.execute("""
+            UPDATE newsletter_deliveries
+            SET status = ?, error = ?, attempts = attempts + 1, sent_at = ?
+            WHERE campaign_id = ? AND email = ? AND status = 'pending'
+        """, ("failed" if error else "sent", error, None if error else _now(),
+              campaign_id, email)).rowcount
+        column = "failed" if error else "sent"
+        if updated:
+            conn.execute(
+                f"UPDATE newsletter_campaigns SET {column} = {column} + 1 WHERE id = ?",
+                (campaign_id,)
+            )
+
+
+def claim_campaign(campaign_id: int, owner: str = OWNER,
+                   lease_seconds: float = NEWSLETTER_LEASE_SECONDS) -> bool:
+    """Take (or renew) the right to send ``campaign_id``; True if held.
+
+    A queued campaign goes to the first worker to ask; a running one
+    only to its owner, or to anyone once the owner's lease has lapsed.
+    """
+    now = time.time()
+    with get_db() as conn:
+        return conn.execute("""
+            UPDATE newsletter_campaigns
+            SET status = 'running', owner = ?, lease_until = ?,
+                started_at = COALESCE(started_at, ?)
+            WHERE id = ? AND (status = 'queued' OR (status = 'running'
+                AND (owner = ? OR lease_until IS NULL OR lease_until < ?)))
+        """, (owner, now + lease_seconds, _now(), campaign_id, owner, now)).rowcount == 1
+
+
+def _finish(campaign_id: int, status: str, owner: str):
+    with get_db() as conn:
+        conn.execute("""
+            UPDATE newsletter_campaigns
+            SET status = ?, finished_at = ?, lease_until = NULL
+            WHERE id = ? AND owner = ? AND status = 'running'
+        """, (status, _now(), campaign_id, owner))
+
+
+class LeaseLost(Exception):
+    """Another worker took over the campaign being sent."""
+
+
+class NewsletterSender:
+    """Deliver queued campaigns through a pool of reused SMTP sessions.
+
+    Messages are built one recipient at a time as pending rows are read,
+    sent by ``concurrency`` threads over an email_utils transport,
+    throttled to ``rate_per_minute`` and their outcome written back per
+    recipient. Campaigns run one at a time, and only in the worker that
+    holds the campaign's claim; an interrupted one resumes from its
+    pending rows.
+    """
+
+    def __init__(self, transport=None,
+                 concurrency: int = NEWSLETTER_CONCURRENCY,
+                 rate_per_minute: int = NEWSLETTER_RATE_PER_MINUTE,
+                 batch_size: int = NEWSLETTER_BATCH_SIZE,
+                 owner: str = OWNER,
+                 lease_seconds: float = NEWSLETTER_LEASE_SECONDS):
+        self.concurrency = concurrency
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.batch_size = batch_size
+        self._transport = transport
+        self.limiter = RateLimiter(rate_per_minute)
+        self._run_lock = threading.Lock()
+        self.active = None
+
+    @property
+    def transport(self):
+        # Created on first use so EMAIL_BACKEND from the env file applies
+        if self._transport is None:
+            self._transport = email_utils.create_transport(size=self.concurrency)
+        return self._transport
+
+    def _send(self, campaign_id: int, msg: EmailMessage):
+        error = None
+        try:
+            self.transport.send(msg)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+        _record(campaign_id, msg["To"], error)
+
+    def run(self, campaign_id: int):
+        """Send every pending delivery of ``campaign_id`` (blocking).
+
+        Returns at once if another worker holds the campaign.
+        """
+        with self._run_lock:
+            if not claim_campaign(campaign_id, self.owner, self.lease_seconds):
+                return
+            with get_db() as conn:
+                campaign = dict(conn.execute(
+                    "SELECT * FROM newsletter_campaigns WHERE id = ?", (campaign_id,)
+                ).fetchone())
+            self.active = campaign_id
+            renew_at = time.monotonic() + self.lease_seconds / 3
+            # Bounds the messages built ahead of the sending threads
+            in_flight = threading.BoundedSemaphore(self.concurrency * 2)
+
+            def send(msg):
+                try:
+                    self._send(campaign_id, msg)
+                except Exception as e:
+                    logger.error(f"Newsletter {campaign_id} delivery to {msg['To']} failed: {e}")
+                finally:
+                    in_flight.release()
+
+            try:
+                with ThreadPoolExecutor(
+                    max_workers=self.concurrency, thread_name_prefix="newsletter"
+                ) as executor:
+                    for recipient in _pending(campaign_id, self.batch_size):
+                        in_flight.acquire()
+                        self.limiter.acquire()
+                        if time.monotonic() >= renew_at:
+                            if not claim_campaign(campaign_id, self.owner, self.lease_seconds):
+                                in_flight.release()
+                                raise LeaseLost()
+                            renew_at = time.monotonic() + self.lease_seconds / 3
+                        executor.submit(send, build_message(campaign, recipient))
+                _finish(campaign_id, "completed", self.owner)
+            except LeaseLost:
+                logger.warning(f"Newsletter campaign {campaign_id} taken over by another worker")
+            except Exception as e:
+                logger.error(f"Newsletter campaign {campaign_id} stopped: {e}")
+                _finish(campaign_id, "failed", self.owner)
+            finally:
+                # Don't hold idle SMTP sessions open between campaigns
+                self.transport.close()
+                self.active = None
+
+    def start(self, campaign_id: int) -> threading.Thread:
+        """Run a campaign on a background thread."""
+        thread = threading.Thread(
+            target=self.run, args=(campaign_id,), daemon=True,
+            name=f"newsletter-campaign-{campaign_id}"
+        )
+        thread.start()
+        return thread
+
+    def stats(self) -> dict:
+        return {
+            "active_campaign": self.active,
+            "concurrency": self.concurrency,
+            "rate_per_minute": self.limiter.per_minute,
+            "throttled_seconds": round(self.limiter.waited_seconds, 3),
+            "transport": self.transport.stats(),
+        }
+
+
+newsletter_sender = NewsletterSender()
+
+
+def campaign_progress(campaign_id: int) -> Optional[dict]:
+    """Campaign row plus per-status delivery counts, or None if unknown."""
+    with get_db() as conn:
+        row = conn.execute(
+            "SELECT * FROM newsletter_campaigns WHERE id = ?", (campaign_id,)
+        ).fetchone()
+        if not row:
+            return None
+        counts = dict(conn.execute("""
+            SELECT status, COUNT(*) FROM newsletter_deliveries
+            WHERE campaign_id = ? GROUP BY status
+        """, (campaign_id,)).fetchall())
+    progress = dict(row)
+    progress["pending"] = counts.get("pending", 0)
+    done = progress["sent"] + progress["failed"]
+    progress["percent"] = round(done / progress["total"] * 100, 1) if progress["total"] else 100.0
+    return progress
+
+
+def failed_deliveries(campaign_id: int, limit: int = 100) -> list:
+    with get_db() as conn:
+        rows = conn.execute("""
+            SELECT email, name, error, attempts FROM newsletter_deliveries
+            WHERE campaign_id = ? AND status = 'failed' ORDER BY email LIMIT ?
+        """, (campaign_id, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def resume_campaigns():
+    """Restart queued campaigns and those whose worker stopped renewing.
+
+    Runs at startup and periodically in every worker; ``run`` claims a
+    campaign before sending, so each is sent by one worker only.
+    """
+    with get_db() as conn:
+        ids = [row[0] for row in conn.execute("""
+            SELECT id FROM newsletter_campaigns
+            WHERE status = 'queued'
+               OR (status = 'running' AND (lease_until IS NULL OR lease_until < ?))
+            ORDER BY id
+        """, (time.time(),))]
+    for campaign_id in ids:
+        if campaign_id == newsletter_sender.active:
+            continue
+        logger.info(f"Resuming newsletter campaign {campaign_id}")
+        newsletter_sender.start(campaign_id)
@@ -0,0 +1,98 @@
+import sqlite3
+from typing import List, Optional, Tuple
+
+# Columns of company_newsletter covered by the trigram index
+SEARCH_FIELDS = ("name", "city", "email", "address", "zipcode")
+# The trigram tokenizer cannot use its index for shorter terms
+MIN_TRIGRAM_TERM = 3
+
+RECIPIENT_COLUMNS = (
+    "id", "name", "phone", "email", "address", "city", "zipcode",
+    "last_activity_date", "source",
+)
+
+
+def _columns(prefix: str = "") -> str:
+    return ", ".join(prefix + column for column in RECIPIENT_COLUMNS)
+
+
+def _phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _column_filter(field: Optional[str], expr: str) -> str:
+    return f"{field} : ({expr})" if field else expr
+
+
+def substring_filter(column: str, value: str) -> Tuple[str, list]:
+    """SQL condition on company_newsletter matching ``value`` anywhere in
+    ``column`` (case-insensitive), like ``column LIKE '%value%'``.
+
+    Uses the trigram index when the term is long enough to; shorter terms
+    fall back to LIKE.
+    """
+    value = value.strip()
+    if len(value) < MIN_TRIGRAM_TERM:
+        return f"{column} LIKE ?", [f"%{value}%"]
+    return (
+        "id IN (SELECT rowid FROM company_newsletter_fts "
+        "WHERE company_newsletter_fts MATCH ?)",
+        [_column_filter(column, _phrase(value))]
+    )
+
+
+def _trigrams(term: str) -> List[str]:
+    term = term.lower()
+    return sorted({term[i:i + 3] for i in range(len(term) - 2)})
+
+
+def _fetch(conn: sqlite3.Connection, match: str, limit: int, offset: int):
+    total = conn.execute(
+        "SELECT COUNT(*) FROM company_newsletter_fts WHERE company_newsletter_fts MATCH ?",
+        (match,)
+    ).fetchone()[0]
+    rows = conn.execute(f"""
+        SELECT {_columns("n.")}, bm25(company_newsletter_fts) AS score
+        FROM company_newsletter_fts f
+        JOIN company_newsletter n ON n.id = f.rowid
+        WHERE company_newsletter_fts MATCH ?
+        ORDER BY score, n.id
+        LIMIT ? OFFSET ?
+    """, (match, limit, offset)).fetchall()
+    return total, [dict(row) for row in rows]
+
+
+def search_recipients(conn: sqlite3.Connection, query: str,
+                      field: Optional[str] = None, limit: int = 25,
+                      offset: int = 0) -> dict:
+    """Ranked, paginated recipient search.
+
+    The whole term is first matched as a substring (which also covers
+    prefixes). If that finds nothing, the term's trigrams are OR-ed
+    together so near misses such as typos still match, ranked by how much
+    of the term they share (bm25). Terms under three characters use a
+    plain LIKE scan.
+    """
+    query = query.strip()
+    columns = (field,) if field else SEARCH_FIELDS
+    if len(query) < MIN_TRIGRAM_TERM:
+        where = " OR ".join(f"{column} LIKE ?" for column in columns)
+        params = [f"%{query}%"] * len(columns)
+        total = conn.execute(
+            f"SELECT COUNT(*) FROM company_newsletter WHERE {where}", params
+        ).fetchone()[0]
+        rows = conn.execute(f"""
+            SELECT {_columns()} FROM company_newsletter
+            WHERE {where} ORDER BY name, id LIMIT ? OFFSET ?
+        """, params + [limit, offset]).fetchall()
+        return {"mode": "like", "total": total, "results": [dict(r) for r in rows]}
+
+    total, results = _fetch(
+        conn, _column_filter(field, _phrase(query)), limit, offset
+    )
+    mode = "exact"
+    if total == 0:
+        fuzzy = " OR ".join(_phrase(t) for t in _trigrams(query))
+        total, results = _fetch(conn, _column_filter(field, fuzzy), limit, offset)
+        mode = "fuzzy"
+    return {"mode": mode, "total": total, "results": results}
@@ -0,0 +1,368 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Optional
+
+from . import email_utils
+from .database import get_db, shard_db
+from .shards import list_shards
+
+logger = logging.getLogger("booking")
+
+EMAIL_OUTBOX_WORKERS = int(os.getenv("EMAIL_OUTBOX_WORKERS", "2"))
+# Rows claimed per worker per round
+EMAIL_OUTBOX_BATCH = int(os.getenv("EMAIL_OUTBOX_BATCH", "10"))
+# Idle workers re-check the table this often even without a wake-up
+EMAIL_OUTBOX_POLL_SECONDS = float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", "5"))
+# A claimed row is retried if its worker has not finished within the lease
+EMAIL_OUTBOX_LEASE_SECONDS = float(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", "120"))
+# Attempts before a message is dead-lettered; retries back off exponentially
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "6"))
+EMAIL_OUTBOX_BACKOFF_SECONDS = float(os.getenv("EMAIL_OUTBOX_BACKOFF_SECONDS", "30"))
+EMAIL_OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("EMAIL_OUTBOX_BACKOFF_MAX_SECONDS", "3600"))
+# Sent messages are kept this long for auditing
+EMAIL_OUTBOX_RETENTION_DAYS = int(os.getenv("EMAIL_OUTBOX_RETENTION_DAYS", "7"))
+# How often every shard is checked for staged emails a crash left behind
+EMAIL_OUTBOX_RELAY_SECONDS = int(os.getenv("EMAIL_OUTBOX_RELAY_SECONDS", "60"))
+
+
+def _booking(payload: dict):
+    # The email_utils helpers read bookings by attribute
+    return SimpleNamespace(**payload["booking"])
+
+
+# kind -> (email_utils function, payload -> positional arguments)
+HANDLERS = {
+    "booking_notification": ("send_booking_email", lambda p: (_booking(p),)),
+    "customer_confirmation": ("send_customer_confirmation", lambda p: (_booking(p),)),
+    "booking_cancellation": (
+        "send_booking_cancellation_email", lambda p: (_booking(p), p.get("reason", ""))
+    ),
+    "deposit_confirmation": (
+        "send_deposit_confirmation_email", lambda p: (_booking(p), p.get("reason", ""))
+    ),
+    "waitlist_confirmation": ("send_waitlist_confirmation", lambda p: (p["waitlist"],)),
+    "waitlist_position": (
+        "send_waitlist_position_email", lambda p: (p["waitlist"], p["position"])
+    ),
+    "waitlist_slot_opened": ("send_waitlist_slot_opened", lambda p: (p["waitlist"],)),
+    "deposit_reminder": ("send_deposit_reminder", lambda p: (_booking(p),)),
+    "deposit_missing": ("notify_admin_deposit_missing", lambda p: (_booking(p),)),
+}
+
+# Staged-only kind: expanded into one waitlist_slot_opened per waiting
+# customer when relayed, since the waitlist lives in mh-bookings.db
+SLOT_OPENED = "slot_opened"
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Delay before retry number ``attempts`` (1-based): base * 2^(n-1), capped."""
+    return min(EMAIL_OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1),
+               EMAIL_OUTBOX_BACKOFF_MAX_SECONDS)
+
+
+def enqueue(kind: str, payload: dict, conn: Optional[sqlite3.Connection] = None,
+            dedupe_key: Optional[str] = None) -> bool:
+    """Append an email to the outbox; returns False if ``dedupe_key`` exists.
+
+    Pass ``conn`` (a mh-bookings.db connection) to enqueue inside the
+    caller's transaction so the email commits or rolls back with it.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown email kind: {kind}")
+    row = (kind, json.dumps(payload, default=str), dedupe_key, time.time(), _now())
+    sql = """
+        INSERT OR IGNORE INTO email_outbox (kind, payload, dedupe_key, next_attempt_at, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    """
+    if conn is not None:
+        added = conn.execute(sql, row).rowcount == 1
+    else:
+        with get_db() as own:
+            added = own.execute(sql, row).rowcount == 1
+    if added:
+        outbox_worker.enqueued_one()
+    return added
+
+
+def enqueue_waitlist_slot_opened(conn: sqlite3.Connection, date: str, time_slot: str,
+                                 dedupe_key: Optional[str] = None) -> int:
+    """Queue a 'slot opened' email for everyone waiting on date/time_slot.
+
+    With ``dedupe_key`` each email is keyed ``<dedupe_key>:<waitlist id>``,
+    so repeating the call queues nothing twice.
+    """
+    count = conn.execute("""
+        INSERT OR IGNORE INTO email_outbox (kind, payload, dedupe_key, next_attempt_at, created_at)
+        SELECT 'waitlist_slot_opened',
+               json_object('waitlist', json_object(
+                   'id', id, 'name', name, 'phone', phone, 'email', email,
+                   'preferred_date', preferred_date, 'preferred_time', preferred_time
+               )),
+               ? || ':' || id, ?, ?
+        FROM waitlist WHERE preferred_date = ? AND preferred_time = ?
+        ORDER BY created_at
+    """, (dedupe_key, time.time(), _now(), date, time_slot)).rowcount
+    for _ in range(count):
+        outbox_worker.enqueued_one()
+    return count
+
+
+def stage(conn: sqlite3.Connection, kind: str, payload: dict, dedupe_key: str):
+    """Stage an email in a weekly shard, inside the caller's transaction.
+
+    SQLite can't commit the shard and mh-bookings.db atomically, so an
+    email triggered by a booking change is written to the shard's own
+    email_outbox with the change and later moved by ``relay``. The key
+    makes relaying the same row twice harmless.
+    """
+    if kind not in HANDLERS and kind != SLOT_OPENED:
+        raise ValueError(f"Unknown email kind: {kind}")
+    conn.execute(
+        "INSERT OR IGNORE INTO email_outbox (kind, payload, dedupe_key, created_at) VALUES (?, ?, ?, ?)",
+        (kind, json.dumps(payload, default=str), dedupe_key, _now())
+    )
+
+
+def relay(db_path: str) -> int:
+    """Move a shard's staged emails into the outbox; returns how many were queued.
+
+    Called right after the shard commit, and for every shard by
+    ``relay_all``, which picks up rows a crash left between the two
+    commits. Rows are only deleted from the shard once the outbox has
+    committed them.
+    """
+    with shard_db(db_path) as shard:
+        rows = shard.execute("SELECT * FROM email_outbox ORDER BY id").fetchall()
+    if not rows:
+        return 0
+    queued = 0
+    with get_db() as conn:
+        for row in rows:
+            if row["kind"] == SLOT_OPENED:
+                slot = json.loads(row["payload"])
+                queued += enqueue_waitlist_slot_opened(
+                    conn, slot["date"], slot["time_slot"], row["dedupe_key"]
+                )
+                continue
+            added = conn.execute("""
+                INSERT OR IGNORE INTO email_outbox (kind, payload, dedupe_key, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (row["kind"], row["payload"], row["dedupe_key"], time.time(),
+                  row["created_at"])).rowcount
+            if added:
+                outbox_worker.enqueued_one()
+                queued += 1
+    with shard_db(db_path) as shard:
+        shard.execute(
+            f"DELETE FROM email_outbox WHERE id IN ({', '.join('?' for _ in rows)})",
+            [row["id"] for row in rows]
+        )
+    return queued
+
+
+def relay_all() -> int:
+    """Periodic job: relay staged emails left in any shard."""
+    queued = 0
+    for db_path in list_shards():
+        try:
+            queued += relay(db_path)
+        except sqlite3.Error as e:
+            logger.error(f"Email relay failed for {os.path.basename(db_path)}: {e}")
+    if queued:
+        logger.info(f"Relayed {queued} staged emails from weekly shards")
+    return queued
+
+
+def deliver(kind: str, payload: dict):
+    """Send one outbox message through app.email_utils."""
+    name, arguments = HANDLERS[kind]
+    getattr(email_utils, name)(*arguments(payload))
+
+
+class OutboxWorker:
+    """Pool of threads draining email_outbox.
+
+    Each round a worker claims a batch of due rows by pushing their
+    next_attempt_at out by the lease, sends them, and marks each sent,
+    rescheduled with exponential backoff, or dead after max_attempts.
+    Rows claimed by a worker that died become due again once the lease
+    expires, so every message is delivered at least once.
+    """
+
+    def __init__(self, workers: int = EMAIL_OUTBOX_WORKERS,
+                 batch_size: int = EMAIL_OUTBOX_BATCH,
+                 poll_seconds: float = EMAIL_OUTBOX_POLL_SECONDS,
+                 max_attempts: int = EMAIL_OUTBOX_MAX_ATTEMPTS):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self._threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self._send_total = 0.0
+        self._send_max = 0.0
+
+    def enqueued_one(self):
+        with self._lock:
+            self.enqueued += 1
+        self._wake.set()
+
+    def _claim(self) -> list:
+        now = time.time()
+        with get_db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("""
+                UPDATE email_outbox
+                SET attempts = attempts + 1, next_attempt_at = ?
+                WHERE id IN (
+                    SELECT id FROM email_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at LIMIT ?
+                )
+                RETURNING id, kind, payload, attempts
+            """, (now + EMAIL_OUTBOX_LEASE_SECONDS, now, self.batch_size)).fetchall()
+        return [dict(row) for row in rows]
+
+    def _finish(self, row: dict, error: Optional[str]):
+        with get_db() as conn:
+            if error is None:
+                conn.execute(
+                    "UPDATE email_outbox SET status = 'sent', sent_at = ?, last_error = NULL WHERE id = ?",
+                    (_now(), row["id"])
+                )
+            elif row["attempts"] >= self.max_attempts:
+                conn.execute(
+                    "UPDATE email_outbox SET status = 'dead', last_error = ? WHERE id = ?",
+                    (error, row["id"])
+                )
+            else:
+                conn.execute(
+                    "UPDATE email_outbox SET next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    (time.time() + backoff_seconds(row["attempts"]), error, row["id"])
+                )
+
+    def drain_once(self) -> int:
+        """Claim and process one batch; returns how many rows were handled."""
+        rows = self._claim()
+        for row in rows:
+            started = time.perf_counter()
+            error = None
+            try:
+                deliver(row["kind"], json.loads(row["payload"]))
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+            elapsed = time.perf_counter() - started
+            self._finish(row, error)
+            with self._lock:
+                self._send_total += elapsed
+                self._send_max = max(self._send_max, elapsed)
+                if error is None:
+                    self.sent += 1
+                elif row["attempts"] >= self.max_attempts:
+                    self.dead += 1
+                    logger.error(f"Email {row['id']} ({row['kind']}) dead-lettered: {error}")
+                else:
+                    self.retried += 1
+                    logger.warning(f"Email {row['id']} ({row['kind']}) attempt {row['attempts']} failed: {error}")
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.drain_once():
+                    continue
+            except Exception as e:
+                logger.error(f"Email outbox worker error: {e}")
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._run, daemon=True, name=f"email-outbox-{i}")
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self) -> dict:
+        with get_db() as conn:
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM email_outbox GROUP BY status"
+            ).fetchall())
+            oldest = conn.execute(
+                "SELECT MIN(next_attempt_at) FROM email_outbox WHERE status = 'pending'"
+            ).fetchone()[0]
+        with self._lock:
+            done = (self.sent + self.retried + self.dead) or 1
+            return {
+                "workers": len(self._threads),
+                "pending": counts.get("pending", 0),
+                "dead_letters": counts.get("dead", 0),
+                "oldest_due_seconds": round(max(time.time() - oldest, 0), 3) if oldest else 0,
+                "enqueued": self.enqueued,
+                "sent": self.sent,
+                "retried": self.retried,
+                "dead": self.dead,
+                "avg_send_ms": round(self._send_total / done * 1000, 3),
+                "max_send_ms": round(self._send_max * 1000, 3),
+            }
+
+
+outbox_worker = OutboxWorker()
+
+
+def dead_letters(limit: int = 100) -> list:
+    with get_db() as conn:
+        rows = conn.execute("""
+            SELECT id, kind, payload, attempts, last_error, created_at
+            FROM email_outbox WHERE status = 'dead' ORDER BY id DESC LIMIT ?
+        """, (limit,)).fetchall()
+    return [dict(row, payload=json.loads(row["payload"])) for row in rows]
+
+
+def requeue(message_id: int) -> bool:
+    """Give a dead-lettered message a fresh set of attempts."""
+    with get_db() as conn:
+        changed = conn.execute("""
+            UPDATE email_outbox
+            SET status = 'pending', attempts = 0, next_attempt_at = ?
+            WHERE id = ? AND status = 'dead'
+        """, (time.time(), message_id)).rowcount
+    if changed:
+        outbox_worker.enqueued_one()
+    return bool(changed)
+
+
+def purge_sent_emails(days: int = EMAIL_OUTBOX_RETENTION_DAYS) -> int:
+    """Daily job: drop sent messages older than the retention window."""
+    cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    with get_db() as conn:
+        return conn.execute(
+            "DELETE FROM email_outbox WHERE status = 'sent' AND sent_at < ?", (cutoff,)
+        ).rowcount
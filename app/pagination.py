@@ -0,0 +1,84 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Sequence
+
+# Seconds a cached COUNT(*) total may be reused by paginated endpoints
+COUNT_CACHE_SECONDS = float(os.getenv("COUNT_CACHE_SECONDS", "30"))
+
+
+def encode_cursor(*values) -> str:
+    """Opaque, URL-safe cursor for a keyset position."""
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode()
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Inverse of encode_cursor; raises ValueError for malformed input."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+class CountCache:
+    """Short-lived cache of ``COUNT(*)`` results keyed by query and params.
+
+    Paginated lists only need an approximate total; recounting a large
+    table on every page request is what made deep pages slow.
+    """
+
+    def __init__(self, ttl: float = COUNT_CACHE_SECONDS, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def count(self, conn: sqlite3.Connection, sql: str, params: Sequence = ()) -> int:
+        key = (sql, tuple(params))
+        now = time.monotonic()
+        with self._lock:
+            hit = self._counts.get(key)
+            if hit and now - hit[1] < self.ttl:
+                return hit[0]
+        total = conn.execute(sql, params).fetchone()[0]
+        with self._lock:
+            if len(self._counts) >= self.max_entries:
+                self._counts.clear()
+            self._counts[key] = (total, now)
+        return total
+
+
+count_cache = CountCache()
+
+
+def keyset_page(conn: sqlite3.Connection, select_sql: str, where: List[str],
+                params: List, before: Optional[list], limit: int,
+                ts_col: str = "timestamp", id_col: str = "id"):
+    """Newest-first page of ``select_sql`` ordered by (ts_col, id_col).
+
+    ``before`` is the decoded (timestamp, id) of the last row already seen.
+    Returns ``(rows, next_before)`` where next_before is the cursor for the
+    following page, or None when this is the last one.
+    """
+    where, params = list(where), list(params)
+    if before:
+        # The leading range keeps the (..., timestamp) index usable
+        where.append(f"{ts_col} <= ? AND ({ts_col} < ? OR {id_col} < ?)")
+        params += [before[0], before[0], before[1]]
+    clause = " WHERE " + " AND ".join(where) if where else ""
+    rows = conn.execute(
+        f"{select_sql}{clause} ORDER BY {ts_col} DESC, {id_col} DESC LIMIT ?",
+        params + [limit + 1]
+    ).fetchall()
+    page = [dict(row) for row in rows[:limit]]
+    next_before = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_before = encode_cursor(last[ts_col.split(".")[-1]], last[id_col.split(".")[-1]])
+    return page, next_before
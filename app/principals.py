@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from . import database
+
+# How long a resolved principal is reused, and how many are kept
+PRINCIPAL_CACHE_SECONDS = float(os.getenv("PRINCIPAL_CACHE_SECONDS", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "1024"))
+
+# Account sources in lookup order: (schema, table, role column)
+_SOURCES = (
+    ("userdb", "users", "role"),
+    ("main", "admins", "user_type"),
+    ("userdb", "admins", "user_type"),
+)
+
+
+def _tables(conn, schema: str) -> set:
+    return {row[0] for row in conn.execute(
+        f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'"
+    )}
+
+
+def load_principal(username: str) -> Optional[dict]:
+    """Resolve ``username`` against users.db and the legacy admin tables.
+
+    users.db is attached to a pooled mh-bookings.db connection so the
+    three tables are searched with one UNION query instead of three
+    separate connections; the first source in _SOURCES wins.
+    """
+    users_path = os.path.join(database.DB_DIR, "users.db")
+    attached = os.path.exists(users_path)
+    with database.get_db() as conn:
+        if attached:
+            conn.execute("ATTACH DATABASE ? AS userdb", (users_path,))
+        try:
+            present = {("main", name) for name in _tables(conn, "main")}
+            if attached:
+                present |= {("userdb", name) for name in _tables(conn, "userdb")}
+            parts = [
+                f"SELECT {rank} AS source, id, username, {role} AS role, password_hash "
+                f"FROM {schema}.{table} WHERE username = :username"
+                for rank, (schema, table, role) in enumerate(_SOURCES)
+                if (schema, table) in present
+            ]
+            row = None
+            if parts:
+                row = conn.execute(
+                    " UNION ALL ".join(parts) + " ORDER BY source LIMIT 1",
+                    {"username": username}
+                ).fetchone()
+        finally:
+            if attached:
+                conn.execute("DETACH DATABASE userdb")
+    if row is None:
+        return None
+    principal = dict(row)
+    del principal["source"]
+    return principal
+
+
+class PrincipalCache:
+    """TTL + LRU cache of resolved principals keyed by (username, token iat).
+
+    Keying on the token's issue time means a fresh login always resolves
+    again. Account changes call invalidate(); other worker processes
+    notice them within ``ttl`` seconds.
+    """
+
+    def __init__(self, loader=load_principal, ttl: float = PRINCIPAL_CACHE_SECONDS,
+                 max_entries: int = PRINCIPAL_CACHE_SIZE):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, username: str, issued_at=None) -> Optional[dict]:
+        key = (username, issued_at)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        principal = self.loader(username)
+        if principal is not None:
+            with self._lock:
+                self._entries[key] = (principal, now)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return principal
+
+    def invalidate(self, username: str):
+        """Forget every cached principal for ``username``."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == username]:
+                del self._entries[key]
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "ttl_seconds": self.ttl,
+            }
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,113 @@
+import sqlite3
+from datetime import datetime
+from typing import Callable, Optional
+from zoneinfo import ZoneInfo
+
+from .availability import occupancy_cache, read_tag
+from .database import SLOT_CAPACITY, SLOT_FULL_MESSAGE
+
+BOOKING_COLUMNS = (
+    "name", "phone", "email", "address", "city", "zipcode", "date",
+    "time_slot", "contact_preference",
+)
+
+
+class SlotFullError(Exception):
+    """Raised when a slot has no capacity left."""
+
+
+def reserve_slot(conn: sqlite3.Connection, booking: dict,
+                 in_transaction: Optional[Callable] = None):
+    """Atomically claim capacity for ``booking`` and insert it.
+
+    The shard's triggers keep ``slot_counts`` exact and abort an INSERT
+    into a full slot, so the capacity check and the insert are one
+    statement inside a ``BEGIN IMMEDIATE`` transaction; concurrent
+    requests (threads or worker processes) can never overbook. Returns
+    ``(booking_id, booked)`` where ``booked`` is the slot's occupancy
+    after the insert; raises SlotFullError if the slot is full.
+    ``booking["created_at"]`` is filled in when missing; optional
+    ``reminder_due_at``/``admin_notify_due_at`` set the deposit deadlines,
+    and ``booking["id"]`` is set. ``in_transaction(conn, booking)`` runs
+    before the commit, e.g. to stage the booking's emails atomically.
+    The occupancy cache is updated with the shard versions read inside
+    the transaction, so concurrent writers can't leave it stale.
+    """
+    date, time_slot = booking["date"], booking["time_slot"]
+    if not booking.get("created_at"):
+        booking["created_at"] = datetime.now(
+            ZoneInfo("America/Los_Angeles")
+        ).isoformat()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        before = read_tag(conn)
+        conn.execute("""
+            INSERT OR IGNORE INTO slot_counts (date, time_slot, booked, capacity)
+            VALUES (?, ?, 0, ?)
+        """, (date, time_slot, SLOT_CAPACITY))
+        try:
+            cur = conn.execute("""
+                INSERT INTO bookings (name, phone, email, address, city,
+                                      zipcode, date, time_slot,
+                                      contact_preference, created_at,
+                                      deposit_received, reminder_due_at,
+                                      admin_notify_due_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
+            """, tuple(booking.get(col, "") for col in BOOKING_COLUMNS) + (
+                booking["created_at"], booking.get("reminder_due_at"),
+                booking.get("admin_notify_due_at"),
+            ))
+        except sqlite3.IntegrityError as e:
+            if SLOT_FULL_MESSAGE in str(e):
+                raise SlotFullError(f"{date} {time_slot} is fully booked")
+            raise
+        booking_id = booking["id"] = cur.lastrowid
+        if in_transaction:
+            in_transaction(conn, booking)
+        booked = conn.execute(
+            "SELECT booked FROM slot_counts WHERE date = ? AND time_slot = ?",
+            (date, time_slot)
+        ).fetchone()[0]
+        after = read_tag(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    occupancy_cache.record(date, time_slot, booked, before, after)
+    return booking_id, booked
+
+
+def release_slot(conn: sqlite3.Connection, booking_id: int,
+                 in_transaction: Optional[Callable] = None):
+    """Atomically delete a booking; the delete trigger frees its capacity.
+
+    Returns ``(booking, booked)`` with the deleted row and the slot's
+    occupancy afterwards, or ``(None, 0)`` if the booking does not exist.
+    ``in_transaction(conn, booking)`` runs with the deleted row before the
+    commit.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        before = read_tag(conn)
+        booking = conn.execute(
+            "SELECT * FROM bookings WHERE id = ?", (booking_id,)
+        ).fetchone()
+        if booking is None:
+            conn.rollback()
+            return None, 0
+        date, time_slot = booking["date"], booking["time_slot"]
+        conn.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
+        if in_transaction:
+            in_transaction(conn, dict(booking))
+        row = conn.execute(
+            "SELECT booked FROM slot_counts WHERE date = ? AND time_slot = ?",
+            (date, time_slot)
+        ).fetchone()
+        booked = row[0] if row else 0
+        after = read_tag(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    occupancy_cache.record(date, time_slot, booked, before, after)
+    return booking, booked
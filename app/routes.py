@@ -1,37 +1,56 @@
 from fastapi import (
-    APIRouter, HTTPException, Depends, BackgroundTasks, Body, Request, Form
+    APIRouter, HTTPException, Depends, Body, Request, Form,
+    Query
 )
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import StreamingResponse
-from .database import get_week_db, get_user_db
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from .database import (
+    week_db, week_db_path, shard_db, booking_db_path, get_user_db, get_db,
+    TIME_SLOTS
+)
 from .auth import (
-    hash_password, verify_password, create_access_token, decode_access_token
+    HashingOverloaded, create_access_token, decode_access_token, password_hasher,
+    token_cache
 )
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from typing import List
+from typing import Dict, List, Optional
 import os
 import sqlite3
-import csv
-from .email_utils import (
-    send_booking_email,
-    send_customer_confirmation,
-    send_waitlist_confirmation,
-    send_waitlist_slot_opened,
-    send_waitlist_position_email,
-    send_deposit_confirmation_email,
-    send_booking_cancellation_email,
-)
+import json
+from itertools import islice
 from .models import (
     BookingCreate, WaitlistCreate, CancelBookingRequest, WaitlistEntry
 )
 import logging
-from .deposit_tasks import schedule_deposit_jobs
-from .utils import (
-    get_latest_user_info, upsert_newsletter_entry, notify_all_waitlist_users
-)
+from .deposit_tasks import deposit_deadlines, sweeper_stats
+from .email_utils import get_transport
+from .principals import principal_cache
+from .utils import get_latest_user_info, upsert_newsletter_entry
 from .websocket_manager import websocket_manager
-from io import StringIO
+from .db_executor import run_db, db_executor
+from .reservations import reserve_slot, release_slot, SlotFullError
+from . import booking_events, outbox
+from .customers import CUSTOMER_SORT_COLUMNS, list_customers
+from .customer_analytics import customer_analytics
+from .kpis import kpi_cache
+from .email_index import shards_for_email, shards_for_emails
+from .pagination import count_cache, decode_cursor, encode_cursor, keyset_page
+from .newsletter_search import SEARCH_FIELDS, search_recipients, substring_filter
+from .newsletter_delivery import (
+    campaign_progress, create_campaign, failed_deliveries, newsletter_sender
+)
+from .exports import (
+    BOOKING_COLUMNS as EXPORT_BOOKING_COLUMNS, NEWSLETTER_COLUMNS,
+    export_stream, iter_booking_export, iter_newsletter, select_columns
+)
+from .availability import (
+    availability_etag, cache_headers, date_range, etag_matches, invalid_dates,
+    live_tags, occupancy, occupancy_cache, slot_status, slot_statuses, MAX_BULK_DATES
+)
+from .shards import (
+    query_shards, count_shards, iter_bookings, list_shards, shards_for_range
+)
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
@@ -46,6 +65,8 @@ logger = logging.getLogger("booking")
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/booking/token")
 limiter = Limiter(key_func=get_remote_address)
+# Customers whose booking histories are fetched per round of shard queries
+HISTORY_CHUNK = int(os.getenv("HISTORY_CHUNK", "500"))
 
 
 def get_current_user(token: str = Depends(oauth2_scheme)):
@@ -53,46 +74,12 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    username = payload["sub"]
-    
-    # First check users table
-    conn = get_user_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user = c.fetchone()
-    if user:
-        return user
-    
-    # Then check admins table in main database
-    with sqlite3.connect("mh-bookings.db") as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM admins WHERE username = ?", (username,))
-        admin = cursor.fetchone()
-        if admin:
-            # Convert admin to user-like format for compatibility
-            return {
-                "id": admin["id"],
-                "username": admin["username"],
-                "role": admin["user_type"],
-                "password_hash": admin["password_hash"]
-            }
-    
-    # Check admins table in users database
-    conn = get_user_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM admins WHERE username = ?", (username,))
-    admin = c.fetchone()
-    if admin:
-        # Convert admin to user-like format for compatibility
-        return {
-            "id": admin["id"],
-            "username": admin["username"],
-            "role": admin["user_type"],
-            "password_hash": admin["password_hash"]
-        }
-    
-    raise HTTPException(status_code=401, detail="User not found")
+    # users (users.db), then admins (mh-bookings.db), then admins (users.db);
+    # cached per token issue time, see app.principals
+    user = principal_cache.get(payload["sub"], payload.get("iat"))
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    return user
 
 
 @router.get("/me")
@@ -118,6 +105,18 @@ def admin_required(user=Depends(get_current_user)):
     return user
 
 
+def _hashing(call, *args, **kwargs):
+    """Run a password_hasher call, answering 429 while it is saturated."""
+    try:
+        return call(*args, **kwargs)
+    except HashingOverloaded:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many sign-in attempts in progress, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
+
+
 @router.post("/token")
 def login(form_data: OAuth2PasswordRequestForm = Depends()):
     """Authenticate user and return a JWT access token."""
@@ -125,8 +124,17 @@ def login(form_data: OAuth2PasswordRequestForm = Depends()):
     c = conn.cursor()
     c.execute("SELECT * FROM users WHERE username = ?", (form_data.username,))
     user = c.fetchone()
-    if not user or not verify_password(form_data.password, user["password_hash"]):
+    if not user:
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    ok, new_hash = _hashing(
+        password_hasher.verify_and_update, form_data.password,
+        user["password_hash"], op="login"
+    )
+    if not ok:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
+    if new_hash:
+        c.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, user["id"]))
+        conn.commit()
     access_token = create_access_token(data={"sub": user["username"], "role": user["role"]})
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -153,7 +161,16 @@ def admin_login(credentials: dict):
     )
     user = c.fetchone()
     
-    if user and verify_password(password, user["password_hash"]):
+    ok, new_hash = False, None
+    if user:
+        ok, new_hash = _hashing(
+            password_hasher.verify_and_update, password,
+            user["password_hash"], op="admin_login"
+        )
+    if ok:
+        if new_hash:
+            c.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, user["id"]))
+            conn.commit()
         access_token = create_access_token(
             data={"sub": user["username"], "role": user["role"]}
         )
@@ -173,7 +190,18 @@ def admin_login(credentials: dict):
         )
         admin = cursor.fetchone()
         
-        if admin and verify_password(password, admin["password_hash"]):
+        ok, new_hash = False, None
+        if admin:
+            ok, new_hash = _hashing(
+                password_hasher.verify_and_update, password,
+                admin["password_hash"], op="admin_login"
+            )
+        if ok:
+            if new_hash:
+                cursor.execute(
+                    "UPDATE admins SET password_hash = ? WHERE id = ?",
+                    (new_hash, admin["id"])
+                )
             access_token = create_access_token(
                 data={"sub": admin["username"], "role": admin["user_type"]}
             )
@@ -193,6 +221,7 @@ def create_admin(
     user=Depends(superadmin_required)
 ):
     """Create a new admin user (superadmin only)."""
+    password_hash = _hashing(password_hasher.hash, password, op="create_admin")
     conn = get_user_db()
     c = conn.cursor()
     try:
@@ -205,7 +234,7 @@ def create_admin(
                              password_reset_required, created_by)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
-            username, hash_password(password), "admin", username.title(),
+            username, password_hash, "admin", username.title(),
             f"{username}@myhibachi.com", current_time, current_time, 1, 0,
             user["username"]
         ))
@@ -270,6 +299,8 @@ def delete_admin(admin_username: str, user=Depends(superadmin_required)):
         f"Deleted admin account: {admin_username}", current_time
     ))
     conn.commit()
+    principal_cache.invalidate(admin_username)
+    token_cache.revoke(admin_username)
     
     return {"message": f"Admin '{admin_username}' deleted successfully"}
 
@@ -299,7 +330,8 @@ def reset_admin_password(admin_username: str, new_password: str = None, user=Dep
         UPDATE users 
         SET password_hash = ?, updated_at = ?, password_reset_required = 1
         WHERE username = ? AND role = 'admin'
-    """, (hash_password(password), current_time, admin_username))
+    """, (_hashing(password_hasher.hash, password, op="reset_admin_password"),
+          current_time, admin_username))
     
     # Log the action
     c.execute("""
@@ -310,6 +342,7 @@ def reset_admin_password(admin_username: str, new_password: str = None, user=Dep
         f"Reset password for admin: {admin_username}", current_time
     ))
     conn.commit()
+    principal_cache.invalidate(admin_username)
     
     return {"message": f"Password reset for admin '{admin_username}'", "new_password": password}
 
@@ -367,23 +400,43 @@ def update_admin(admin_username: str, full_name: str = None, email: str = None,
         user["id"], "update_admin", admin_username, details, current_time
     ))
     conn.commit()
+    principal_cache.invalidate(admin_username)
     
     return {"message": f"Admin '{admin_username}' updated successfully"}
 
 @router.get("/superadmin/activity_logs")
-def get_admin_activity_logs(limit: int = 100, user=Depends(superadmin_required)):
-    """Get admin activity logs (superadmin only)."""
+def get_admin_activity_logs(limit: int = 100, before: Optional[str] = None,
+                            action: Optional[str] = None,
+                            user=Depends(superadmin_required)):
+    """Get admin activity logs, newest first (superadmin only).
+
+    Pass the returned ``next_before`` as ``before`` for the next page.
+    """
+    where, params = [], []
+    if action:
+        where.append("ual.action = ?")
+        params.append(action)
     conn = get_user_db()
-    c = conn.cursor()
-    c.execute("""
-        SELECT ual.*, u.username as actor_username
-        FROM user_activity_logs ual
-        LEFT JOIN users u ON ual.user_id = u.id
-        ORDER BY ual.timestamp DESC
-        LIMIT ?
-    """, (limit,))
-    logs = [dict(row) for row in c.fetchall()]
-    return {"logs": logs}
+    try:
+        logs, next_before = keyset_page(
+            conn,
+            """
+                SELECT ual.*, u.username as actor_username
+                FROM user_activity_logs ual
+                LEFT JOIN users u ON ual.user_id = u.id
+            """,
+            where, params, _decode_cursor(before, 2), limit,
+            ts_col="ual.timestamp", id_col="ual.id"
+        )
+        total = count_cache.count(
+            conn,
+            "SELECT COUNT(*) FROM user_activity_logs ual"
+            + (" WHERE " + " AND ".join(where) if where else ""),
+            params
+        )
+    finally:
+        conn.close()
+    return {"logs": logs, "total": total, "next_before": next_before}
 
 @router.post("/admin/change_password")
 def change_own_password(
@@ -393,7 +446,8 @@ def change_own_password(
 ):
     """Allow admin to change their own password."""
     # Verify current password
-    if not verify_password(current_password, user["password_hash"]):
+    if not _hashing(password_hasher.verify, current_password,
+                    user["password_hash"], op="change_own_password"):
         raise HTTPException(
             status_code=400, 
             detail="Current password is incorrect"
@@ -407,7 +461,8 @@ def change_own_password(
         UPDATE users
         SET password_hash = ?, updated_at = ?, password_reset_required = 0
         WHERE id = ?
-    """, (hash_password(new_password), current_time, user["id"]))
+    """, (_hashing(password_hasher.hash, new_password, op="change_own_password"),
+          current_time, user["id"]))
 
     # Log the action
     c.execute("""
@@ -419,44 +474,43 @@ def change_own_password(
         "Changed own password", current_time
     ))
     conn.commit()
+    principal_cache.invalidate(user["username"])
 
     return {"message": "Password changed successfully"}
 
+def _stage_booking_emails(conn, booking):
+    outbox.stage(conn, "booking_notification", {"booking": booking},
+                 f"booking:{booking['id']}:notification")
+    outbox.stage(conn, "customer_confirmation", {"booking": booking},
+                 f"booking:{booking['id']}:confirmation")
+
+
+def _insert_booking(data: BookingCreate):
+    """Reserve the slot and insert a booking; returns (booking_id, count)."""
+    booking = data.model_dump()
+    booking.update(deposit_deadlines())
+    with week_db(data.date) as conn:
+        try:
+            booking_id, count = reserve_slot(conn, booking, _stage_booking_emails)
+        except SlotFullError:
+            raise HTTPException(status_code=400, detail="This slot is fully booked.")
+    booking_events.booking_created(booking)
+    # The emails were staged in the shard with the booking; queue them now
+    outbox.relay(week_db_path(data.date))
+    logger.info(f"Booking count for {data.date} {data.time_slot}: {count}")
+    return booking_id, count
+
+
 @router.post("/book")
 @limiter.limit("5/minute")
-async def book_service(data: BookingCreate, background_tasks: BackgroundTasks, request: Request):
-    """Create a new booking and send confirmation emails."""
+async def book_service(data: BookingCreate, request: Request):
+    """Create a new booking and queue its confirmation emails."""
     logger.info(f"Received booking request: {data.model_dump()}")
     
-    conn = get_week_db(data.date)
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM bookings WHERE date = ? AND time_slot = ?", (data.date, data.time_slot))
-    count = c.fetchone()[0]
-    logger.info(f"Booking count for {data.date} {data.time_slot}: {count}")
-    if count >= 2:
-        raise HTTPException(status_code=400, detail="This slot is fully booked.")
-    
-    # Insert the booking
-    c.execute("""
-        INSERT INTO bookings (name, phone, email, address, city, zipcode, date, time_slot, contact_preference, created_at, deposit_received)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        data.name, data.phone, data.email, data.address, data.city, data.zipcode,
-        data.date, data.time_slot, data.contact_preference,
-        datetime.now(ZoneInfo("America/Los_Angeles")).isoformat(),
-        0  # deposit_received
-    ))
-    booking_id = c.lastrowid
-    conn.commit()
+    booking_id, new_count = await run_db(_insert_booking, data)
     
-    # Calculate new status after booking
-    new_count = count + 1
-    if new_count == 1:
-        new_status = "waiting"
-    elif new_count >= 2:
-        new_status = "booked"
-    else:
-        new_status = "available"
+    # reserve_slot/release_slot keep the occupancy cache current
+    new_status = slot_status(new_count)
     
     # Send real-time WebSocket notification
     try:
@@ -469,12 +523,8 @@ async def book_service(data: BookingCreate, background_tasks: BackgroundTasks, r
     except Exception as e:
         logger.error(f"Failed to send WebSocket notification: {e}")
     
-    # Background tasks
-    background_tasks.add_task(send_booking_email, data)
-    background_tasks.add_task(send_customer_confirmation, data)
-    schedule_deposit_jobs(booking_id, data.date)
     # Upsert newsletter entry
-    upsert_newsletter_entry(data.model_dump(), "booking")
+    await run_db(upsert_newsletter_entry, data.model_dump(), "booking")
     return {"message": "Booking successful", "booking_id": booking_id}
 
 # Example for any admin route in app/routes.py
@@ -485,16 +535,20 @@ def admin_weekly(start_date: str, user=Depends(admin_required)):
         date = datetime.strptime(start_date, "%Y-%m-%d")
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format")
-    year, week, _ = date.isocalendar()
-    db_path = os.path.join("backend/weekly_databases", f"bookings_{year}-{week:02d}.db")
+    db_path = week_db_path(date.strftime("%Y-%m-%d"))
     if not os.path.exists(db_path):
         return []
-    with sqlite3.connect(db_path) as conn:
-        conn.row_factory = sqlite3.Row
+    with shard_db(db_path) as conn:
         c = conn.cursor()
         c.execute("SELECT * FROM bookings ORDER BY date, time_slot, created_at")
         return [dict(row) for row in c.fetchall()]
 
+def _booking_order(booking):
+    """Merge key matching ORDER BY date, time_slot, created_at."""
+    return (booking["date"] or "", booking["time_slot"] or "",
+            booking["created_at"] or "")
+
+
 @router.get("/admin/monthly")
 def admin_monthly(year: int, month: int, user=Depends(admin_required)):
     """Get all bookings for a given month (admin only)."""
@@ -502,87 +556,103 @@ def admin_monthly(year: int, month: int, user=Depends(admin_required)):
     from datetime import date as dt_date
     first_day = dt_date(year, month, 1)
     last_day = dt_date(year, month, monthrange(year, month)[1])
-    week_files = set()
-    day = first_day
-    while day <= last_day:
-        y, w, _ = day.isocalendar()
-        week_files.add((y, w))
-        day += timedelta(days=1)
-    bookings = []
-    for y, w in week_files:
-        db_path = os.path.join("backend/weekly_databases", f"bookings_{y}-{w:02d}.db")
-        if os.path.exists(db_path):
-            with sqlite3.connect(db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                c = conn.cursor()
-                c.execute("SELECT * FROM bookings WHERE date BETWEEN ? AND ? ORDER BY date, time_slot, created_at",
-                          (first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")))
-                bookings.extend([dict(row) for row in c.fetchall()])
-    return bookings
+    return query_shards(
+        "SELECT * FROM bookings WHERE date BETWEEN ? AND ? ORDER BY date, time_slot, created_at",
+        (first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")),
+        shards=shards_for_range(first_day, last_day),
+        key=_booking_order
+    )
+
+def _conditional(request: Request, dates: List[str], render):
+    """304 if the client's copy is current, else ``render(counts)`` with cache headers.
+
+    The live shard tags decide the 304 without building a payload. A
+    payload gets the ETag of the tags its counts were actually served at,
+    so a tag never vouches for data other than what it came with.
+    """
+    tags = live_tags(dates)
+    etag = availability_etag(dates, tags)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers(etag))
+    counts, tags = occupancy(dates, tags)
+    return JSONResponse(
+        render(counts), headers=cache_headers(availability_etag(dates, tags))
+    )
+
 
 @router.get("/availability")
-def get_availability(date: str):
+def get_availability(date: str, request: Request):
     """Get availability status for each time slot on a given date."""
-    conn = get_week_db(date)
-    c = conn.cursor()
-    c.execute(
-        "SELECT time_slot, COUNT(*) as count FROM bookings WHERE date = ? GROUP BY time_slot",
-        (date,)
+    if invalid_dates([date]):
+        raise HTTPException(status_code=400, detail="date must be a valid YYYY-MM-DD date")
+    return _conditional(
+        request, [date], lambda counts: slot_statuses(counts[date])
     )
-    slots = {row["time_slot"]: row["count"] for row in c.fetchall()}
-    all_slots = ['12:00 PM', '3:00 PM', '6:00 PM', '9:00 PM']
-    result = {}
-    for slot in all_slots:
-        count = slots.get(slot, 0)
-        if count == 0:
-            status = "available"
-        elif count == 1:
-            status = "waiting"
-        else:
-            status = "booked"
-        result[slot] = {"status": status}
-    return result
+
+def _requested_dates(dates: Optional[List[str]], start: Optional[str],
+                     end: Optional[str]) -> List[str]:
+    """Resolve an explicit date list and/or a start/end range.
+
+    Any entry that is not a YYYY-MM-DD date fails the whole request with
+    a 400 naming it, rather than being reported as available.
+    """
+    requested = list(dates or [])
+    invalid = invalid_dates(requested + [d for d in (start, end) if d])
+    if invalid:
+        raise HTTPException(
+            status_code=400,
+            detail=f"invalid dates (expected YYYY-MM-DD): {', '.join(map(str, invalid))}"
+        )
+    if start or end:
+        try:
+            requested += date_range(start or end, end or start)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if len(requested) > MAX_BULK_DATES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"at most {MAX_BULK_DATES} dates per request"
+        )
+    return requested
+
+
+def _bulk_conditional(request: Request, dates: List[str]):
+    return _conditional(
+        request, dates,
+        lambda counts: {date: slot_statuses(counts[date]) for date in dates}
+    )
+
 
 # Phase 1: Bulk availability endpoint for enhanced caching
 @router.post("/availability/bulk")
-async def get_bulk_availability(dates: List[str]):
-    """Get availability status for multiple dates at once - Phase 1 improvement"""
+async def get_bulk_availability(
+    request: Request,
+    dates: Optional[List[str]] = Body(None),
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+):
+    """Get availability for a list of dates and/or a start..end range.
+
+    Responses carry an ETag; clients may send it back as If-None-Match
+    and get a 304 when nothing changed.
+    """
+    requested = _requested_dates(dates, start, end)
     try:
-        result = {}
-        
-        for date in dates:
-            try:
-                conn = get_week_db(date)
-                c = conn.cursor()
-                c.execute(
-                    "SELECT time_slot, COUNT(*) as count FROM bookings WHERE date = ? GROUP BY time_slot",
-                    (date,)
-                )
-                slots = {row["time_slot"]: row["count"] for row in c.fetchall()}
-                all_slots = ['12:00 PM', '3:00 PM', '6:00 PM', '9:00 PM']
-                
-                date_result = {}
-                for slot in all_slots:
-                    count = slots.get(slot, 0)
-                    if count == 0:
-                        status = "available"
-                    elif count == 1:
-                        status = "waiting"
-                    else:
-                        status = "booked"
-                    date_result[slot] = {"status": status}
-                
-                result[date] = date_result
-                
-            except Exception as e:
-                logger.warning(f"Error fetching availability for {date}: {e}")
-                # Return default available status on error
-                result[date] = {
-                    slot: {"status": "available"} for slot in ['12:00 PM', '3:00 PM', '6:00 PM', '9:00 PM']
-                }
-        
-        return result
-        
+        return await run_db(_bulk_conditional, request, requested)
+    except Exception as e:
+        logger.error(f"Bulk availability error: {e}")
+        raise HTTPException(status_code=500, detail="Error fetching bulk availability")
+
+
+@router.get("/availability/bulk")
+async def get_bulk_availability_range(start: str, end: str, request: Request):
+    """Get availability for every date from start to end (inclusive).
+
+    Same payload as the POST form but cacheable by browsers and the CDN.
+    """
+    requested = _requested_dates(None, start, end)
+    try:
+        return await run_db(_bulk_conditional, request, requested)
     except Exception as e:
         logger.error(f"Bulk availability error: {e}")
         raise HTTPException(status_code=500, detail="Error fetching bulk availability")
@@ -590,16 +660,14 @@ async def get_bulk_availability(dates: List[str]):
 
 @router.post("/waitlist")
 @limiter.limit("10/minute")  # 10 waitlist joins per minute per IP
-def join_waitlist(data: WaitlistCreate, background_tasks: BackgroundTasks, request: Request):
-    """Add a user to the waitlist, send confirmation and position email."""
-    from .database import get_db
+def join_waitlist(data: WaitlistCreate, request: Request):
+    """Add a user to the waitlist and queue the confirmation and position emails."""
     with get_db() as conn:
         c = conn.cursor()
         c.execute("""
             INSERT INTO waitlist (name, phone, email, preferred_date, preferred_time)
             VALUES (?, ?, ?, ?, ?)
         """, (data.name, data.phone, data.email, data.preferred_date, data.preferred_time))
-        conn.commit()
         # Get the user's position in the waitlist for this slot
         c.execute("""
             SELECT id FROM waitlist
@@ -608,113 +676,100 @@ def join_waitlist(data: WaitlistCreate, background_tasks: BackgroundTasks, reque
         """, (data.preferred_date, data.preferred_time))
         ids = [row[0] for row in c.fetchall()]
         position = ids.index(c.lastrowid) + 1 if c.lastrowid in ids else len(ids)
-    background_tasks.add_task(send_waitlist_confirmation, data.dict())
-    background_tasks.add_task(send_waitlist_position_email, data.dict(), position)
+        outbox.enqueue("waitlist_confirmation", {"waitlist": data.dict()}, conn)
+        outbox.enqueue("waitlist_position", {"waitlist": data.dict(), "position": position}, conn)
     # Upsert newsletter entry
     upsert_newsletter_entry(data.dict(), "waitlist")
     return {"message": f"Added to waitlist. You are number {position} in line."}
 
+def _delete_booking(booking_id: int, reason: str = ""):
+    """Delete a booking and queue the cancellation and waitlist emails;
+    returns (booking, remaining count) or (None, 0)."""
+    db_path = booking_db_path(booking_id)
+    if db_path is None:
+        return None, 0
+
+    def stage_emails(conn, booking):
+        outbox.stage(conn, "booking_cancellation", {"booking": booking, "reason": reason},
+                     f"booking:{booking_id}:cancellation")
+        outbox.stage(conn, outbox.SLOT_OPENED,
+                     {"date": booking["date"], "time_slot": booking["time_slot"]},
+                     f"booking:{booking_id}:slot_opened")
+
+    with shard_db(db_path) as conn:
+        booking, count = release_slot(conn, booking_id, stage_emails)
+    if booking is not None:
+        booking = dict(booking)
+        booking_events.booking_cancelled(booking)
+        outbox.relay(db_path)
+    return booking, count
+
+
 @router.delete("/admin/cancel_booking")
 async def cancel_booking(
     booking_id: int,
     body: CancelBookingRequest = Body(...),
     user=Depends(admin_required)
 ):
-    """Cancel a booking by ID, send cancellation email, and log the action (admin only)."""
+    """Cancel a booking by ID, queue the cancellation email, and log the action (admin only)."""
     reason = body.reason
-    db_folder = "backend/weekly_databases"
-    found = False
-    cancelled_booking = None
-    for db_file in os.listdir(db_folder):
-        if db_file.endswith(".db"):
-            db_path = os.path.join(db_folder, db_file)
-            with sqlite3.connect(db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                c = conn.cursor()
-                c.execute("SELECT * FROM bookings WHERE id = ?", (booking_id,))
-                booking = c.fetchone()
-                if booking:
-                    # Check count before deletion for WebSocket notification
-                    c.execute("SELECT COUNT(*) FROM bookings WHERE date = ? AND time_slot = ?", 
-                             (booking["date"], booking["time_slot"]))
-                    count_before = c.fetchone()[0]
-                    
-                    c.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
-                    conn.commit()
-                    found = True
-                    cancelled_booking = dict(booking)
-                    logger.info(f"Admin {user['username']} cancelled booking {booking_id} for reason: {reason}")
-                    
-                    # Calculate new status after cancellation
-                    new_count = count_before - 1
-                    if new_count == 0:
-                        new_status = "available"
-                    elif new_count == 1:
-                        new_status = "waiting"
-                    else:
-                        new_status = "booked"
-                    
-                    # Send real-time WebSocket notification
-                    try:
-                        await websocket_manager.notify_availability_change(
-                            booking["date"], 
-                            booking["time_slot"], 
-                            new_status
-                        )
-                        logger.info(f"WebSocket notification sent for cancellation {booking['date']} {booking['time_slot']}: {new_status}")
-                    except Exception as e:
-                        logger.error(f"Failed to send WebSocket notification: {e}")
-                    
-                    try:
-                        # Create a booking object for the new email function
-                        booking_obj = type("Booking", (), {
-                            "name": cancelled_booking['name'],
-                            "email": cancelled_booking['email'],
-                            "phone": cancelled_booking['phone'],
-                            "date": cancelled_booking['date'],
-                            "time_slot": cancelled_booking['time_slot'],
-                            "address": cancelled_booking['address'],
-                            "city": cancelled_booking['city'],
-                            "zipcode": cancelled_booking['zipcode']
-                        })()
-                        
-                        send_booking_cancellation_email(booking_obj, reason)
-                    except Exception as e:
-                        logger.error(f"Failed to send cancellation email: {e}")
-                    # Notify the first user on the waitlist for this slot
-                    notify_all_waitlist_users(booking["date"], booking["time_slot"], send_waitlist_slot_opened)
-                    break
-    if not found:
+    booking, new_count = await run_db(_delete_booking, booking_id, reason)
+    if booking is None:
         raise HTTPException(status_code=404, detail="Booking not found")
+    cancelled_booking = dict(booking)
+    logger.info(f"Admin {user['username']} cancelled booking {booking_id} for reason: {reason}")
+    
+    # reserve_slot/release_slot keep the occupancy cache current
+    new_status = slot_status(new_count)
+    
+    # Send real-time WebSocket notification
+    try:
+        await websocket_manager.notify_availability_change(
+            booking["date"], 
+            booking["time_slot"], 
+            new_status
+        )
+        logger.info(f"WebSocket notification sent for cancellation {booking['date']} {booking['time_slot']}: {new_status}")
+    except Exception as e:
+        logger.error(f"Failed to send WebSocket notification: {e}")
+    
     return {"message": "Booking cancelled", "booking": cancelled_booking}
 
 @router.post("/admin/confirm_deposit")
 def confirm_deposit(
     booking_id: int,
-    date: str,
+    date: str = None,
     reason: str = Body(..., embed=True),
     user=Depends(admin_required)
 ):
     """Admin marks a booking as deposit received and sends notification."""
     from .utils import log_activity
     
-    conn = get_week_db(date)
-    c = conn.cursor()
-    
-    # Get booking details first
-    c.execute("SELECT * FROM bookings WHERE id = ?", (booking_id,))
-    booking = c.fetchone()
-    if not booking:
+    db_path = booking_db_path(booking_id)
+    if db_path is None:
         raise HTTPException(status_code=404, detail="Booking not found")
-    
-    booking_dict = dict(booking)
-    
-    # Update deposit status
-    c.execute(
-        "UPDATE bookings SET deposit_received = 1 WHERE id = ?",
-        (booking_id,)
-    )
-    conn.commit()
+    with shard_db(db_path) as conn:
+        c = conn.cursor()
+        
+        # Get booking details first
+        c.execute("SELECT * FROM bookings WHERE id = ?", (booking_id,))
+        booking = c.fetchone()
+        if not booking:
+            raise HTTPException(status_code=404, detail="Booking not found")
+        
+        booking_dict = dict(booking)
+        
+        # Update deposit status; the deposit sweeper skips paid bookings
+        c.execute("""
+            UPDATE bookings
+            SET deposit_received = 1, reminder_due_at = NULL, admin_notify_due_at = NULL
+            WHERE id = ?
+        """, (booking_id,))
+        # Stage the email to customer and info@myhibachichef.com with the update
+        outbox.stage(conn, "deposit_confirmation", {"booking": booking_dict, "reason": reason},
+                     f"booking:{booking_id}:deposit")
+        conn.commit()
+    outbox.relay(db_path)
     
     # Log the activity
     log_activity(
@@ -726,42 +781,10 @@ def confirm_deposit(
                     f"({booking_dict['name']} - {booking_dict['date']} "
                     f"{booking_dict['time_slot']})",
         reason=reason,
-        details=f"Date: {date}, Customer: {booking_dict['name']}, "
+        details=f"Date: {booking_dict['date']}, Customer: {booking_dict['name']}, "
                 f"Email: {booking_dict['email']}"
     )
     
-    # Send email notification to customer and info@myhibachichef.com
-    try:
-        # Create a booking object for the email function
-        booking_obj = type("Booking", (), {
-            "name": booking_dict['name'],
-            "email": booking_dict['email'],
-            "phone": booking_dict['phone'],
-            "date": booking_dict['date'],
-            "time_slot": booking_dict['time_slot'],
-            "address": booking_dict['address'],
-            "city": booking_dict['city'],
-            "zipcode": booking_dict['zipcode']
-        })()
-        
-        send_deposit_confirmation_email(booking_obj, reason)
-        
-        logger.info(
-            f"Deposit confirmation emails sent for booking {booking_id}"
-        )
-        
-    except Exception as e:
-        logger.error(f"Failed to send deposit confirmation email: {e}")
-        # Don't fail the whole operation if email fails
-    
-    # Optionally: Remove scheduled jobs for this booking
-    try:
-        from .deposit_tasks import scheduler
-        scheduler.remove_job(f"reminder_{booking_id}")
-        scheduler.remove_job(f"admin_notify_{booking_id}")
-    except Exception as e:
-        logger.warning(f"Failed to remove scheduled jobs: {e}")
-    
     return {"message": "Deposit confirmed and notification sent"}
 
 
@@ -818,12 +841,17 @@ def get_activity_logs(
     limit: int = 50,
     entity_type: str = None,
     action_type: str = None,
+    before: Optional[str] = None,
     user=Depends(admin_required)
 ):
-    """Get activity logs with pagination and filtering."""
+    """Get activity logs, newest first, with pagination and filtering.
+
+    Pass the returned ``next_before`` as ``before`` to fetch the next page
+    by keyset; ``page`` (offset based) is still accepted. ``total`` is
+    cached for a few seconds and may lag slightly behind new entries.
+    """
     from .database import get_db
     
-    offset = (page - 1) * limit
     where_conditions = []
     params = []
     
@@ -839,29 +867,33 @@ def get_activity_logs(
                     if where_conditions else "")
     
     with get_db() as conn:
-        c = conn.cursor()
-        
-        # Get total count
-        count_query = f"SELECT COUNT(*) FROM activity_logs{where_clause}"
-        c.execute(count_query, params)
-        total = c.fetchone()[0]
-        
-        # Get logs with pagination
-        query = f"""
-            SELECT * FROM activity_logs{where_clause}
-            ORDER BY timestamp DESC
-            LIMIT ? OFFSET ?
-        """
-        params.extend([limit, offset])
-        c.execute(query, params)
-        logs = [dict(row) for row in c.fetchall()]
+        total = count_cache.count(
+            conn, f"SELECT COUNT(*) FROM activity_logs{where_clause}", params
+        )
+        if before or page <= 1:
+            logs, next_before = keyset_page(
+                conn, "SELECT * FROM activity_logs", where_conditions, params,
+                _decode_cursor(before, 2), limit
+            )
+        else:
+            # Legacy offset paging for clients that still jump to a page
+            c = conn.cursor()
+            c.execute(f"""
+                SELECT * FROM activity_logs{where_clause}
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ? OFFSET ?
+            """, params + [limit, (page - 1) * limit])
+            logs = [dict(row) for row in c.fetchall()]
+            next_before = (encode_cursor(logs[-1]["timestamp"], logs[-1]["id"])
+                           if len(logs) == limit else None)
     
     return {
         "logs": logs,
         "total": total,
         "page": page,
         "limit": limit,
-        "total_pages": (total + limit - 1) // limit
+        "total_pages": (total + limit - 1) // limit,
+        "next_before": next_before
     }
 
 
@@ -896,94 +928,123 @@ def remove_waitlist_user(waitlist_id: int, user=Depends(admin_required)):
         conn.commit()
     return {"message": f"Waitlist entry {waitlist_id} removed."}
 
+def _move_waitlist_entry(waitlist_id: int):
+    """Book a waitlist entry into its weekly shard; returns (booking_data, count)."""
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM waitlist WHERE id = ?", (waitlist_id,))
+        entry = c.fetchone()
+    if not entry:
+        raise HTTPException(status_code=404, detail="Waitlist entry not found")
+    # Use utility to fetch latest info
+    address, city, zipcode, contact_preference = get_latest_user_info(entry["email"])
+    
+    booking_data = {
+        "name": entry["name"],
+        "phone": entry["phone"],
+        "email": entry["email"],
+        "address": address,
+        "city": city,
+        "zipcode": zipcode,
+        "date": entry["preferred_date"],
+        "time_slot": entry["preferred_time"],
+        "contact_preference": contact_preference,
+    }
+    def stage_confirmation(conn, booking):
+        outbox.stage(conn, "customer_confirmation", {"booking": booking},
+                     f"booking:{booking['id']}:confirmation")
+
+    with week_db(booking_data["date"]) as conn:
+        try:
+            booking_id, new_count = reserve_slot(conn, booking_data, stage_confirmation)
+        except SlotFullError:
+            raise HTTPException(status_code=400, detail="Slot is fully booked")
+    booking_events.booking_created(booking_data)
+    outbox.relay(week_db_path(booking_data["date"]))
+    with get_db() as conn:
+        conn.execute("DELETE FROM waitlist WHERE id = ?", (waitlist_id,))
+    return booking_data, new_count
+
+
 @router.post("/admin/waitlist/{waitlist_id}/move_to_booking")
 async def move_waitlist_to_booking(waitlist_id: int, user=Depends(admin_required)):
     """
     Admin moves a user from the waitlist to the bookings table (if slot is available).
     Fetches user info from previous bookings if available, and notifies the user.
     """
-    from .database import get_db
-    with get_db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT * FROM waitlist WHERE id = ?", (waitlist_id,))
-        entry = c.fetchone()
-        if not entry:
-            raise HTTPException(status_code=404, detail="Waitlist entry not found")
-        # Use utility to fetch latest info
-        address, city, zipcode, contact_preference = get_latest_user_info(entry["email"])
-        
-        # Check current booking count
-        c.execute(
-            "SELECT COUNT(*) FROM bookings WHERE date = ? AND time_slot = ?",
-            (entry["preferred_date"], entry["preferred_time"])
+    booking_data, new_count = await run_db(_move_waitlist_entry, waitlist_id)
+    
+    # reserve_slot/release_slot keep the occupancy cache current
+    new_status = slot_status(new_count)
+    
+    # Send real-time WebSocket notification
+    try:
+        await websocket_manager.notify_availability_change(
+            booking_data["date"], 
+            booking_data["time_slot"], 
+            new_status
         )
-        current_count = c.fetchone()[0]
-        if current_count >= 2:
-            raise HTTPException(status_code=400, detail="Slot is fully booked")
-            
-        booking_data = {
-            "name": entry["name"],
-            "phone": entry["phone"],
-            "email": entry["email"],
-            "address": address,
-            "city": city,
-            "zipcode": zipcode,
-            "date": entry["preferred_date"],
-            "time_slot": entry["preferred_time"],
-            "contact_preference": contact_preference,
-        }
-        c.execute("""
-            INSERT INTO bookings (name, phone, email, address, city, zipcode, date, time_slot, contact_preference, created_at, deposit_received)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'), 0)
-        """, (
-            booking_data["name"], booking_data["phone"], booking_data["email"], booking_data["address"],
-            booking_data["city"], booking_data["zipcode"], booking_data["date"], booking_data["time_slot"],
-            booking_data["contact_preference"]
-        ))
-        c.execute("DELETE FROM waitlist WHERE id = ?", (waitlist_id,))
-        conn.commit()
-        
-        # Calculate new status after waitlist move
-        new_count = current_count + 1
-        if new_count == 1:
-            new_status = "waiting"
-        elif new_count >= 2:
-            new_status = "booked"
-        else:
-            new_status = "available"
-        
-        # Send real-time WebSocket notification
-        try:
-            await websocket_manager.notify_availability_change(
-                booking_data["date"], 
-                booking_data["time_slot"], 
-                new_status
-            )
-            logger.info(f"WebSocket notification sent for waitlist move {booking_data['date']} {booking_data['time_slot']}: {new_status}")
-        except Exception as e:
-            logger.error(f"Failed to send WebSocket notification: {e}")
+        logger.info(f"WebSocket notification sent for waitlist move {booking_data['date']} {booking_data['time_slot']}: {new_status}")
+    except Exception as e:
+        logger.error(f"Failed to send WebSocket notification: {e}")
     
-    # Send booking confirmation email to user
-    send_customer_confirmation(type("Booking", (), booking_data))
     # Upsert newsletter entry
-    upsert_newsletter_entry(booking_data, "booking")
+    await run_db(upsert_newsletter_entry, booking_data, "booking")
     return {"message": f"Waitlist entry {waitlist_id} moved to bookings and user notified."}
 
+def _csv_response(columns, rows, filename: str, compress: bool):
+    headers = {"Content-Disposition": f"attachment; filename={filename}{'.gz' if compress else ''}"}
+    return StreamingResponse(
+        export_stream(columns, rows, compress),
+        media_type="application/gzip" if compress else "text/csv",
+        headers=headers
+    )
+
+
 @router.get("/admin/newsletter/export")
-def export_newsletter(user=Depends(admin_required)):
-    """Export all company newsletter contacts as CSV (admin only)."""
-    from .database import get_db
-    with get_db() as conn:
-        c = conn.cursor()
-        c.execute("SELECT name, phone, email, address, city, zipcode, last_activity_date, source FROM company_newsletter")
-        rows = c.fetchall()
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["name", "phone", "email", "address", "city", "zipcode", "last_activity_date", "source"])
-    for row in rows:
-        writer.writerow([row["name"], row["phone"], row["email"], row["address"], row["city"], row["zipcode"], row["last_activity_date"], row["source"]])
-    output.seek(0)
-    return StreamingResponse(output, media_type="text/csv", headers={"Content-Disposition": "attachment; filename=newsletter.csv"})
+def export_newsletter(
+    columns: Optional[str] = None,
+    city: Optional[str] = None,
+    source: Optional[str] = None,
+    active_since: Optional[str] = None,
+    gzip: bool = False,
+    user=Depends(admin_required)
+):
+    """Export company newsletter contacts as CSV (admin only).
+
+    Streams in constant memory. ``columns`` is a comma separated subset;
+    city/source/active_since select a segment; gzip=true compresses.
+    """
+    try:
+        selected = select_columns(columns, NEWSLETTER_COLUMNS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rows = iter_newsletter(selected, city, source, active_since)
+    return _csv_response(selected, rows, "newsletter.csv", gzip)
+
+
+@router.get("/admin/bookings/export")
+def export_bookings(
+    columns: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    gzip: bool = False,
+    user=Depends(admin_required)
+):
+    """Export bookings from every weekly shard as CSV (admin only).
+
+    Same options as the newsletter export; start/end (YYYY-MM-DD) limit
+    the date range.
+    """
+    try:
+        selected = select_columns(columns, EXPORT_BOOKING_COLUMNS)
+        for value in (start, end):
+            if value:
+                datetime.strptime(value, "%Y-%m-%d")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rows = iter_booking_export(selected, start, end)
+    return _csv_response(selected, rows, "bookings.csv", gzip)
 
 def notify_and_remove_waitlist_users(date, time_slot, send_func):
     from .database import get_db
@@ -1023,90 +1084,12 @@ def log_demo():
 def admin_kpis(user=Depends(admin_required)):
     """
     Returns KPIs: total bookings, bookings this week, bookings this month, waitlist count.
+    Served from the KPI counters through a stale-while-revalidate cache.
     """
     try:
-        # Calculate current week and month
-        today = datetime.now()
-        year, week, _ = today.isocalendar()
-        
-        # Weekly DB path - use same path as monthly endpoint
-        db_path = os.path.join("backend/weekly_databases", f"bookings_{year}-{week:02d}.db")
-        
-        # Total bookings (all weekly DBs)
-        total_bookings = 0
-
-        # Count bookings for this week
-        week_count = 0
-        if os.path.exists(db_path):
-            with sqlite3.connect(db_path) as conn:
-                c = conn.cursor()
-                c.execute("SELECT COUNT(*) FROM bookings")
-                week_count = c.fetchone()[0]
-
-        # Count bookings for this month using the same logic as monthly endpoint
-        from calendar import monthrange
-        from datetime import date as dt_date
-        
-        first_day = dt_date(today.year, today.month, 1)
-        last_day = dt_date(today.year, today.month, monthrange(today.year, today.month)[1])
-        
-        # Find all weeks that overlap with this month
-        week_files = set()
-        day = first_day
-        while day <= last_day:
-            y, w, _ = day.isocalendar()
-            week_files.add((y, w))
-            day += timedelta(days=1)
-        
-        monthly_bookings = []
-        for y, w in week_files:
-            db_file_path = os.path.join("backend/weekly_databases", f"bookings_{y}-{w:02d}.db")
-            if os.path.exists(db_file_path):
-                with sqlite3.connect(db_file_path) as conn:
-                    conn.row_factory = sqlite3.Row
-                    c = conn.cursor()
-                    c.execute("SELECT * FROM bookings WHERE date BETWEEN ? AND ? ORDER BY date, time_slot, created_at",
-                              (first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")))
-                    monthly_bookings.extend([dict(row) for row in c.fetchall()])
-
-        # Count total bookings (all weekly DBs)
-        try:
-            weekly_db_dir = "backend/weekly_databases"
-            if os.path.exists(weekly_db_dir):
-                for fname in os.listdir(weekly_db_dir):
-                    if fname.endswith(".db") and "bookings_" in fname:
-                        full_path = os.path.join(weekly_db_dir, fname)
-                        with sqlite3.connect(full_path) as conn:
-                            c = conn.cursor()
-                            # Check if bookings table exists
-                            c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='bookings'")
-                            if c.fetchone():
-                                c.execute("SELECT COUNT(*) FROM bookings")
-                                total_bookings += c.fetchone()[0]
-        except Exception as e:
-            # Log the error but continue
-            print(f"Error reading weekly databases: {e}")
-
-        # Waitlist count
-        waitlist_count = 0
-        waitlist_db = "mh-bookings.db"
-        if os.path.exists(waitlist_db):
-            with sqlite3.connect(waitlist_db) as conn:
-                c = conn.cursor()
-                # Check if waitlist table exists
-                c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='waitlist'")
-                if c.fetchone():
-                    c.execute("SELECT COUNT(*) FROM waitlist")
-                    waitlist_count = c.fetchone()[0]
-
-        return {
-            "total": total_bookings,
-            "week": week_count,
-            "month": len(monthly_bookings),
-            "waitlist": waitlist_count
-        }
+        return kpi_cache.get()
     except Exception as e:
-        print(f"Error in admin_kpis: {e}")
+        logger.error(f"Error in admin_kpis: {e}")
         raise HTTPException(status_code=500, detail=f"KPI calculation error: {str(e)}")
 
 
@@ -1126,13 +1109,11 @@ def get_newsletter_recipients(
         conditions = []
         params = []
         
-        if city and city.strip():
-            conditions.append("city LIKE ?")
-            params.append(f"%{city.strip()}%")
-            
-        if name and name.strip():
-            conditions.append("name LIKE ?")
-            params.append(f"%{name.strip()}%")
+        for column, value in (("city", city), ("name", name)):
+            if value and value.strip():
+                condition, condition_params = substring_filter(column, value)
+                conditions.append(condition)
+                params.extend(condition_params)
         
         if conditions:
             query_parts.append("WHERE " + " AND ".join(conditions))
@@ -1162,18 +1143,45 @@ def get_newsletter_recipients(
     }
 
 
+@router.get("/admin/newsletter/search")
+def search_newsletter_recipients(
+    q: str,
+    field: Optional[str] = None,
+    limit: int = Query(25, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    user=Depends(admin_required)
+):
+    """Ranked full-text search over newsletter recipients (admin only).
+
+    Matches substrings and prefixes of name, city, email, address and
+    zipcode (or only ``field``), falling back to typo-tolerant matching.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query cannot be empty")
+    if field and field not in SEARCH_FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"field must be one of: {', '.join(SEARCH_FIELDS)}"
+        )
+    from .database import get_db
+    with get_db() as conn:
+        found = search_recipients(conn, q, field, limit, offset)
+    return dict(found, query=q, limit=limit, offset=offset)
+
+
 @router.post("/admin/newsletter/send")
 def send_newsletter(
     newsletter_data: dict,
     user=Depends(admin_required)
 ):
-    """Send newsletter to recipients (admin only)."""
+    """Queue a newsletter for delivery to matching recipients (admin only).
+
+    Returns immediately with the campaign id; delivery runs in the
+    background and its progress is at /admin/newsletter/campaigns/{id}.
+    """
     from .utils import log_activity
     
     try:
-        sent_count = 0
-        failed_count = 0
-        
         subject = newsletter_data.get("subject", "My Hibachi Newsletter")
         message = newsletter_data.get("message", "")
         city_filter = newsletter_data.get("city_filter", "")
@@ -1192,36 +1200,23 @@ def send_newsletter(
                 detail="SMS sending is not yet implemented"
             )
         
-        from .database import get_db
-        with get_db() as conn:
-            c = conn.cursor()
-            if city_filter and city_filter.strip():
-                query = """SELECT name, email FROM company_newsletter
-                          WHERE city LIKE ? AND email IS NOT NULL
-                          AND email != ''"""
-                c.execute(query, (f"%{city_filter.strip()}%",))
-            else:
-                query = """SELECT name, email FROM company_newsletter
-                          WHERE email IS NOT NULL AND email != ''"""
-                c.execute(query)
-            
-            recipients = c.fetchall()
-        
-        if not recipients:
-            # Log the attempt even if no recipients
-            log_activity(
-                user["username"],
-                "newsletter_send_attempt",
-                f"No recipients found. City filter: {city_filter or 'None'}. " +
-                f"Message length: {len(message)} chars"
-            )
+        campaign = create_campaign(subject, message, city_filter, user["username"])
+        log_activity(
+            user["username"],
+            "newsletter_send" if campaign["total"] else "newsletter_send_attempt",
+            "newsletter",
+            campaign["id"],
+            f"Newsletter queued for {campaign['total']} recipients. "
+            f"City filter: {city_filter or 'None'}. Message length: {len(message)} chars"
+        )
+        if campaign["total"]:
+            newsletter_sender.start(campaign["id"])
         
         return {
             "success": True,
-            "message": f"Newsletter sent to {sent_count} recipients",
-            "sent_count": sent_count,
-            "failed_count": failed_count,
-            "total_recipients": len(recipients)
+            "message": f"Newsletter queued for {campaign['total']} recipients",
+            "campaign_id": campaign["id"],
+            "total_recipients": campaign["total"]
         }
         
     except HTTPException:
@@ -1233,6 +1228,21 @@ def send_newsletter(
         )
 
 
+@router.get("/admin/newsletter/campaigns/{campaign_id}")
+def get_newsletter_campaign(
+    campaign_id: int,
+    include_failures: bool = False,
+    user=Depends(admin_required)
+):
+    """Delivery progress of a newsletter campaign (admin only)."""
+    progress = campaign_progress(campaign_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    if include_failures:
+        progress["failures"] = failed_deliveries(campaign_id)
+    return progress
+
+
 @router.get("/admin/newsletter/cities")
 def get_newsletter_cities(user=Depends(admin_required)):
     """Get all unique cities from newsletter database (admin only)."""
@@ -1246,145 +1256,134 @@ def get_newsletter_cities(user=Depends(admin_required)):
     
     return {"cities": cities}
 
+def _decode_cursor(cursor: Optional[str], size: int):
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor, size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/admin/all-bookings")
-def admin_all_bookings(user=Depends(admin_required)):
-    """Get all bookings from all time periods (admin only)."""
-    bookings = []
-    weekly_db_dir = "backend/weekly_databases"
-    
-    if os.path.exists(weekly_db_dir):
-        for fname in os.listdir(weekly_db_dir):
-            if fname.endswith('.db') and 'bookings_' in fname:
-                db_path = os.path.join(weekly_db_dir, fname)
-                try:
-                    with sqlite3.connect(db_path) as conn:
-                        conn.row_factory = sqlite3.Row
-                        c = conn.cursor()
-                        # Check if bookings table exists
-                        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='bookings'")
-                        if c.fetchone():
-                            c.execute("SELECT * FROM bookings ORDER BY date, time_slot, created_at")
-                            bookings.extend([dict(row) for row in c.fetchall()])
-                except Exception as e:
-                    print(f"Error reading {db_path}: {e}")
-                    continue
-    
-    return bookings
+def admin_all_bookings(limit: Optional[int] = Query(None, ge=1, le=1000),
+                       cursor: Optional[str] = None,
+                       user=Depends(admin_required)):
+    """Get all bookings from all time periods (admin only).
+
+    Ordered by (date, time_slot, id). With ``limit`` the response is one
+    page, ``{"bookings": [...], "next_cursor": ...}``; pass next_cursor
+    back as ``cursor`` for the following page (null on the last page).
+    Without ``limit`` the full list is returned as before; prefer the
+    /admin/all-bookings/stream endpoint for large exports.
+    """
+    after = _decode_cursor(cursor, 3)
+    if limit is None and after is None:
+        return list(iter_bookings())
+    page = list(islice(iter_bookings(after), (limit or 100) + 1))
+    bookings = page[:limit or 100]
+    next_cursor = None
+    if len(page) > len(bookings):
+        last = bookings[-1]
+        next_cursor = encode_cursor(last["date"], last["time_slot"], last["id"])
+    return {"bookings": bookings, "next_cursor": next_cursor}
+
+
+def _ndjson(rows, chunk_rows: int = 100):
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(row, default=str))
+        if len(chunk) >= chunk_rows:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+
+@router.get("/admin/all-bookings/stream")
+def admin_all_bookings_stream(cursor: Optional[str] = None,
+                              user=Depends(admin_required)):
+    """Stream every booking as NDJSON (one JSON object per line, admin only).
+
+    Rows are read shard by shard with fetchmany, so memory use does not
+    grow with history. Accepts the same ``cursor`` as /admin/all-bookings.
+    """
+    rows = iter_bookings(_decode_cursor(cursor, 3))
+    return StreamingResponse(_ndjson(rows), media_type="application/x-ndjson")
+
+
+def _booking_histories(emails: List[str]) -> Dict[str, list]:
+    """Booking history per email, newest first.
+
+    Emails are looked up HISTORY_CHUNK at a time (well under SQLite's
+    bound-variable limit), each chunk only in the shards the email index
+    lists for it.
+    """
+    histories = {email: [] for email in emails}
+    for i in range(0, len(emails), HISTORY_CHUNK):
+        chunk = emails[i:i + HISTORY_CHUNK]
+        for booking in query_shards(
+            f"""
+                SELECT email, date, time_slot, deposit_received, created_at
+                FROM bookings
+                WHERE email IN ({', '.join('?' for _ in chunk)})
+                ORDER BY date DESC
+            """,
+            chunk,
+            shards=shards_for_emails(chunk),
+            key=lambda b: b["date"] or "",
+            reverse=True
+        ):
+            histories[booking['email']].append({
+                'date': booking['date'],
+                'time_slot': booking['time_slot'],
+                'status': 'confirmed',  # Default status since column doesn't exist
+                'deposit_received': bool(booking['deposit_received']),
+                'created_at': booking['created_at']
+            })
+    return histories
 
 
 # Customer Management Endpoints
 @router.get("/admin/customers")
-def get_all_customers(user=Depends(admin_required)):
-    """Get all customer data with booking history (admin only)."""
-    customers_data = {}
-    weekly_db_dir = "backend/weekly_databases"
-    
-    if os.path.exists(weekly_db_dir):
-        for fname in os.listdir(weekly_db_dir):
-            if fname.endswith('.db') and 'bookings_' in fname:
-                db_path = os.path.join(weekly_db_dir, fname)
-                try:
-                    with sqlite3.connect(db_path) as conn:
-                        conn.row_factory = sqlite3.Row
-                        c = conn.cursor()
-                        # Check if bookings table exists
-                        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='bookings'")
-                        if c.fetchone():
-                            c.execute("""
-                                SELECT name, email, phone, address, city, zipcode, 
-                                       contact_preference, date, time_slot, 
-                                       deposit_received, created_at
-                                FROM bookings 
-                                ORDER BY created_at DESC
-                            """)
-                            bookings = [dict(row) for row in c.fetchall()]
-                            
-                            # Group bookings by customer (using email as unique identifier)
-                            for booking in bookings:
-                                email = booking['email']
-                                if email not in customers_data:
-                                    customers_data[email] = {
-                                        'customer_info': {
-                                            'name': booking['name'],
-                                            'email': booking['email'],
-                                            'phone': booking['phone'],
-                                            'address': booking['address'],
-                                            'city': booking['city'],
-                                            'zipcode': booking['zipcode'],
-                                            'contact_preference': booking['contact_preference']
-                                        },
-                                        'booking_history': [],
-                                        'total_bookings': 0,
-                                        'total_spent': 0.0,
-                                        'last_booking_date': None,
-                                        'first_booking_date': None,
-                                        'favorite_time_slots': [],
-                                        'booking_status_counts': {
-                                            'confirmed': 0,
-                                            'pending': 0,
-                                            'cancelled': 0
-                                        }
-                                    }
-                                
-                                # Add booking to history
-                                customers_data[email]['booking_history'].append({
-                                    'date': booking['date'],
-                                    'time_slot': booking['time_slot'],
-                                    'status': 'confirmed',  # Default status since column doesn't exist
-                                    'deposit_received': bool(booking['deposit_received']),
-                                    'created_at': booking['created_at']
-                                })
-                                
-                                # Update customer statistics
-                                customers_data[email]['total_bookings'] += 1
-                                customers_data[email]['total_spent'] += 55.0  # Base price
-                                
-                                # Update booking dates
-                                booking_date = booking['date']
-                                if not customers_data[email]['last_booking_date'] or booking_date > customers_data[email]['last_booking_date']:
-                                    customers_data[email]['last_booking_date'] = booking_date
-                                if not customers_data[email]['first_booking_date'] or booking_date < customers_data[email]['first_booking_date']:
-                                    customers_data[email]['first_booking_date'] = booking_date
-                                
-                                # Count booking statuses - use confirmed as default
-                                customers_data[email]['booking_status_counts']['confirmed'] += 1
-                                    
-                except Exception as e:
-                    print(f"Error reading {db_path}: {e}")
-                    continue
-    
-    # Convert to list and add additional analytics
-    customers_list = []
-    for email, customer_data in customers_data.items():
-        # Calculate favorite time slots
-        time_slot_counts = {}
-        for booking in customer_data['booking_history']:
-            time_slot = booking['time_slot']
-            time_slot_counts[time_slot] = time_slot_counts.get(time_slot, 0) + 1
-        
-        # Get top 3 favorite time slots
-        favorite_slots = sorted(time_slot_counts.items(), key=lambda x: x[1], reverse=True)[:3]
-        customer_data['favorite_time_slots'] = [slot[0] for slot in favorite_slots]
-        
-        # Calculate customer tier based on booking count
-        total_bookings = customer_data['total_bookings']
-        if total_bookings >= 10:
-            customer_data['customer_tier'] = 'VIP'
-        elif total_bookings >= 5:
-            customer_data['customer_tier'] = 'Premium'
-        elif total_bookings >= 2:
-            customer_data['customer_tier'] = 'Regular'
-        else:
-            customer_data['customer_tier'] = 'New'
-            
-        # Sort booking history by date (most recent first)
-        customer_data['booking_history'].sort(key=lambda x: x['date'], reverse=True)
-        
-        customers_list.append(customer_data)
-    
-    # Sort customers by total bookings (most active first)
-    customers_list.sort(key=lambda x: x['total_bookings'], reverse=True)
-    
+def get_all_customers(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    sort: str = "total_bookings",
+    order: str = "desc",
+    tier: Optional[str] = None,
+    include_history: Optional[bool] = None,
+    user=Depends(admin_required),
+):
+    """Get customers from the customer aggregate table (admin only).
+
+    Without ``limit`` every customer is returned with its booking history,
+    as before. With ``limit`` the response is one page starting at
+    ``offset`` and histories are only loaded when include_history is set.
+    The total number of matching customers is returned in X-Total-Count.
+    """
+    if sort not in CUSTOMER_SORT_COLUMNS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"sort must be one of: {', '.join(CUSTOMER_SORT_COLUMNS)}"
+        )
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    customers_list, total = list_customers(
+        limit, offset, sort, order == "desc", tier
+    )
+    response.headers["X-Total-Count"] = str(total)
+    if include_history is None:
+        include_history = limit is None
+
+    if include_history and customers_list:
+        histories = _booking_histories(
+            [c['customer_info']['email'] for c in customers_list]
+        )
+        for customer in customers_list:
+            customer['booking_history'] = histories[customer['customer_info']['email']]
+
     return customers_list
 
 @router.get("/admin/customer/{email}")
@@ -1399,57 +1398,44 @@ def get_customer_detail(email: str, user=Depends(admin_required)):
         'monthly_activity': {}
     }
     
-    weekly_db_dir = "backend/weekly_databases"
-    
-    if os.path.exists(weekly_db_dir):
-        for fname in os.listdir(weekly_db_dir):
-            if fname.endswith('.db') and 'bookings_' in fname:
-                db_path = os.path.join(weekly_db_dir, fname)
-                try:
-                    with sqlite3.connect(db_path) as conn:
-                        conn.row_factory = sqlite3.Row
-                        c = conn.cursor()
-                        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='bookings'")
-                        if c.fetchone():
-                            c.execute("""
-                                SELECT * FROM bookings 
-                                WHERE email = ? 
-                                ORDER BY date DESC, created_at DESC
-                            """, (email,))
-                            bookings = [dict(row) for row in c.fetchall()]
-                            
-                            for booking in bookings:
-                                if not customer_data['customer_info']:
-                                    customer_data['customer_info'] = {
-                                        'name': booking['name'],
-                                        'email': booking['email'],
-                                        'phone': booking['phone'],
-                                        'address': booking['address'],
-                                        'city': booking['city'],
-                                        'zipcode': booking['zipcode'],
-                                        'contact_preference': booking['contact_preference']
-                                    }
-                                
-                                # Add to booking history with proper formatting
-                                customer_data['booking_history'].append({
-                                    'id': booking['id'],
-                                    'date': booking['date'],
-                                    'time_slot': booking['time_slot'],
-                                    'status': 'confirmed',  # Default since column doesn't exist
-                                    'deposit_received': bool(booking['deposit_received']),
-                                    'created_at': booking['created_at']
-                                })
-                                
-                                customer_data['total_bookings'] += 1
-                                customer_data['total_spent'] += 55.0
-                                
-                                # Track monthly activity
-                                month_key = booking['date'][:7]  # YYYY-MM format
-                                customer_data['monthly_activity'][month_key] = customer_data['monthly_activity'].get(month_key, 0) + 1
-                                
-                except Exception as e:
-                    print(f"Error reading {db_path}: {e}")
-                    continue
+    for booking in query_shards(
+        """
+            SELECT * FROM bookings
+            WHERE email = ?
+            ORDER BY date DESC, created_at DESC
+        """,
+        (email,),
+        shards=shards_for_email(email),
+        key=lambda b: (b["date"] or "", b["created_at"] or ""),
+        reverse=True
+    ):
+        if not customer_data['customer_info']:
+            customer_data['customer_info'] = {
+                'name': booking['name'],
+                'email': booking['email'],
+                'phone': booking['phone'],
+                'address': booking['address'],
+                'city': booking['city'],
+                'zipcode': booking['zipcode'],
+                'contact_preference': booking['contact_preference']
+            }
+
+        # Add to booking history with proper formatting
+        customer_data['booking_history'].append({
+            'id': booking['id'],
+            'date': booking['date'],
+            'time_slot': booking['time_slot'],
+            'status': 'confirmed',  # Default since column doesn't exist
+            'deposit_received': bool(booking['deposit_received']),
+            'created_at': booking['created_at']
+        })
+
+        customer_data['total_bookings'] += 1
+        customer_data['total_spent'] += 55.0
+
+        # Track monthly activity
+        month_key = booking['date'][:7]  # YYYY-MM format
+        customer_data['monthly_activity'][month_key] = customer_data['monthly_activity'].get(month_key, 0) + 1
     
     if not customer_data['customer_info']:
         raise HTTPException(status_code=404, detail="Customer not found")
@@ -1457,99 +1443,56 @@ def get_customer_detail(email: str, user=Depends(admin_required)):
     return customer_data
 
 @router.get("/admin/customer-analytics")
-def get_customer_analytics(user=Depends(admin_required)):
-    """Get customer analytics and insights (admin only)."""
-    analytics = {
-        'total_customers': 0,
-        'new_customers_this_month': 0,
-        'returning_customers': 0,
-        'customer_tiers': {
-            'VIP': 0,
-            'Premium': 0,
-            'Regular': 0,
-            'New': 0
-        },
-        'top_customers': [],
-        'booking_patterns': {},
-        'retention_rate': 0.0
+def get_customer_analytics(start: Optional[str] = None, end: Optional[str] = None,
+                           user=Depends(admin_required)):
+    """Get customer analytics and insights (admin only).
+
+    Pass start/end (YYYY-MM-DD) to also get activity for that window.
+    """
+    if bool(start) != bool(end):
+        raise HTTPException(status_code=400, detail="start and end must be given together")
+    if start:
+        try:
+            if datetime.strptime(start, "%Y-%m-%d") > datetime.strptime(end, "%Y-%m-%d"):
+                raise ValueError("end date is before start date")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return customer_analytics(start, end)
+
+
+@router.get("/admin/email-outbox/dead-letters")
+def get_dead_letters(limit: int = Query(100, ge=1, le=1000),
+                     user=Depends(admin_required)):
+    """Emails that exhausted their retries (admin only)."""
+    return {"dead_letters": outbox.dead_letters(limit)}
+
+
+@router.post("/admin/email-outbox/{message_id}/retry")
+def retry_dead_letter(message_id: int, user=Depends(admin_required)):
+    """Put a dead-lettered email back in the queue (admin only)."""
+    if not outbox.requeue(message_id):
+        raise HTTPException(status_code=404, detail="Dead-lettered email not found")
+    return {"message": f"Email {message_id} requeued"}
+
+
+@router.get("/admin/metrics")
+def admin_metrics(user=Depends(admin_required)):
+    """Runtime metrics for the data-access layer (admin only)."""
+    from .database import pool, schemas
+    return {
+        "db_executor": db_executor.stats(),
+        "connection_pool": pool.stats(),
+        "schemas": schemas.stats(),
+        "occupancy_cache": occupancy_cache.stats(),
+        "kpi_cache": kpi_cache.stats(),
+        "newsletter_delivery": newsletter_sender.stats(),
+        "email_outbox": outbox.outbox_worker.stats(),
+        "email_transport": get_transport().stats(),
+        "deposit_sweeper": sweeper_stats(),
+        "principal_cache": principal_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "token_cache": token_cache.stats(),
     }
-    
-    customers_data = {}
-    current_month = datetime.now().strftime('%Y-%m')
-    
-    weekly_db_dir = "backend/weekly_databases"
-    
-    if os.path.exists(weekly_db_dir):
-        for fname in os.listdir(weekly_db_dir):
-            if fname.endswith('.db') and 'bookings_' in fname:
-                db_path = os.path.join(weekly_db_dir, fname)
-                try:
-                    with sqlite3.connect(db_path) as conn:
-                        conn.row_factory = sqlite3.Row
-                        c = conn.cursor()
-                        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='bookings'")
-                        if c.fetchone():
-                            c.execute("SELECT * FROM bookings ORDER BY created_at DESC")
-                            bookings = [dict(row) for row in c.fetchall()]
-                            
-                            for booking in bookings:
-                                email = booking['email']
-                                if email not in customers_data:
-                                    customers_data[email] = {
-                                        'name': booking['name'],
-                                        'email': email,
-                                        'total_bookings': 0,
-                                        'total_spent': 0.0,
-                                        'first_booking': booking['created_at'],
-                                        'last_booking': booking['created_at']
-                                    }
-                                
-                                customers_data[email]['total_bookings'] += 1
-                                customers_data[email]['total_spent'] += 55.0
-                                
-                                # Update first/last booking dates
-                                if booking['created_at'] < customers_data[email]['first_booking']:
-                                    customers_data[email]['first_booking'] = booking['created_at']
-                                if booking['created_at'] > customers_data[email]['last_booking']:
-                                    customers_data[email]['last_booking'] = booking['created_at']
-                                
-                                # Check if new customer this month
-                                if booking['created_at'].startswith(current_month):
-                                    if customers_data[email]['total_bookings'] == 1:
-                                        analytics['new_customers_this_month'] += 1
-                                
-                except Exception as e:
-                    print(f"Error reading {db_path}: {e}")
-                    continue
-    
-    # Calculate analytics
-    analytics['total_customers'] = len(customers_data)
-    
-    # Calculate customer tiers and top customers
-    for customer in customers_data.values():
-        total_bookings = customer['total_bookings']
-        
-        if total_bookings >= 10:
-            analytics['customer_tiers']['VIP'] += 1
-        elif total_bookings >= 5:
-            analytics['customer_tiers']['Premium'] += 1
-        elif total_bookings >= 2:
-            analytics['customer_tiers']['Regular'] += 1
-        else:
-            analytics['customer_tiers']['New'] += 1
-    
-    # Get top 10 customers
-    top_customers = sorted(customers_data.values(), key=lambda x: x['total_bookings'], reverse=True)[:10]
-    analytics['top_customers'] = top_customers
-    
-    # Calculate retention rate (customers with more than 1 booking)
-    returning_customers = sum(1 for customer in customers_data.values() if customer['total_bookings'] > 1)
-    analytics['returning_customers'] = returning_customers
-    if analytics['total_customers'] > 0:
-        analytics['retention_rate'] = (returning_customers / analytics['total_customers']) * 100
-    
-    return analytics
 
 # Phase 1: WebSocket endpoint is registered in main.py directly
 # This avoids conflicts with the router prefix
-
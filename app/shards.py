@@ -0,0 +1,140 @@
+import heapq
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as dt_date, datetime, timedelta
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from .database import DB_DIR, SHARD_FILE_RE, shard_db, shard_key, shard_path
+
+SHARD_QUERY_WORKERS = int(os.getenv("SHARD_QUERY_WORKERS", "8"))
+_executor = ThreadPoolExecutor(
+    max_workers=SHARD_QUERY_WORKERS, thread_name_prefix="shard-query"
+)
+
+# Rows fetched per round trip when streaming bookings
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+DateLike = Union[str, dt_date]
+
+
+def _as_date(value: DateLike) -> dt_date:
+    if isinstance(value, str):
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    return value
+
+
+def list_shards() -> List[str]:
+    """Return every existing weekly shard file, oldest week first."""
+    if not os.path.exists(DB_DIR):
+        return []
+    return [
+        os.path.join(DB_DIR, fname)
+        for fname in sorted(os.listdir(DB_DIR))
+        if SHARD_FILE_RE.match(fname)
+    ]
+
+
+def shards_for_range(start: DateLike, end: DateLike) -> List[str]:
+    """Return the existing shard files whose ISO week overlaps [start, end].
+
+    Filters ``list_shards()`` by the week in each file name, so an open
+    end such as ``date.max`` costs no more than a bounded range.
+    """
+    start, end = _as_date(start), _as_date(end)
+    shards = []
+    for path in list_shards():
+        year, week = SHARD_FILE_RE.match(os.path.basename(path)).groups()
+        try:
+            monday = dt_date.fromisocalendar(int(year), int(week), 1)
+        except ValueError:
+            continue
+        if monday <= end and monday + timedelta(days=6) >= start:
+            shards.append(path)
+    return shards
+
+
+def map_shards(fn: Callable, items: Sequence) -> list:
+    """Apply ``fn`` to each item on the shard query pool, keeping order."""
+    return list(_executor.map(fn, items))
+
+
+def _query_one(db_path: str, sql: str, params: Sequence) -> List[dict]:
+    with shard_db(db_path) as conn:
+        return [dict(row) for row in conn.execute(sql, params)]
+
+
+def query_shards(sql: str, params: Sequence = (),
+                 shards: Optional[Sequence[str]] = None,
+                 key: Optional[Callable] = None,
+                 reverse: bool = False) -> List[dict]:
+    """Run ``sql`` on each shard concurrently and merge the results.
+
+    When ``key`` is given every shard must already return its rows in that
+    order (via ORDER BY in ``sql``); the per-shard results are then
+    combined with a k-way merge rather than concatenated and re-sorted.
+    Without ``key`` rows are returned in shard (week) order. A failing
+    shard raises rather than being left out, so callers never get a
+    partial result that looks complete.
+    """
+    if shards is None:
+        shards = list_shards()
+    results = map_shards(lambda path: _query_one(path, sql, params), shards)
+    if key is None:
+        return list(itertools.chain.from_iterable(results))
+    return list(heapq.merge(*results, key=key, reverse=reverse))
+
+
+def count_shards(sql: str, params: Sequence = (),
+                 shards: Optional[Sequence[str]] = None) -> int:
+    """Sum a single-value ``SELECT COUNT(*)`` / ``SUM(...)`` across shards."""
+    rows = query_shards(sql, params, shards)
+    return sum(next(iter(row.values())) or 0 for row in rows)
+
+
+def iter_bookings(after: Optional[Tuple[str, str, int]] = None,
+                  batch_size: int = STREAM_BATCH_SIZE,
+                  start: Optional[DateLike] = None,
+                  end: Optional[DateLike] = None,
+                  columns: str = "*") -> Iterator[dict]:
+    """Yield every booking in (date, time_slot, id) order, shard by shard.
+
+    Shards hold disjoint weeks, so visiting them in week order and reading
+    each with ``ORDER BY date, time_slot, id`` gives the global order
+    without a merge. Rows are pulled ``batch_size`` at a time, so memory
+    stays flat however many shards exist. ``after`` is a keyset cursor:
+    only rows strictly after that (date, time_slot, id) are returned.
+    ``start``/``end`` limit the dates (and the shards opened).
+    """
+    if start or end:
+        start = _as_date(start) if start else dt_date(1970, 1, 1)
+        end = _as_date(end) if end else dt_date(9999, 12, 31)
+        shards = shards_for_range(start, end)
+    else:
+        shards = list_shards()
+    first = os.path.basename(shard_path(shard_key(after[0]))) if after else None
+    for db_path in shards:
+        name = os.path.basename(db_path)
+        if first and name < first:
+            continue
+        where, params = [], []
+        if first and name == first:
+            where.append("(date, time_slot, id) > (?, ?, ?)")
+            params += list(after)
+        if start or end:
+            where.append("date BETWEEN ? AND ?")
+            params += [start.isoformat(), end.isoformat()]
+        clause = " WHERE " + " AND ".join(where) if where else ""
+        with shard_db(db_path) as conn:
+            cur = conn.execute(
+                f"SELECT {columns} FROM bookings{clause} "
+                f"ORDER BY date, time_slot, id",
+                params
+            )
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+
@@ -1,26 +1,13 @@
-import os
-import sqlite3
 from datetime import datetime
 
+from .email_index import latest_booking
+
 def get_latest_user_info(email):
     """Fetch the latest address, city, zipcode, and contact_preference for a user from previous bookings."""
-    address, city, zipcode, contact_preference = "", "", "", ""
-    db_dir = os.path.join(os.path.dirname(__file__), '..', 'weekly_databases')
-    for db_file in os.listdir(db_dir):
-        if db_file.endswith(".db"):
-            db_path = os.path.join(db_dir, db_file)
-            with sqlite3.connect(db_path) as bconn:
-                bconn.row_factory = sqlite3.Row
-                bc = bconn.cursor()
-                bc.execute("SELECT * FROM bookings WHERE email = ? ORDER BY created_at DESC LIMIT 1", (email,))
-                prev = bc.fetchone()
-                if prev:
-                    address = prev["address"]
-                    city = prev["city"]
-                    zipcode = prev["zipcode"]
-                    contact_preference = prev["contact_preference"]
-                    break
-    return address, city, zipcode, contact_preference
+    prev = latest_booking(email)
+    if not prev:
+        return "", "", "", ""
+    return prev["address"], prev["city"], prev["zipcode"], prev["contact_preference"]
 
 def upsert_newsletter_entry(data, source):
     """Insert or update a contact in the company newsletter table."""
@@ -7,7 +7,8 @@ import asyncio
 from datetime import datetime
 from typing import Dict, Set
 from fastapi import WebSocket, WebSocketDisconnect
-from .database import get_week_db
+from .availability import availability_for
+from .db_executor import run_db
 
 logger = logging.getLogger("booking.websocket")
 
@@ -204,7 +205,9 @@ class WebSocketManager:
                     
                     # Send current availability status
                     try:
-                        availability = self.get_current_availability(date)
+                        availability = await run_db(
+                            self.get_current_availability, date
+                        )
                         await websocket.send_text(json.dumps({
                             "type": "availability_snapshot",
                             "date": date,
@@ -247,27 +250,7 @@ class WebSocketManager:
     def get_current_availability(self, date: str) -> dict:
         """Get current availability for a date"""
         try:
-            conn = get_week_db(date)
-            c = conn.cursor()
-            c.execute(
-                "SELECT time_slot, COUNT(*) as count FROM bookings WHERE date = ? GROUP BY time_slot",
-                (date,)
-            )
-            slots = {row["time_slot"]: row["count"] for row in c.fetchall()}
-            
-            all_slots = ['12:00 PM', '3:00 PM', '6:00 PM', '9:00 PM']
-            result = {}
-            for slot in all_slots:
-                count = slots.get(slot, 0)
-                if count == 0:
-                    status = "available"
-                elif count == 1:
-                    status = "waiting"
-                else:
-                    status = "booked"
-                result[slot] = {"status": status, "count": count}
-            
-            return result
+            return availability_for(date, include_count=True)
         except Exception as e:
             logger.error(f"Failed to get availability for {date}: {e}")
             return {}
@@ -8,16 +8,70 @@ from fastapi.requests import Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 import logging
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 # Phase 1: Import WebSocket support
 from app.websocket_manager import websocket_endpoint
+from app.database import bootstrap_shards, ensure_user_db_indexes
+from app.customers import backfill_customers
+from app.email_index import backfill_email_index
+from app.customer_analytics import backfill_rollups, compact_rollups
+from app.deposit_tasks import (
+    DEPOSIT_SWEEP_SECONDS, rebuild_deposit_shards, run_deposit_sweeper, scheduler
+)
+from app.kpis import backfill_kpi_counters
+from app.newsletter_delivery import NEWSLETTER_LEASE_SECONDS, resume_campaigns
+from app.outbox import (
+    EMAIL_OUTBOX_RELAY_SECONDS, outbox_worker, purge_sent_emails, relay_all
+)
+from app.email_utils import get_transport
 
 # Load environment variables from .env file
 load_dotenv("csbook.env")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Migrate existing weekly shards before any booking id is served
+    bootstrap_shards()
+    ensure_user_db_indexes()
+    backfill_email_index()
+    backfill_customers()
+    backfill_rollups()
+    scheduler.add_job(
+        compact_rollups, trigger="cron", hour=3,
+        id="compact_customer_rollups", replace_existing=True
+    )
+    backfill_kpi_counters()
+    resume_campaigns()
+    scheduler.add_job(
+        resume_campaigns, trigger="interval", seconds=NEWSLETTER_LEASE_SECONDS,
+        id="resume_campaigns", replace_existing=True, max_instances=1, coalesce=True
+    )
+    # Emails staged in a shard by a process that died before relaying them
+    relay_all()
+    outbox_worker.start()
+    scheduler.add_job(
+        relay_all, trigger="interval", seconds=EMAIL_OUTBOX_RELAY_SECONDS,
+        id="relay_staged_emails", replace_existing=True, max_instances=1, coalesce=True
+    )
+    rebuild_deposit_shards()
+    scheduler.add_job(
+        run_deposit_sweeper, trigger="interval", seconds=DEPOSIT_SWEEP_SECONDS,
+        id="deposit_sweeper", replace_existing=True, max_instances=1, coalesce=True
+    )
+    scheduler.add_job(
+        purge_sent_emails, trigger="cron", hour=4,
+        id="purge_sent_emails", replace_existing=True
+    )
+    yield
+    outbox_worker.stop()
+    get_transport().close()
+
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Set up SlowAPI limiter
 limiter = Limiter(key_func=get_remote_address)
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""
+Rebuild the customer email index, the customers aggregate table and the
+customer analytics rollups from every weekly shard
+Run after restoring shards from backup or if aggregates are suspected to drift
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.customers import rebuild_customers
+from app.email_index import rebuild_email_index
+from app.customer_analytics import compact_rollups, rebuild_rollups
+
+
+if __name__ == "__main__":
+    print(f"✅ Indexed {rebuild_email_index()} bookings by email")
+    print(f"✅ Rebuilt {rebuild_customers()} customer aggregates")
+    print(f"✅ Rolled up {rebuild_rollups()} bookings")
+    print(f"🧹 Compacted {compact_rollups()} expired daily rollup rows")
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+Recount the dashboard KPI counters from every weekly shard's slot_counts
+Run after restoring shards from backup or if the counters are suspected to
+drift, while no bookings are being written (e.g. with the API stopped)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.kpis import rebuild_kpi_counters
+
+
+if __name__ == "__main__":
+    counters = rebuild_kpi_counters()
+    print(f"✅ Recounted {counters['total']} bookings into {len(counters)} KPI counters")
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Backfill / repair the slot_counts table of every weekly shard
+Run after restoring shards from backup or if counts are suspected to drift
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.database import rebuild_slot_counts, shard_db
+from app.shards import list_shards
+
+
+def repair_all_shards():
+    """Recount slot_counts from bookings in every shard"""
+    repaired = 0
+    for db_path in list_shards():
+        with shard_db(db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            changed = rebuild_slot_counts(conn)
+        if changed:
+            repaired += 1
+            print(f"🔧 {os.path.basename(db_path)}: {changed} slot rows corrected")
+    print(f"✅ Checked {len(list_shards())} shards, repaired {repaired}")
+
+
+if __name__ == "__main__":
+    repair_all_shards()
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
+
+
+@pytest.fixture
+def tmp_db(tmp_path, monkeypatch):
+    """Point the weekly shards and mh-bookings.db at ``tmp_path``."""
+    from app import database, shards
+
+    monkeypatch.setattr(database, "DB_DIR", str(tmp_path))
+    monkeypatch.setattr(shards, "DB_DIR", str(tmp_path))
+    monkeypatch.setattr(database, "MAIN_DB_PATH", str(tmp_path / "main.db"))
+    return tmp_path
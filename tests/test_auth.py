@@ -0,0 +1,98 @@
+from app import database
+
+
+def test_principal_cache_merged_lookup_and_invalidation(tmp_db):
+    from app.auth import create_access_token, decode_access_token
+    from app.principals import PrincipalCache, load_principal
+
+    users = database.init_user_db()
+    users.execute("""INSERT INTO users (username, password_hash, role)
+                     VALUES ('karen', 'h1', 'admin')""")
+    users.commit()
+    users.close()
+    with database.get_db() as conn:
+        conn.execute("""CREATE TABLE admins (id INTEGER PRIMARY KEY, username TEXT,
+                        password_hash TEXT, user_type TEXT, is_active INTEGER)""")
+        conn.execute("""INSERT INTO admins (username, password_hash, user_type)
+                        VALUES ('karen', 'legacy', 'superadmin'), ('yohan', 'h2', 'superadmin')""")
+
+    assert load_principal("karen")["password_hash"] == "h1"
+    assert load_principal("yohan")["role"] == "superadmin"
+    assert load_principal("nobody") is None
+
+    loads = []
+    cache = PrincipalCache(lambda name: loads.append(name) or load_principal(name))
+    iat = decode_access_token(create_access_token({"sub": "karen"}))["iat"]
+    for _ in range(3):
+        assert cache.get("karen", iat)["role"] == "admin"
+    assert loads == ["karen"] and cache.stats()["hits"] == 2
+    users = database.get_user_db()
+    users.execute("UPDATE users SET role = 'superadmin' WHERE username = 'karen'")
+    users.commit()
+    users.close()
+    cache.invalidate("karen")
+    assert cache.get("karen", iat)["role"] == "superadmin" and len(loads) == 2
+
+
+def test_password_hasher_sheds_load_and_rehashes():
+    import threading
+    from app.auth import HashingOverloaded, PasswordHasher
+
+    release = threading.Event()
+
+    class SlowContext:
+        def hash(self, password):
+            release.wait(5)
+            return "$new$" + password
+
+        def verify_and_update(self, password, hashed):
+            ok = hashed.endswith(password)
+            return ok, ("$new$" + password if ok and hashed.startswith("$old$") else None)
+
+    hasher = PasswordHasher(workers=1, max_pending=2, context=SlowContext())
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(hasher.hash("pw", op="create_admin")))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while hasher.stats()["pending"] < 2:
+        pass
+    try:
+        hasher.hash("pw", op="create_admin")
+        assert False, "expected the full queue to reject"
+    except HashingOverloaded:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["$new$pw", "$new$pw"]
+
+    assert hasher.verify_and_update("pw", "$old$pw", op="login") == (True, "$new$pw")
+    assert hasher.verify_and_update("pw", "$new$pw", op="login") == (True, None)
+    stats = hasher.stats()
+    assert stats["rejected"] == 1 and stats["rehashed"] == 1
+    assert stats["operations"]["create_admin"]["calls"] == 2
+    assert stats["operations"]["login"]["calls"] == 2
+
+
+def test_verified_token_cache_expiry_and_revocation(monkeypatch):
+    from datetime import timedelta
+    from app import auth
+
+    cache = auth.VerifiedTokenCache(max_entries=2)
+    monkeypatch.setattr(auth, "token_cache", cache)
+    token = auth.create_access_token({"sub": "karen"})
+    payload = auth.decode_access_token(token)
+    assert auth.decode_access_token(token) == payload
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    assert auth.decode_access_token(token + "x") is None
+
+    assert cache.revoke("karen") == 1
+    auth.decode_access_token(token)
+    assert cache.stats()["misses"] == 3
+
+    # Entries never outlive the token's own exp
+    cache.put("stale", {"sub": "yohan", "exp": 0})
+    assert cache.get("stale") is None
+    expired = auth.create_access_token({"sub": "yohan"}, timedelta(seconds=-1))
+    assert auth.decode_access_token(expired) is None
@@ -1,28 +1,22 @@
-import sys
 import os
-import glob
 import pytest
 
 # Set testing environment variables before any imports
 os.environ["TESTING"] = "true"
 os.environ["DISABLE_EMAIL"] = "true"
 
-# Clean up the test DB before running tests
-def setup_module(module):
-    db_dir = os.path.join(os.path.dirname(__file__), "../weekly_databases")
-    for f in glob.glob(os.path.join(db_dir, "*.db")):
-        os.remove(f)
-    # Remove mh-bookings.db if it exists
-    main_db = os.path.join(os.path.dirname(__file__), "..", "mh-bookings.db")
-    if os.path.exists(main_db):
-        os.remove(main_db)
-
-sys.path.append(os.path.dirname(os.path.abspath(__file__)) + "/..")
-
 from main import app
 import httpx
 from datetime import datetime, timedelta
 
+# Every test runs against its own shards and mh-bookings.db in tmp_path
+# (conftest.tmp_db), with the /book rate limit reset
+@pytest.fixture(autouse=True)
+def isolated(tmp_db):
+    from app.routes import limiter
+    limiter.reset()
+    return tmp_db
+
 # Mock email sending for all tests in this module
 @pytest.fixture(autouse=True)
 def patch_send_email(monkeypatch):
@@ -34,6 +28,19 @@ def patch_send_email(monkeypatch):
     monkeypatch.setattr(email_utils, "send_cancellation_email", lambda *args, **kwargs: None)
     monkeypatch.setattr(email_utils, "send_waitlist_slot_opened", lambda *args, **kwargs: None)
 
+def booking_payload(date, time_slot, email="test@example.com"):
+    return {
+        "name": "Test User",
+        "phone": "1234567890",
+        "email": email,
+        "address": "123 Test St",
+        "city": "Testville",
+        "zipcode": "12345",
+        "date": date,
+        "time_slot": time_slot,
+        "contact_preference": "email"
+    }
+
 @pytest.mark.asyncio
 async def test_availability():
     transport = httpx.ASGITransport(app=app)
@@ -41,23 +48,17 @@ async def test_availability():
         resp = await ac.get("/api/booking/availability?date=2024-07-10")
         assert resp.status_code == 200
         assert isinstance(resp.json(), dict)
+        for bad in ("not-a-date", "2024-7-10", "2024-02-30"):
+            resp = await ac.get(f"/api/booking/availability?date={bad}")
+            assert resp.status_code == 400
+            assert "etag" not in resp.headers
 
 @pytest.mark.asyncio
 async def test_booking_and_fully_booked():
     transport = httpx.ASGITransport(app=app)
     async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
         test_date = (datetime.now() + timedelta(days=10)).strftime("%Y-%m-%d")
-        payload = {
-            "name": "Test User",
-            "phone": "1234567890",
-            "email": "test@example.com",
-            "address": "123 Test St",
-            "city": "Testville",
-            "zipcode": "12345",
-            "date": test_date,
-            "time_slot": "12:00 PM",
-            "contact_preference": "email"
-        }
+        payload = booking_payload(test_date, "12:00 PM")
         # First booking should succeed
         resp = await ac.post("/api/booking/book", json=payload)
         print(resp.status_code, resp.json())
@@ -70,4 +71,79 @@ async def test_booking_and_fully_booked():
         resp = await ac.post("/api/booking/book", json=payload)
         print(resp.status_code, resp.json())
         assert resp.status_code == 400
-        assert resp.json().get("detail") == "This slot is fully booked."
\ No newline at end of file
+        assert resp.json().get("detail") == "This slot is fully booked."
+
+@pytest.mark.asyncio
+async def test_availability_cache_follows_bookings():
+    from app.availability import occupancy_cache
+    from app.database import week_db
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+        test_date = (datetime.now() + timedelta(days=20)).strftime("%Y-%m-%d")
+        payload = booking_payload(test_date, "3:00 PM", "cache@example.com")
+        # Create the week's shard so the first read has something to cache
+        with week_db(test_date):
+            pass
+        resp = await ac.get(f"/api/booking/availability?date={test_date}")
+        assert resp.json()["3:00 PM"]["status"] == "available"
+        hits = occupancy_cache.stats()["hits"]
+        resp = await ac.post("/api/booking/book", json=payload)
+        assert resp.status_code in (200, 201)
+        resp = await ac.get(f"/api/booking/availability?date={test_date}")
+        assert resp.json()["3:00 PM"]["status"] == "waiting"
+        assert occupancy_cache.stats()["hits"] == hits + 1
+
+@pytest.mark.asyncio
+async def test_bulk_availability_range():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+        start = datetime.now() + timedelta(days=20)
+        end = start + timedelta(days=13)
+        resp = await ac.post(
+            "/api/booking/book",
+            json=booking_payload(start.strftime("%Y-%m-%d"), "3:00 PM", "bulk@example.com")
+        )
+        assert resp.status_code in (200, 201)
+        resp = await ac.get(
+            "/api/booking/availability/bulk",
+            params={"start": start.strftime("%Y-%m-%d"), "end": end.strftime("%Y-%m-%d")}
+        )
+        assert resp.status_code == 200
+        data = resp.json()
+        assert len(data) == 14
+        assert data[start.strftime("%Y-%m-%d")]["3:00 PM"]["status"] == "waiting"
+        resp = await ac.post(
+            "/api/booking/availability/bulk",
+            json=[start.strftime("%Y-%m-%d"), "not-a-date", "2031-02-30"]
+        )
+        assert resp.status_code == 400
+        assert "not-a-date, 2031-02-30" in resp.json()["detail"]
+        assert "etag" not in resp.headers
+        resp = await ac.get(
+            "/api/booking/availability/bulk", params={"start": "2031-1-1", "end": "2031-01-05"}
+        )
+        assert resp.status_code == 400 and "2031-1-1" in resp.json()["detail"]
+        resp = await ac.get(
+            "/api/booking/availability/bulk",
+            params={"start": "2030-01-01", "end": "2032-01-01"}
+        )
+        assert resp.status_code == 400
+
+@pytest.mark.asyncio
+async def test_availability_etag_revalidation():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+        test_date = (datetime.now() + timedelta(days=22)).strftime("%Y-%m-%d")
+        url = f"/api/booking/availability?date={test_date}"
+        resp = await ac.get(url)
+        etag = resp.headers["etag"]
+        assert "must-revalidate" in resp.headers["cache-control"]
+        resp = await ac.get(url, headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        payload = booking_payload(test_date, "6:00 PM", "etag@example.com")
+        resp = await ac.post("/api/booking/book", json=payload)
+        assert resp.status_code in (200, 201)
+        resp = await ac.get(url, headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.headers["etag"] != etag
+        assert resp.json()["6:00 PM"]["status"] == "waiting"
@@ -0,0 +1,521 @@
+import os
+
+from app import database
+from app.database import ConnectionPool, SchemaRegistry, open_connection
+
+
+def test_pool_reuses_tuned_connections(tmp_path):
+    pool = ConnectionPool(max_idle=2, max_files=4)
+    db_path = str(tmp_path / "bookings_2025-01.db")
+    with pool.connection(db_path) as conn:
+        first = conn
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.execute("INSERT INTO t VALUES (1)")
+    assert mode == "wal"
+    with pool.connection(db_path) as conn:
+        assert conn is first
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 1
+    assert pool.stats()["opened"] == 1
+    assert pool.stats()["reused"] == 1
+    pool.close_all()
+
+
+def test_pool_rolls_back_on_error(tmp_path):
+    pool = ConnectionPool()
+    db_path = str(tmp_path / "rollback.db")
+    with pool.connection(db_path) as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+    try:
+        with pool.connection(db_path) as conn:
+            conn.execute("INSERT INTO t VALUES (1)")
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    with pool.connection(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    pool.close_all()
+
+
+def test_pool_discards_connections_to_replaced_files(tmp_path):
+    pool = ConnectionPool()
+    db_path = str(tmp_path / "replaced.db")
+    with pool.connection(db_path) as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+    pool_conn = conn
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    with pool.connection(db_path) as conn:
+        assert conn is not pool_conn
+        tables = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'"
+        ).fetchall()
+        assert tables == []
+    pool.close_all()
+
+
+def test_pool_bounds_open_files(tmp_path):
+    pool = ConnectionPool(max_idle=1, max_files=2)
+    for i in range(4):
+        with pool.connection(str(tmp_path / f"f{i}.db")):
+            pass
+    stats = pool.stats()
+    assert stats["files"] == 2
+    assert stats["idle"] == 2
+    assert stats["closed"] == 2
+    pool.close_all()
+
+
+def test_schema_registry_bootstraps_once(tmp_path):
+    registry = SchemaRegistry()
+    db_path = str(tmp_path / "schema.db")
+    calls = []
+
+    def migrate(conn, from_version):
+        calls.append(from_version)
+        conn.execute("CREATE TABLE IF NOT EXISTS t (x INTEGER)")
+
+    conn = open_connection(db_path)
+    registry.ensure(conn, db_path, 1, migrate)
+    registry.ensure(conn, db_path, 1, migrate)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 1
+    conn.close()
+
+    # A fresh registry (new worker) trusts the version stored in the file
+    other = SchemaRegistry()
+    conn = open_connection(db_path)
+    other.ensure(conn, db_path, 1, migrate)
+    other.ensure(conn, db_path, 2, migrate)
+    conn.close()
+    assert calls == [0, 1]
+
+
+def test_booking_ids_route_to_their_shard(tmp_db):
+    ids = []
+    for date in ("2031-03-04", "2031-03-11"):
+        with database.week_db(date) as conn:
+            c = conn.cursor()
+            c.execute(
+                "INSERT INTO bookings (name, date, time_slot) VALUES (?, ?, ?)",
+                ("Test", date, "12:00 PM")
+            )
+            ids.append(c.lastrowid)
+    assert ids[0] != ids[1]
+    assert database.booking_db_path(ids[0]) == database.week_db_path("2031-03-04")
+    assert database.booking_db_path(ids[1]) == database.week_db_path("2031-03-11")
+    assert database.booking_db_path(1) is None
+
+
+def test_legacy_booking_ids_are_renumbered(tmp_db):
+    db_path = database.week_db_path("2031-05-06")
+    conn = open_connection(db_path)
+    conn.execute("CREATE TABLE bookings (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, date TEXT, time_slot TEXT)")
+    conn.execute("INSERT INTO bookings (name) VALUES ('legacy')")
+    conn.commit()
+    conn.close()
+    with database.shard_db(db_path) as conn:
+        legacy_id = conn.execute("SELECT id FROM bookings").fetchone()[0]
+        conn.execute("INSERT INTO bookings (name) VALUES ('new')")
+        new_id = conn.execute("SELECT MAX(id) FROM bookings").fetchone()[0]
+    assert legacy_id == database.shard_id_base(db_path) + 1
+    assert new_id == legacy_id + 1
+    assert database.booking_db_path(legacy_id) == db_path
+
+
+async def test_db_executor_runs_off_loop_and_records_stats():
+    import threading
+    from app.db_executor import DBExecutor
+
+    executor = DBExecutor(workers=2, max_queue=2)
+    loop_thread = threading.get_ident()
+    results = [await executor.run(threading.get_ident) for _ in range(3)]
+    assert loop_thread not in results
+    stats = executor.stats()
+    assert stats["completed"] == 3
+    assert stats["queued"] == 0 and stats["running"] == 0
+
+
+def test_reserve_slot_never_overbooks(tmp_db):
+    from concurrent.futures import ThreadPoolExecutor
+    from app.reservations import reserve_slot, release_slot, SlotFullError
+
+    booking = {"name": "Race", "email": "race@example.com",
+               "date": "2031-06-07", "time_slot": "6:00 PM"}
+
+    def attempt(_):
+        with database.week_db(booking["date"]) as conn:
+            try:
+                return reserve_slot(conn, booking)[0]
+            except SlotFullError:
+                return None
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        ids = [i for i in pool.map(attempt, range(16)) if i is not None]
+    assert len(ids) == database.SLOT_CAPACITY
+
+    with database.week_db(booking["date"]) as conn:
+        count = conn.execute("SELECT COUNT(*) FROM bookings").fetchone()[0]
+        assert count == database.SLOT_CAPACITY
+        deleted, booked = release_slot(conn, ids[0])
+        assert deleted["id"] == ids[0]
+        assert booked == database.SLOT_CAPACITY - 1
+    assert attempt(0) is not None
+
+
+def test_occupancy_cache_follows_shard_versions(tmp_db):
+    from app.availability import OccupancyCache, occupancy_cache, slot_counts
+    from app.reservations import reserve_slot
+
+    occupancy_cache.invalidate()
+    date = "2031-06-10"
+    booking = {"name": "V", "email": "v@example.com", "date": date, "time_slot": "3:00 PM"}
+    assert slot_counts(date) == {}
+    with database.week_db(date) as conn:
+        reserve_slot(conn, dict(booking))
+    assert slot_counts(date) == {"3:00 PM": 1}
+    with database.week_db(date) as conn:
+        reserve_slot(conn, dict(booking, time_slot="6:00 PM"))
+    hits = occupancy_cache.stats()["hits"]
+    assert slot_counts(date) == {"3:00 PM": 1, "6:00 PM": 1}
+    assert occupancy_cache.stats()["hits"] == hits + 1
+
+    # A write from another process bumps the version behind the cache's back
+    with database.week_db(date) as conn:
+        conn.execute("INSERT INTO bookings (name, date, time_slot) VALUES ('x', ?, '3:00 PM')", (date,))
+    assert slot_counts(date) == {"3:00 PM": 2, "6:00 PM": 1}
+
+    # Writes applied out of order never replace newer counts
+    cache = OccupancyCache()
+    path = database.week_db_path(date)
+    cache.put(path, {date: {"3:00 PM": 1}}, ("e", 1))
+    cache.record(date, "3:00 PM", 2, ("e", 1), ("e", 2))
+    cache.record(date, "3:00 PM", 1, ("e", 0), ("e", 1))
+    assert cache.lookup(path, [date], ("e", 2)) == {date: {"3:00 PM": 2}}
+    cache.record(date, "3:00 PM", 0, ("e", 5), ("e", 6))
+    assert cache.lookup(path, [date], ("e", 2)) is None
+
+
+def test_availability_etag_matches_served_counts(tmp_db):
+    import pytest
+    from app.availability import availability_etag, invalid_dates, live_tags, occupancy
+
+    assert invalid_dates(["2031-06-17", "not-a-date", "2031-6-17", "2031-02-30"]) == [
+        "not-a-date", "2031-6-17", "2031-02-30"
+    ]
+    dates = ["2031-06-17", "2031-06-18"]
+    insert = "INSERT INTO bookings (name, date, time_slot) VALUES ('t', ?, '12:00 PM')"
+    with database.week_db(dates[0]) as conn:
+        conn.execute(insert, (dates[0],))
+    counts, tags = occupancy(dates)
+    etag = availability_etag(dates, tags)
+    assert counts[dates[0]] == {"12:00 PM": 1} and counts[dates[1]] == {}
+    assert availability_etag(dates, live_tags(dates)) == etag
+
+    with database.week_db(dates[1]) as conn:
+        conn.execute(insert, (dates[1],))
+    assert availability_etag(dates, live_tags(dates)) != etag
+    counts, tags = occupancy(dates)
+    assert counts[dates[1]] == {"12:00 PM": 1}
+    assert availability_etag(dates, tags) == availability_etag(dates, live_tags(dates))
+    with pytest.raises(ValueError):
+        occupancy(dates + ["not-a-date"])
+    with pytest.raises(ValueError):
+        availability_etag(["not-a-date"], {})
+
+
+def test_slot_counts_triggers_and_repair(tmp_db):
+    import sqlite3
+    import pytest
+
+    date = "2031-08-05"
+    insert = "INSERT INTO bookings (name, date, time_slot) VALUES ('t', ?, '9:00 PM')"
+    with database.week_db(date) as conn:
+        for _ in range(database.SLOT_CAPACITY):
+            conn.execute(insert, (date,))
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute(insert, (date,))
+        conn.execute("DELETE FROM bookings WHERE id = (SELECT MIN(id) FROM bookings)")
+        booked = conn.execute("SELECT booked FROM slot_counts").fetchone()[0]
+        assert booked == database.SLOT_CAPACITY - 1
+
+        conn.execute("UPDATE slot_counts SET booked = 0")
+        assert database.rebuild_slot_counts(conn) == 1
+        booked = conn.execute("SELECT booked FROM slot_counts").fetchone()[0]
+        assert booked == database.SLOT_CAPACITY - 1
+
+
+def test_customer_aggregates_follow_bookings(tmp_db):
+    from app import booking_events, customers
+    from app.reservations import reserve_slot, release_slot
+
+    ids = []
+    for date, slot in (("2031-09-02", "12:00 PM"), ("2031-09-09", "6:00 PM"),
+                       ("2031-09-16", "6:00 PM")):
+        booking = {"name": "Agg", "email": "agg@example.com",
+                   "date": date, "time_slot": slot}
+        with database.week_db(date) as conn:
+            booking_id, _ = reserve_slot(conn, booking)
+        booking_events.booking_created(dict(booking, id=booking_id))
+        ids.append((date, booking_id))
+
+    page, total = customers.list_customers(10)
+    assert total == 1
+    assert page[0]["total_bookings"] == 3
+    assert page[0]["favorite_time_slots"][0] == "6:00 PM"
+    assert page[0]["customer_tier"] == "Regular"
+
+    date, booking_id = ids[-1]
+    with database.week_db(date) as conn:
+        deleted, _ = release_slot(conn, booking_id)
+    booking_events.booking_cancelled(dict(deleted))
+    page, _ = customers.list_customers(10)
+    assert page[0]["total_bookings"] == 2
+    assert page[0]["last_booking_date"] == "2031-09-09"
+
+    assert customers.rebuild_customers() == 1
+    assert customers.list_customers(10)[0] == page
+    assert customers.list_customers(None)[0] == page
+
+
+def test_customer_histories_read_in_chunks(tmp_db, monkeypatch):
+    from app import booking_events, routes
+    from app.email_index import shards_for_emails
+    from app.reservations import reserve_slot
+
+    for email, date in (("a@example.com", "2031-10-07"), ("a@example.com", "2031-10-14"),
+                        ("b@example.com", "2031-10-14"), ("c@example.com", "2031-10-21")):
+        booking = {"name": "H", "email": email, "date": date, "time_slot": "3:00 PM"}
+        with database.week_db(date) as conn:
+            booking["id"] = reserve_slot(conn, booking)[0]
+        booking_events.booking_created(booking)
+
+    # Only the shards the email index names for a chunk are queried
+    assert [os.path.basename(p) for p in shards_for_emails(["b@example.com", "c@example.com"])] == [
+        "bookings_2031-42.db", "bookings_2031-43.db"
+    ]
+    monkeypatch.setattr(routes, "HISTORY_CHUNK", 2)
+    histories = routes._booking_histories(
+        ["a@example.com", "b@example.com", "c@example.com", "none@example.com"]
+    )
+    assert {email: [h["date"] for h in rows] for email, rows in histories.items()} == {
+        "a@example.com": ["2031-10-14", "2031-10-07"],
+        "b@example.com": ["2031-10-14"],
+        "c@example.com": ["2031-10-21"],
+        "none@example.com": [],
+    }
+
+
+def test_customer_rollups_and_compaction(tmp_db):
+    from datetime import date, timedelta
+    from app import customer_analytics, customers
+
+    today = customer_analytics._today()
+    old = (today - timedelta(days=customer_analytics.ROLLUP_DAILY_RETENTION_DAYS + 40)).isoformat()
+    recent = (today - timedelta(days=10)).isoformat()
+    bookings = [
+        {"email": "a@example.com", "date": old, "time_slot": "12:00 PM", "created_at": old + "T10:00:00"},
+        {"email": "a@example.com", "date": recent, "time_slot": "12:00 PM", "created_at": recent + "T10:00:00"},
+        {"email": "b@example.com", "date": recent, "time_slot": "3:00 PM", "created_at": recent + "T11:00:00"},
+    ]
+    for booking in bookings:
+        customers.record_booking(booking)
+        customer_analytics.record_booking(booking)
+
+    stats = customer_analytics.customer_analytics(recent, today.isoformat())
+    assert stats["total_customers"] == 2
+    assert stats["customer_tiers"]["Regular"] == 1
+    assert stats["window"]["bookings"] == 2
+    assert stats["window"]["new_customers"] == 1
+    assert stats["retention_rate_90d"] == 50.0
+
+    assert customer_analytics.compact_rollups() == 1
+    with database.get_db() as conn:
+        window = customer_analytics.window_stats(conn, old, old)
+    assert window["granularity"] == "month"
+    assert window["bookings"] == 1
+
+
+def test_kpi_counters_and_stale_while_revalidate(tmp_db):
+    import time
+    from datetime import datetime
+    from app import kpis
+    from app.reservations import reserve_slot
+
+    today = datetime.now().strftime("%Y-%m-%d")
+    booking = {"name": "Kpi", "email": "kpi@example.com",
+               "date": today, "time_slot": "12:00 PM"}
+    with database.week_db(today) as conn:
+        reserve_slot(conn, dict(booking))
+    kpis.record_booking(booking)
+    with database.get_db() as conn:
+        conn.execute(
+            "INSERT INTO waitlist (name, phone, email, preferred_date, preferred_time) "
+            "VALUES ('w', '1', 'w@example.com', ?, '3:00 PM')", (today,)
+        )
+    expected = {"total": 1, "week": 1, "month": 1, "waitlist": 1}
+    assert kpis.read_kpis() == expected
+    assert kpis.rebuild_kpi_counters()["total"] == 1
+    assert kpis.read_kpis() == expected
+
+    calls = []
+    cache = kpis.StaleWhileRevalidate(lambda: calls.append(1) or len(calls),
+                                      fresh=60, stale=120)
+    assert cache.get() == 1 and cache.get() == 1
+    cache.mark_stale()
+    assert cache.get() == 1  # stale value served while refreshing
+    for _ in range(100):
+        if cache.stats()["loads"] == 2:
+            break
+        time.sleep(0.01)
+    assert cache.get() == 2
+
+
+def test_email_index_routes_customer_lookups(tmp_db):
+    from app import booking_events, email_index
+    from app.reservations import reserve_slot
+    from app.utils import get_latest_user_info
+
+    for date, city in (("2031-10-07", "Old Town"), ("2031-11-04", "New Town")):
+        booking = {"name": "Idx", "email": "idx@example.com", "city": city,
+                   "date": date, "time_slot": "12:00 PM"}
+        with database.week_db(date) as conn:
+            booking_id, _ = reserve_slot(conn, booking)
+        booking_events.booking_created(dict(booking, id=booking_id))
+    # A shard without this customer is never touched
+    with database.week_db("2031-12-02") as conn:
+        reserve_slot(conn, {"name": "Other", "email": "other@example.com",
+                            "date": "2031-12-02", "time_slot": "12:00 PM"})
+
+    assert email_index.shards_for_email("idx@example.com") == [
+        database.week_db_path("2031-10-07"), database.week_db_path("2031-11-04")
+    ]
+    assert get_latest_user_info("idx@example.com")[1] == "New Town"
+    assert get_latest_user_info("nobody@example.com") == ("", "", "", "")
+    assert email_index.rebuild_email_index() == 3
+    assert len(email_index.shards_for_email("idx@example.com")) == 2
+
+
+def test_iter_bookings_keyset_order(tmp_db):
+    from datetime import date as dt_date
+    from app import shards
+    from app.reservations import reserve_slot
+
+    for date in ("2032-02-10", "2032-01-06", "2032-01-07"):
+        for slot in ("6:00 PM", "12:00 PM"):
+            with database.week_db(date) as conn:
+                reserve_slot(conn, {"name": "S", "email": "s@example.com",
+                                    "date": date, "time_slot": slot})
+    rows = list(shards.iter_bookings(batch_size=1))
+    keys = [(r["date"], r["time_slot"], r["id"]) for r in rows]
+    assert keys == sorted(keys) and len(keys) == 6
+    after = list(shards.iter_bookings(keys[2]))
+    assert [(r["date"], r["time_slot"], r["id"]) for r in after] == keys[3:]
+    assert shards.shards_for_range("2032-01-08", dt_date.max) == [
+        database.week_db_path("2032-01-06"), database.week_db_path("2032-02-10")
+    ]
+    assert len(list(shards.iter_bookings(start="2032-02-01"))) == 2
+
+
+def test_shard_query_errors_are_not_hidden(tmp_db):
+    import sqlite3
+    import pytest
+    from app import shards
+    from app.reservations import reserve_slot
+
+    with database.week_db("2032-06-01") as conn:
+        reserve_slot(conn, {"name": "E", "email": "e@example.com",
+                            "date": "2032-06-01", "time_slot": "3:00 PM"})
+    assert shards.count_shards("SELECT COUNT(*) FROM bookings") == 1
+    # A shard that cannot answer fails the query instead of counting as empty
+    with pytest.raises(sqlite3.OperationalError):
+        shards.query_shards("SELECT missing_column FROM bookings")
+
+
+def test_activity_log_keyset_pages(tmp_db):
+    from app.pagination import CountCache, decode_cursor, keyset_page
+
+    with database.get_db() as conn:
+        conn.executemany(
+            "INSERT INTO activity_logs (username, action_type, entity_type, description, timestamp) "
+            "VALUES ('a', ?, 'booking', 'd', ?)",
+            [("create" if i % 2 else "cancel", f"2031-01-01T00:00:{i // 2:02d}")
+             for i in range(9)]
+        )
+        plan = " ".join(row[3] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM activity_logs WHERE action_type = ? "
+            "ORDER BY timestamp DESC, id DESC", ("create",)
+        ))
+        assert "idx_activity_logs_action_timestamp" in plan
+
+        seen, before = [], None
+        while True:
+            logs, cursor = keyset_page(conn, "SELECT * FROM activity_logs", [], [],
+                                       before, 4)
+            seen += [log["id"] for log in logs]
+            if not cursor:
+                break
+            before = decode_cursor(cursor, 2)
+        assert seen == sorted(seen, reverse=True) and len(seen) == 9
+
+        cache = CountCache(ttl=60)
+        sql = "SELECT COUNT(*) FROM activity_logs WHERE action_type = ?"
+        assert cache.count(conn, sql, ["create"]) == 4
+        conn.execute("DELETE FROM activity_logs")
+        assert cache.count(conn, sql, ["create"]) == 4
+
+
+def test_newsletter_trigram_search(tmp_db):
+    from app.newsletter_search import search_recipients, substring_filter
+    from app.utils import upsert_newsletter_entry
+
+    for name, city in (("Alice Nguyen", "San Jose"), ("Bob Stone", "Sacramento"),
+                       ("Carla Jones", "San Jose")):
+        upsert_newsletter_entry({"name": name, "city": city,
+                                 "email": f"{name.split()[0].lower()}@example.com"}, "test")
+    upsert_newsletter_entry({"name": "Bob Stone", "city": "Fresno",
+                             "email": "bob@example.com"}, "test")
+    with database.get_db() as conn:
+        found = search_recipients(conn, "jose", field="city")
+        assert found["mode"] == "exact" and found["total"] == 2
+        assert search_recipients(conn, "fresno")["results"][0]["name"] == "Bob Stone"
+        assert search_recipients(conn, "sacramento")["total"] == 0
+        typo = search_recipients(conn, "nguyem")
+        assert typo["mode"] == "fuzzy" and typo["results"][0]["name"] == "Alice Nguyen"
+        page = search_recipients(conn, "example", limit=2, offset=2)
+        assert page["total"] == 3 and len(page["results"]) == 1
+        condition, params = substring_filter("city", "SAN J")
+        assert conn.execute(
+            f"SELECT COUNT(*) FROM company_newsletter WHERE {condition}", params
+        ).fetchone()[0] == 2
+
+
+def test_streaming_csv_export(tmp_db, monkeypatch):
+    import csv
+    import gzip
+    import io
+    from app import exports
+    from app.reservations import reserve_slot
+    from app.utils import upsert_newsletter_entry
+
+    monkeypatch.setattr(exports, "EXPORT_CHUNK_BYTES", 64)
+    for i in range(20):
+        upsert_newsletter_entry({"name": f"N{i}", "email": f"n{i}@example.com",
+                                 "city": "San Jose" if i % 2 else "Fresno"}, "test")
+    columns = exports.select_columns("email,city", exports.NEWSLETTER_COLUMNS)
+    chunks = list(exports.export_stream(
+        columns, exports.iter_newsletter(columns, city="jose")
+    ))
+    assert len(chunks) > 1
+    rows = list(csv.reader(io.StringIO(b"".join(chunks).decode())))
+    assert rows[0] == ["email", "city"] and len(rows) == 11
+
+    for date in ("2032-03-02", "2032-04-06"):
+        with database.week_db(date) as conn:
+            reserve_slot(conn, {"name": "E", "email": "e@example.com",
+                                "date": date, "time_slot": "12:00 PM"})
+    columns = exports.select_columns("date,email", exports.BOOKING_COLUMNS)
+    data = gzip.decompress(b"".join(exports.export_stream(
+        columns, exports.iter_booking_export(columns, start="2032-04-01"), compress=True
+    ))).decode()
+    assert data.splitlines() == ["date,email", "2032-04-06,e@example.com"]
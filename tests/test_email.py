@@ -0,0 +1,127 @@
+def test_newsletter_campaign_reuses_smtp_sessions(tmp_db):
+    import smtplib
+    from app.email_utils import SMTPTransport
+    from app.newsletter_delivery import (
+        NewsletterSender, RateLimiter, campaign_progress, create_campaign
+    )
+    from app.utils import upsert_newsletter_entry
+
+    class SinkSession:
+        opened = []
+
+        def __init__(self):
+            self.received = []
+            SinkSession.opened.append(self)
+
+        def send_message(self, msg):
+            if msg["To"] == "bounce@example.com":
+                raise smtplib.SMTPRecipientsRefused({msg["To"]: (550, b"no such user")})
+            self.received.append(msg)
+
+        def quit(self):
+            pass
+
+    for i in range(12):
+        upsert_newsletter_entry({"name": f"N{i}", "email": f"n{i}@example.com",
+                                 "city": "San Jose" if i % 3 else "Fresno"}, "test")
+    upsert_newsletter_entry({"name": "B", "email": "bounce@example.com",
+                             "city": "San Jose"}, "test")
+    campaign = create_campaign("Hi", "Hello from the grill", "jose", "admin")
+    assert campaign["total"] == 9
+
+    sender = NewsletterSender(SMTPTransport(SinkSession, size=2), concurrency=2,
+                              rate_per_minute=0, batch_size=3)
+    sender.run(campaign["id"])
+    progress = campaign_progress(campaign["id"])
+    assert progress["status"] == "completed"
+    assert (progress["sent"], progress["failed"], progress["pending"]) == (8, 1, 0)
+    assert sum(len(s.received) for s in SinkSession.opened) == 8
+    # One replacement session at most, not one session per message
+    assert len(SinkSession.opened) <= 3
+
+    clock, sleeps = [0.0], []
+    limiter = RateLimiter(2, clock=lambda: clock[0],
+                          sleep=lambda s: (sleeps.append(s), clock.__setitem__(0, clock[0] + s)))
+    for _ in range(3):
+        limiter.acquire()
+    assert sleeps == [60.0]
+
+
+def test_smtp_transport_reuses_checks_and_recycles_sessions():
+    import smtplib
+    from app.email_utils import SinkTransport, SMTPTransport
+
+    class Session:
+        opened = []
+
+        def __init__(self):
+            self.sent, self.noops, self.alive = 0, 0, True
+            Session.opened.append(self)
+
+        def send_message(self, msg):
+            if not self.alive:
+                raise smtplib.SMTPServerDisconnected("gone")
+            self.sent += 1
+
+        def noop(self):
+            self.noops += 1
+            return (250, b"OK") if self.alive else (421, b"closing")
+
+        def quit(self):
+            pass
+
+    transport = SMTPTransport(Session, size=2, max_age=3600, noop_after=3600)
+    for _ in range(5):
+        transport.send("msg")
+    assert len(Session.opened) == 1 and Session.opened[0].sent == 5
+
+    # A session the server dropped is replaced and the send retried
+    Session.opened[0].alive = False
+    transport.send("msg")
+    assert len(Session.opened) == 2 and Session.opened[1].sent == 1
+
+    # Idle sessions are NOOP-checked; dead ones are recycled before use
+    transport.noop_after = 0
+    Session.opened[1].alive = False
+    transport.send("msg")
+    assert Session.opened[1].noops == 1 and Session.opened[2].sent == 1
+    transport.max_age = 0
+    transport.send("msg")
+    stats = transport.stats()
+    assert len(Session.opened) == 4 and stats["recycled"] == 3
+    assert stats["sent"] == 8 and stats["failed"] == 0 and stats["health_checks"] == 1
+
+    sink = SinkTransport()
+    sink.send("msg")
+    assert list(sink.messages) == ["msg"] and sink.stats()["sent"] == 1
+
+
+def test_newsletter_campaign_sent_by_one_worker(tmp_db):
+    from app import database
+    from app.email_utils import SinkTransport
+    from app.newsletter_delivery import (
+        NewsletterSender, campaign_progress, claim_campaign, create_campaign
+    )
+    from app.utils import upsert_newsletter_entry
+
+    for i in range(4):
+        upsert_newsletter_entry({"name": f"W{i}", "email": f"w{i}@example.com",
+                                 "city": "Oakland"}, "test")
+    campaign_id = create_campaign("Hi", "Hello", None, "admin")["id"]
+
+    # Another worker resumed it first: this one sends nothing
+    assert claim_campaign(campaign_id, owner="worker-a")
+    transport = SinkTransport()
+    sender = NewsletterSender(transport, rate_per_minute=0, owner="worker-b")
+    sender.run(campaign_id)
+    assert len(transport.messages) == 0
+    assert campaign_progress(campaign_id)["status"] == "running"
+
+    # Once worker-a's lease lapses the campaign is taken over and finished
+    with database.get_db() as conn:
+        conn.execute("UPDATE newsletter_campaigns SET lease_until = 0 WHERE id = ?", (campaign_id,))
+    sender.run(campaign_id)
+    progress = campaign_progress(campaign_id)
+    assert (progress["status"], progress["owner"], progress["sent"]) == ("completed", "worker-b", 4)
+    assert len(transport.messages) == 4
+    assert not claim_campaign(campaign_id, owner="worker-a")
@@ -0,0 +1,153 @@
+from app import database
+
+
+def test_email_outbox_retries_and_dead_letters(tmp_db, monkeypatch):
+    from app import email_utils, outbox
+
+    sent, failures = [], {"count": 1}
+
+    def flaky_confirmation(booking):
+        if failures["count"]:
+            failures["count"] -= 1
+            raise ConnectionError("smtp down")
+        sent.append(booking.email)
+
+    monkeypatch.setattr(email_utils, "send_customer_confirmation", flaky_confirmation)
+    monkeypatch.setattr(email_utils, "send_waitlist_slot_opened",
+                        lambda user: (_ for _ in ()).throw(RuntimeError("bounced")))
+    booking = {"id": 7, "name": "A", "email": "a@example.com", "date": "2032-01-05"}
+    assert outbox.enqueue("customer_confirmation", {"booking": booking}, dedupe_key="b7")
+    assert not outbox.enqueue("customer_confirmation", {"booking": booking}, dedupe_key="b7")
+    with database.get_db() as conn:
+        conn.execute("""INSERT INTO waitlist (name, phone, email, preferred_date, preferred_time)
+                        VALUES ('W', '555', 'w@example.com', '2032-01-05', '12:00 PM')""")
+        assert outbox.enqueue_waitlist_slot_opened(conn, "2032-01-05", "12:00 PM") == 1
+
+    worker = outbox.OutboxWorker(workers=1, max_attempts=2)
+    assert worker.drain_once() == 2
+    assert sent == [] and worker.retried == 2
+    with database.get_db() as conn:
+        # Make the backed-off retries due now
+        conn.execute("UPDATE email_outbox SET next_attempt_at = 0 WHERE status = 'pending'")
+    assert worker.drain_once() == 2
+    assert sent == ["a@example.com"]
+    stats = worker.stats()
+    assert (stats["sent"], stats["dead"], stats["pending"], stats["dead_letters"]) == (1, 1, 0, 1)
+    dead = outbox.dead_letters()
+    assert dead[0]["payload"]["waitlist"]["email"] == "w@example.com"
+    assert outbox.requeue(dead[0]["id"]) and worker.stats()["pending"] == 1
+    assert outbox.backoff_seconds(3) == 4 * outbox.EMAIL_OUTBOX_BACKOFF_SECONDS
+
+
+def test_staged_emails_survive_a_crash_before_relay(tmp_db):
+    from app import outbox
+    from app.reservations import release_slot, reserve_slot
+
+    with database.get_db() as conn:
+        conn.execute("""INSERT INTO waitlist (name, phone, email, preferred_date, preferred_time)
+                        VALUES ('W', '555', 'w@example.com', '2032-02-03', '6:00 PM')""")
+
+    def stage(kind):
+        return lambda conn, booking: outbox.stage(
+            conn, kind, {"booking": booking, "date": booking["date"],
+                         "time_slot": booking["time_slot"]},
+            f"booking:{booking['id']}:{kind}"
+        )
+
+    booking = {"name": "S", "email": "s@example.com", "date": "2032-02-03", "time_slot": "6:00 PM"}
+    with database.week_db(booking["date"]) as conn:
+        booking_id, _ = reserve_slot(conn, booking, stage("customer_confirmation"))
+        # Nothing is staged if the transaction rolls back
+        try:
+            reserve_slot(conn, dict(booking), lambda conn, b: 1 / 0)
+        except ZeroDivisionError:
+            pass
+        release_slot(conn, booking_id, stage(outbox.SLOT_OPENED))
+
+    # The process died before relaying: the periodic job picks the rows up
+    assert outbox.relay_all() == 2
+    assert outbox.relay_all() == 0
+    with database.get_db() as conn:
+        kinds = sorted(row[0] for row in conn.execute("SELECT kind FROM email_outbox"))
+    assert kinds == ["customer_confirmation", "waitlist_slot_opened"]
+
+    # Relaying a row again after the outbox committed queues nothing twice
+    with database.week_db(booking["date"]) as conn:
+        outbox.stage(conn, "customer_confirmation", {"booking": booking},
+                     f"booking:{booking_id}:customer_confirmation")
+    assert outbox.relay(database.week_db_path(booking["date"])) == 0
+
+
+def test_deposit_sweeper_queues_due_reminders_once(tmp_db):
+    from datetime import datetime, timedelta, timezone
+    from app import deposit_tasks
+    from app.reservations import reserve_slot
+
+    # Booked late on the Sunday of the event's week: both deadlines fall
+    # after that week's shard is in the past
+    booked_at = datetime(2032, 3, 7, 20, tzinfo=timezone.utc)
+    ids = []
+    for email in ("paid@example.com", "late@example.com"):
+        booking = {"name": "D", "email": email, "date": "2032-03-07", "time_slot": "12:00 PM"}
+        booking.update(deposit_tasks.deposit_deadlines(booked_at))
+        with database.week_db("2032-03-07") as conn:
+            ids.append(reserve_slot(conn, booking)[0])
+        deposit_tasks.record_booking(booking)
+    with database.week_db("2032-03-07") as conn:
+        conn.execute("UPDATE bookings SET deposit_received = 1 WHERE id = ?", (ids[0],))
+        plan = " ".join(str(row[-1]) for row in conn.execute("""
+            EXPLAIN QUERY PLAN SELECT * FROM bookings
+            WHERE deposit_received = 0 AND reminder_due_at IS NOT NULL AND reminder_due_at <= ?
+        """, ("2032-03-01 17:00:00",)))
+    assert "idx_bookings_reminder_due" in plan
+
+    def tracked():
+        with database.get_db() as conn:
+            return [tuple(row) for row in conn.execute("SELECT shard, next_due_at FROM deposit_shards")]
+
+    assert tracked() == [(203210, "2032-03-08 00:00:00")]
+    sweep = deposit_tasks.sweep_deposit_deadlines
+    assert sweep(booked_at + timedelta(hours=1)) == {"deposit_reminder": 0, "deposit_missing": 0}
+    assert sweep(booked_at + timedelta(hours=5)) == {"deposit_reminder": 1, "deposit_missing": 0}
+    # The paid booking's reminder is skipped; the shard waits for the admin notice
+    assert tracked() == [(203210, "2032-03-08 02:00:00")]
+    assert sweep(booked_at + timedelta(hours=7)) == {"deposit_reminder": 0, "deposit_missing": 1}
+    assert tracked() == []
+    # Nothing tracked: no shard is opened, and a startup rebuild finds nothing
+    assert sweep(booked_at + timedelta(days=30)) == {"deposit_reminder": 0, "deposit_missing": 0}
+    assert deposit_tasks.rebuild_deposit_shards() == 0
+    with database.get_db() as conn:
+        queued = conn.execute("SELECT kind, dedupe_key FROM email_outbox ORDER BY id").fetchall()
+    assert [tuple(row) for row in queued] == [
+        ("deposit_reminder", f"booking:{ids[1]}:deposit_reminder"),
+        ("deposit_missing", f"booking:{ids[1]}:deposit_missing"),
+    ]
+    assert deposit_tasks.sweeper_stats()["sweeps"] >= 3
+
+
+def test_deposit_shards_rebuilt_from_shards(tmp_db):
+    from datetime import datetime, timezone
+    from app import deposit_tasks
+    from app.reservations import reserve_slot
+
+    # A booking whose record_booking never ran (the process died after commit)
+    booking = {"name": "R", "email": "r@example.com", "date": "2032-05-04", "time_slot": "3:00 PM"}
+    booking.update(deposit_tasks.deposit_deadlines(datetime(2032, 5, 1, tzinfo=timezone.utc)))
+    with database.week_db("2032-05-04") as conn:
+        reserve_slot(conn, booking)
+    assert deposit_tasks.rebuild_deposit_shards() == 1
+    with database.get_db() as conn:
+        row = conn.execute("SELECT shard, next_due_at FROM deposit_shards").fetchone()
+    assert tuple(row) == (203219, "2032-05-01 04:00:00")
+
+
+def test_job_lease_held_by_one_owner(tmp_db):
+    from app import leases
+
+    assert leases.acquire("job", 60, owner="a")
+    assert not leases.acquire("job", 60, owner="b")
+    # The holder renews; after a release (or expiry) another owner takes over
+    assert leases.acquire("job", 60, owner="a")
+    leases.release("job", owner="a")
+    assert leases.acquire("job", 60, owner="b")
+    assert not leases.acquire("job", 60, owner="a")
@@ -10,6 +10,12 @@ from main import app
 
 client = TestClient(app)
 
+@pytest.fixture(autouse=True)
+def isolated(tmp_db):
+    from app.routes import limiter
+    limiter.reset()
+    return tmp_db
+
 @pytest.fixture(autouse=True)
 def patch_send_email(monkeypatch):
     from app import email_utils